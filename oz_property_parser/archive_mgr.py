@@ -2,41 +2,348 @@
 
 """Module to manage archives."""
 
+import bz2
+import concurrent.futures
+import gzip
+import io
 import logging
+import lzma
 import os
+import shutil
+import tarfile
+import threading
 import zipfile
+import zlib
+
+from typing import (IO, Callable, Iterator, List, NamedTuple, Optional, Set,
+                    Tuple, TypeVar)
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+MemberResult = TypeVar('MemberResult')
+
+# Errors reading corrupt or truncated compressed data
+_DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error, lzma.LZMAError,
+                         zipfile.BadZipFile)
+
 
 class ExtractionError(Exception):
     """Generic exception to indicate exception failes."""
 
 
+class ArchiveMember(NamedTuple):
+    """File streamed from an (optionally nested) archive.
+
+    Reading a corrupt member raises ExtractionError.
+    """
+
+    # Archive path joined with the member names, e.g. "a.zip/b.tar/c.DAT"
+    path: str
+    file_obj: IO[bytes]
+
+
+class _MemberReader(io.RawIOBase):
+    """Reader of a streamed member, raising ExtractionError if corrupt."""
+
+    def __init__(self, path: str, file_obj: Optional[IO[bytes]],
+                 error: Optional[Exception] = None) -> None:
+        """Initialize the reader of the file object, or of a failed member.
+
+        Members that failed decompressing raise the error when read.
+        """
+        super().__init__()
+        self._path = path
+        self._file_obj = file_obj
+        self._error = error
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._file_obj is None:
+            raise _member_error(self._path, self._error)
+        try:
+            data = self._file_obj.read(len(buffer))
+        except _DECOMPRESSION_ERRORS as error:
+            raise _member_error(self._path, error)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _member_error(path: str, error: Optional[Exception]) -> ExtractionError:
+    """Create the error of a member failing decompression."""
+    return ExtractionError(F'Failed to decompress "{path}" with error '
+                           F'"{error}"')
+
+
+def _guarded_member(path: str, file_obj: IO[bytes]) -> IO[bytes]:
+    """Wrap a streamed member to raise ExtractionError if corrupt."""
+    return io.BufferedReader(_MemberReader(path, file_obj))
+
+
 def _unzip(file_path: str, dest_dir: str) -> None:
     """Unzip the given file to the given dir."""
     try:
         with zipfile.ZipFile(file_path, 'r') as zip_ref:
             zip_ref.extractall(dest_dir)
-    except (ValueError, zipfile.BadZipFile) as error:
+    except (ValueError,) + _DECOMPRESSION_ERRORS as error:
+        raise ExtractionError(F'Failed to unzip Archive with error "{error}"')
+
+
+class _ZipHandles():
+    """Zip file handles per thread, a ZipFile cannot be shared."""
+
+    def __init__(self, file_path: str) -> None:
+        """Initialize the handles for the given zip file."""
+        self._file_path = file_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._handles: List[zipfile.ZipFile] = []
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close all handles opened by the threads."""
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+
+    def get(self) -> zipfile.ZipFile:
+        """Get the zip file handle of the calling thread."""
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = zipfile.ZipFile(self._file_path, 'r')
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        return handle
+
+
+def _map_zip_members(file_path: str,
+                     member_func: Callable[[zipfile.ZipFile, zipfile.ZipInfo],
+                                           MemberResult],
+                     max_workers: Optional[int] = None
+                     ) -> Iterator[MemberResult]:
+    """Run member_func for all zip file members on a thread pool.
+
+    Results are yielded as the members complete. zlib releases the GIL, so
+    decompression scales with the workers. To bound the memory at most twice
+    the number of workers members are in flight.
+    """
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.is_dir()]
+    except (OSError, ValueError, zipfile.BadZipFile) as error:
+        raise ExtractionError(F'Failed to unzip Archive with error "{error}"')
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with _ZipHandles(file_path) as handles, \
+            concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+
+        def run_member(info: zipfile.ZipInfo) -> MemberResult:
+            return member_func(handles.get(), info)
+
+        window = 2 * max_workers
+        pending: Set['concurrent.futures.Future[MemberResult]'] = set()
+        info_iter = iter(infos)
+        try:
+            while True:
+                for info in info_iter:
+                    pending.add(executor.submit(run_member, info))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        except (ValueError,) + _DECOMPRESSION_ERRORS as error:
+            raise ExtractionError(
+                F'Failed to unzip Archive with error "{error}"')
+        finally:
+            # Don't decompress any further if the consumer stopped early
+            for future in pending:
+                future.cancel()
+
+
+def _zip_member_dir(dest_dir: str, info: zipfile.ZipInfo) -> str:
+    """Get the directory a zip member is extracted to, like ZipFile."""
+    parts = [part for part in info.filename.split('/')
+             if part not in ('', os.curdir, os.pardir)]
+    if not info.is_dir():
+        parts = parts[:-1]
+    return os.path.join(dest_dir, *parts)
+
+
+def unzip_parallel(file_path: str, dest_dir: str,
+                   max_workers: Optional[int] = None) -> Iterator[str]:
+    """Extract the zip file members on a thread pool.
+
+    The paths of the extracted members are yielded as they complete.
+    """
+    # Create the directories upfront, the threads would race creating them
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            member_dirs = {_zip_member_dir(dest_dir, info)
+                           for info in zip_ref.infolist()}
+    except (OSError, ValueError, zipfile.BadZipFile) as error:
+        raise ExtractionError(F'Failed to unzip Archive with error "{error}"')
+    for member_dir in member_dirs:
+        os.makedirs(member_dir, exist_ok=True)
+
+    yield from _map_zip_members(
+        file_path, lambda zip_ref, info: zip_ref.extract(info, dest_dir),
+        max_workers)
+
+
+def _untar(file_path: str, dest_dir: str) -> None:
+    """Untar the given (optionally compressed) file to the given dir."""
+    try:
+        with tarfile.open(file_path, 'r:*') as tar_ref:
+            if hasattr(tarfile, 'data_filter'):
+                tar_ref.extractall(dest_dir, filter='data')
+            else:
+                for member in tar_ref.getmembers():
+                    if not _member_path_is_safe(member.name):
+                        raise ExtractionError(
+                            F'Unsafe member path "{member.name}"')
+                tar_ref.extractall(dest_dir)  # nosec
+    except (tarfile.TarError,) + _DECOMPRESSION_ERRORS as error:
+        raise ExtractionError(F'Failed to untar Archive with error "{error}"')
+
+
+def _decompress(file_path: str, dest_dir: str) -> None:
+    """Decompress the given single file archive to the given dir.
+
+    The file is only created once decompressed completely, truncated
+    archives leave nothing behind.
+    """
+    file_name = os.path.basename(file_path)
+    open_func = _COMPRESSED_FILE_OPENERS[_get_archive_extension(file_name)]
+    dest_path = os.path.join(dest_dir, _strip_extension(file_name))
+    # Not a property file name, even if a crash leaves it behind
+    temp_path = os.path.join(dest_dir, '.' + file_name + '.part')
+    try:
+        os.makedirs(dest_dir, exist_ok=True)
+        with open_func(file_path) as source_file:
+            with open(temp_path, 'wb') as dest_file:
+                shutil.copyfileobj(source_file, dest_file)
+        os.replace(temp_path, dest_path)
+    except _DECOMPRESSION_ERRORS as error:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise ExtractionError(
+            F'Failed to decompress Archive with error "{error}"')
+
+
+def _stream_zip(file_obj: IO[bytes],
+                _: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Stream the members of the given zip file."""
+    try:
+        with zipfile.ZipFile(file_obj, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if not info.is_dir():
+                    with zip_ref.open(info) as member:
+                        yield info.filename, member
+    except (ValueError,) + _DECOMPRESSION_ERRORS as error:
         raise ExtractionError(F'Failed to unzip Archive with error "{error}"')
 
 
+def _stream_tar(file_obj: IO[bytes],
+                _: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Stream the members of the given (optionally compressed) tar file."""
+    try:
+        with tarfile.open(fileobj=file_obj, mode='r|*') as tar_ref:
+            for info in tar_ref:
+                member = tar_ref.extractfile(info) if info.isfile() else None
+                if member is not None:
+                    yield info.name, member
+    except (tarfile.TarError,) + _DECOMPRESSION_ERRORS as error:
+        raise ExtractionError(F'Failed to untar Archive with error "{error}"')
+
+
+def _stream_compressed(file_obj: IO[bytes],
+                       file_name: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Stream the single member of the given compressed file."""
+    open_func = _COMPRESSED_FILE_OPENERS[_get_archive_extension(file_name)]
+    try:
+        with open_func(file_obj) as member:
+            yield _strip_extension(file_name), member
+    except _DECOMPRESSION_ERRORS as error:
+        raise ExtractionError(
+            F'Failed to decompress Archive with error "{error}"')
+
+
+_COMPRESSED_FILE_OPENERS = {
+    'gz': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
 _ZIP_FILE_MAPPING = {
-    # Extension: (Zip, Unzip)
-    'zip': (None, _unzip)
+    # Extension: (Zip, Unzip, Stream)
+    'zip': (None, _unzip, _stream_zip),
+    'tar': (None, _untar, _stream_tar),
+    'tar.gz': (None, _untar, _stream_tar),
+    'tgz': (None, _untar, _stream_tar),
+    'tar.bz2': (None, _untar, _stream_tar),
+    'tbz2': (None, _untar, _stream_tar),
+    'tar.xz': (None, _untar, _stream_tar),
+    'txz': (None, _untar, _stream_tar),
+    'gz': (None, _decompress, _stream_compressed),
+    'bz2': (None, _decompress, _stream_compressed),
+    'xz': (None, _decompress, _stream_compressed),
 }
 
+# Longest extensions first, so "tar.gz" is preferred over "gz"
+_ARCHIVE_EXTENSIONS = sorted(_ZIP_FILE_MAPPING.keys(), key=len, reverse=True)
+
+
+def _get_archive_extension(file_path: str) -> str:
+    """Get the (compound) archive extension of the file, '' if none."""
+    file_path = file_path.lower()
+    for ext in _ARCHIVE_EXTENSIONS:
+        if file_path.endswith(os.extsep + ext):
+            return ext
+    return ''
+
+
+def _strip_extension(file_name: str) -> str:
+    """Remove the archive extension from the given file name."""
+    ext = _get_archive_extension(file_name)
+    return file_name[:-len(os.extsep + ext)] if ext else file_name
+
+
+def _member_path_is_safe(member_path: str) -> bool:
+    """Check the archive member stays inside the extraction directory."""
+    normalised = os.path.normpath(member_path.replace('\\', '/'))
+    return not (os.path.isabs(normalised) or
+                normalised.split(os.sep)[0] == os.pardir)
+
 
 def file_is_archive(file_path: str) -> bool:
     """Check if the file is a supported archive file."""
-    ext = file_path.split(os.extsep)[-1]
-    return ext.lower() in _ZIP_FILE_MAPPING.keys()
+    return _get_archive_extension(file_path) in _ZIP_FILE_MAPPING.keys()
+
 
+def extract(file_path: str, dest_dir: str,
+            max_workers: Optional[int] = None) -> None:
+    """Extract the given file to the given dir.
 
-def extract(file_path: str, dest_dir: str) -> None:
-    """Extract the given file to the given dir."""
-    ext = file_path.split(os.extsep)[-1].lower()
+    Zip files are extracted on a thread pool with max_workers if given.
+    This returns once all members are extracted, use unzip_parallel() or
+    iter_archive_members_parallel() to process members as they complete.
+    """
+    ext = _get_archive_extension(file_path)
+    if max_workers is not None and ext == 'zip':
+        for _ in unzip_parallel(file_path, dest_dir, max_workers):
+            pass
+        return
     try:
         archive_tuple = _ZIP_FILE_MAPPING[ext]
     except KeyError:
@@ -49,6 +356,99 @@ def extract(file_path: str, dest_dir: str) -> None:
             raise NotImplementedError('Extract for "{ext}" not implemented')
 
 
+def iter_archive_members(file_path: str) -> Iterator[ArchiveMember]:
+    """Stream the files of the given archive without extracting to disk.
+
+    Nested archives are streamed recursively. Each member has to be consumed
+    before advancing the iterator, streamed archives cannot seek back.
+    """
+    if not file_is_archive(file_path):
+        raise ExtractionError(F'Extraction not supported for "{file_path}"')
+
+    with open(file_path, 'rb') as file_obj:
+        yield from _iter_members(file_path, file_obj)
+
+
+def iter_archive_members_parallel(
+        file_path: str,
+        max_workers: Optional[int] = None) -> Iterator[ArchiveMember]:
+    """Stream the files of the given archive, decompressing zips in parallel.
+
+    Zip members are decompressed into memory on a thread pool, each thread
+    with its own ZipFile handle, and yielded as they complete. Other
+    archives are streamed sequentially.
+    """
+    if _get_archive_extension(file_path) != 'zip':
+        yield from iter_archive_members(file_path)
+        return
+
+    def read_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo):
+        try:
+            return info.filename, zip_ref.read(info), None
+        except _DECOMPRESSION_ERRORS as error:
+            # Only this member fails, the others are still read
+            return info.filename, None, error
+
+    for name, data, error in _map_zip_members(file_path, read_member,
+                                              max_workers):
+        member_path = file_path + '/' + name
+        if data is None:
+            yield ArchiveMember(member_path, io.BufferedReader(
+                _MemberReader(member_path, None, error)))
+        elif file_is_archive(name):
+            logger.debug(F'Streaming nested archive "{member_path}"')
+            yield from _iter_members(member_path, io.BytesIO(data))
+        else:
+            yield ArchiveMember(member_path, io.BytesIO(data))
+
+
+def list_zip_members(file_path: str) -> List[str]:
+    """Get the names of the files in the given zip file."""
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            return [info.filename for info in zip_ref.infolist()
+                    if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile) as error:
+        raise ExtractionError(F'Failed to unzip Archive with error "{error}"')
+
+
+def iter_zip_member(file_path: str, name: str) -> Iterator[ArchiveMember]:
+    """Stream a single member of the given zip file.
+
+    A nested archive is streamed recursively, like iter_archive_members().
+    """
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            data = zip_ref.read(name)
+    except (KeyError,) + _DECOMPRESSION_ERRORS as error:
+        raise ExtractionError(F'Failed to unzip "{name}" with error "{error}"')
+
+    member_path = file_path + '/' + name
+    if file_is_archive(name):
+        yield from _iter_members(member_path, io.BytesIO(data))
+    else:
+        yield ArchiveMember(member_path, io.BytesIO(data))
+
+
+def _iter_members(archive_path: str,
+                  file_obj: IO[bytes]) -> Iterator[ArchiveMember]:
+    """Stream the members of the archive file object recursively."""
+    stream_func = _ZIP_FILE_MAPPING[_get_archive_extension(archive_path)][2]
+    archive_name = archive_path.replace('\\', '/').split('/')[-1]
+    for name, member in stream_func(file_obj, archive_name):
+        member_path = archive_path + '/' + name
+        member = _guarded_member(member_path, member)
+        if file_is_archive(name):
+            logger.debug(F'Streaming nested archive "{member_path}"')
+            if _get_archive_extension(name) == 'zip':
+                # Zip files keep their directory at the end, nested streams
+                # cannot seek (or only by decompressing again)
+                member = io.BytesIO(member.read())
+            yield from _iter_members(member_path, member)
+        else:
+            yield ArchiveMember(member_path, member)
+
+
 def test() -> None:
     """Test function."""
 
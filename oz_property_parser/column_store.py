@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+"""Store the parsed sales as NumPy columns.
+
+A column store is a directory with a "<Column>.npy" file per column and a
+"meta.json" holding the row count. Numbers are stored with native dtypes
+(missing integers as MISSING_INT, missing floats as NaN), dates as
+datetime64[D] day numbers (missing as NaT) and strings as int32 codes into
+the values of "<Column>.dict.json" (missing as MISSING_CODE).
+
+Each run appends to the column files in place, so analyses can memory map
+all rows with load_columns() without a database:
+
+    columns = column_store.load_columns('ParseResult_Properties.npy')
+    prices = columns['Purchase_Price']
+    prices[prices != column_store.MISSING_INT].mean()
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+
+from typing import Any, Dict, IO, List, Optional
+
+import numpy as np
+
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+META_FILE = 'meta.json'
+MISSING_INT = -1
+MISSING_CODE = -1
+
+# Rows buffered before they are appended to the column files
+DEFAULT_BATCH_ROWS = 65536
+
+# Fixed size of the .npy headers, so appending only rewrites the shape
+_HEADER_SIZE = 128
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+_FIELD_DTYPES = {
+    int: np.dtype('<i8'),
+    float: np.dtype('<f8'),
+    datetime.date: np.dtype('<M8[D]'),
+    str: np.dtype('<i4'),
+}
+_MISSING_VALUES: Dict[type, Any] = {
+    int: MISSING_INT,
+    float: np.nan,
+    datetime.date: np.datetime64('NaT', 'D'),
+    str: MISSING_CODE,
+}
+
+
+def column_file(store_path: str, column: str) -> str:
+    """Get the path of the values of a column."""
+    return os.path.join(store_path, F'{column}.npy')
+
+
+def dictionary_file(store_path: str, column: str) -> str:
+    """Get the path of the dictionary of a string column."""
+    return os.path.join(store_path, F'{column}.dict.json')
+
+
+def load_columns(store_path: str,
+                 mmap_mode: Optional[str] = 'r') -> Dict[str, np.ndarray]:
+    """Load the columns of a store, memory mapped by default."""
+    meta = _read_json(os.path.join(store_path, META_FILE))
+    return {column: np.load(column_file(store_path, column),
+                            mmap_mode=mmap_mode)[:meta['rows']]
+            for column in meta['columns']}
+
+
+def load_dictionary(store_path: str, column: str) -> List[str]:
+    """Load the values of a string column, indexed by the stored codes."""
+    return _read_json(dictionary_file(store_path, column))
+
+
+def decode_column(store_path: str, column: str) -> List[Optional[str]]:
+    """Get the values of a string column, None if missing."""
+    values = load_dictionary(store_path, column)
+    codes = load_columns(store_path)[column]
+    return [values[code] if code != MISSING_CODE else None
+            for code in codes.tolist()]
+
+
+class ColumnStoreSink():
+    """Sink appending the properties to a column store.
+
+    Same interface as file_sink.PropertySink, the store (a directory) is
+    created if missing. New stores hold the given columns (all PropertyData
+    columns if None), existing stores keep their columns.
+    """
+
+    def __init__(self, store_path: str, columns: Optional[List[str]] = None,
+                 batch_rows: int = DEFAULT_BATCH_ROWS) -> None:
+        """Initialize the sink writing the given columns."""
+        self._store_path = store_path
+        self._columns = (
+            list(columns) if columns is not None else
+            [field.value for field in property_parser.PropertyData])
+        self._check_columns = columns is not None
+        self._batch_rows = batch_rows
+        self._rows = 0
+        self._buffer: List[Dict[str, property_parser.FieldValue]] = []
+        self._dictionaries: Dict[str, Dict[str, int]] = {}
+        self._property_total = 0
+
+    def __enter__(self) -> 'ColumnStoreSink':
+        logger.info(F'Writing/Appending to: "{self._store_path}"')
+        meta_path = os.path.join(self._store_path, META_FILE)
+        if os.path.exists(meta_path):
+            meta = _read_json(meta_path)
+            if (self._check_columns and
+                    set(meta['columns']) != set(self._columns)):
+                raise ValueError(F'"{self._store_path}" stores the columns: '
+                                 F'{", ".join(meta["columns"])}')
+            self._columns = meta['columns']
+            self._rows = meta['rows']
+        else:
+            os.makedirs(self._store_path, exist_ok=True)
+
+        for column in self._columns:
+            field_type = _field_type(column)
+            path = column_file(self._store_path, column)
+            if os.path.exists(path):
+                # Drop rows appended after the last commit
+                _truncate_npy(path, self._rows)
+            else:
+                with open(path, 'wb') as npy_file:
+                    _write_header(npy_file, _FIELD_DTYPES[field_type], 0)
+            if field_type is str:
+                self._dictionaries[column] = {
+                    value: code for code, value in enumerate(
+                        _read_json(dictionary_file(self._store_path, column))
+                        if self._rows else [])}
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.commit()
+        logger.debug(F'Added Properties: {self._property_total}')
+
+    def add_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Buffer a list of properties, appended in batches."""
+        self._buffer.extend(property_list)
+        self._property_total += len(property_list)
+        if len(self._buffer) >= self._batch_rows:
+            self._flush()
+
+    def commit(self) -> None:
+        """Append the buffered properties and record the row count."""
+        self._flush()
+        for column, values in self._dictionaries.items():
+            _write_json(dictionary_file(self._store_path, column),
+                        list(values))
+        # The row count written last decides which rows are valid
+        _write_json(os.path.join(self._store_path, META_FILE),
+                    {'columns': self._columns, 'rows': self._rows})
+
+    def _flush(self) -> None:
+        """Append the buffered properties to the column files."""
+        if not self._buffer:
+            return
+        for column in self._columns:
+            values = self._column_values(column)
+            with open(column_file(self._store_path, column), 'r+b') as file:
+                file.seek(0, os.SEEK_END)
+                file.write(values.tobytes())
+                file.seek(0)
+                _write_header(file, values.dtype,
+                              self._rows + len(self._buffer))
+        self._rows += len(self._buffer)
+        self._buffer = []
+
+    def _column_values(self, column: str) -> np.ndarray:
+        """Convert the buffered values of a column to its dtype."""
+        field = property_parser.PropertyData(column)
+        field_type = _field_type(column)
+        missing = _MISSING_VALUES[field_type]
+        values = []
+        for prop in self._buffer:
+            value = prop.get(column)
+            try:
+                value = property_parser.convert_to_typed(field, value)
+            except ValueError:
+                logger.debug(F'Storing invalid {column} as missing: '
+                             F'"{value}"')
+                value = None
+            if field_type is str:
+                if value is None:
+                    value = MISSING_CODE
+                else:
+                    codes = self._dictionaries[column]
+                    value = codes.setdefault(str(value), len(codes))
+            elif value is None:
+                value = missing
+            values.append(value)
+        return np.array(values, dtype=_FIELD_DTYPES[field_type])
+
+
+def export_database(db_path: str, store_path: str,
+                    columns: Optional[List[str]] = None,
+                    chunk_size: int = DEFAULT_BATCH_ROWS) -> int:
+    """Append the sales of a parse result database to a column store.
+
+    Returns the number of sales exported.
+    """
+    # The database backend is only needed for the export
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    count = 0
+    with db_store.SqliteDb(db_path) as database:
+        columns = columns or database.sales_data_columns()
+        with database.session_scope() as session, \
+                ColumnStoreSink(store_path, columns, chunk_size) as sink:
+            for chunk in db_store.iter_sales_chunks(session, chunk_size):
+                sink.add_property_list(chunk)
+                count += len(chunk)
+    return count
+
+
+def _field_type(column: str) -> type:
+    """Get the typed representation type of a column."""
+    return property_parser.get_field_type(
+        property_parser.PropertyData(column))
+
+
+def _write_header(npy_file: IO[bytes], dtype: np.dtype, rows: int) -> None:
+    """Write a fixed size .npy (version 1.0) header at the file position."""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False, 'shape': (rows,)})
+    header_size = _HEADER_SIZE - len(_NPY_MAGIC) - 2
+    npy_file.write(_NPY_MAGIC + header_size.to_bytes(2, 'little') +
+                   header.ljust(header_size - 1).encode('latin1') + b'\n')
+
+
+def _truncate_npy(path: str, rows: int) -> None:
+    """Truncate a column file to the given number of rows."""
+    dtype = np.load(path, mmap_mode='r').dtype
+    with open(path, 'r+b') as npy_file:
+        _write_header(npy_file, dtype, rows)
+        npy_file.truncate(_HEADER_SIZE + rows * dtype.itemsize)
+
+
+def _read_json(path: str) -> Any:
+    """Read a json file of the store."""
+    with open(path, encoding='utf-8') as json_file:
+        return json.load(json_file)
+
+
+def _write_json(path: str, data: Any) -> None:
+    """Replace a json file of the store atomically."""
+    with open(path + '.tmp', 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Set up command line arguments for the export."""
+    parser = argparse.ArgumentParser(
+        description='Append the sales of a parse result database to a '
+                    'NumPy column store')
+    parser.add_argument('db_path', help='Parse result database')
+    parser.add_argument('store_path', help='Column store directory')
+    parser.add_argument('--columns', metavar='COLUMN,...',
+                        type=lambda value: value.split(','),
+                        help='Only export these columns')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Export a parse result database to a column store."""
+    args = parse_args(argv)
+    count = export_database(args.db_path, args.store_path, args.columns)
+    print(F'Exported {count} sales to "{args.store_path}"')
+
+
+if __name__ == '__main__':
+    main()
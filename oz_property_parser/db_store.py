@@ -2,23 +2,129 @@
 
 """Manage the Database."""
 
+import datetime
 import logging
+import sys
+import time
 
 from contextlib import contextmanager
 
+from typing import (Dict, Iterator, List, NamedTuple, Optional, Set, Tuple,
+                    Type)
+
 import sqlalchemy
 
 from sqlalchemy import (Boolean, Column, Integer, String, ForeignKey, Table,
-                        UniqueConstraint, create_engine, Unicode)
+                        UniqueConstraint, create_engine, Unicode, MetaData,
+                        Index, text, Date, Float, and_, or_)
 
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.interfaces import PoolListener
 
-from sqlalchemy.orm import relationship, sessionmaker, mapper
+from sqlalchemy.orm import relationship, sessionmaker, mapper, class_mapper
+
+from sqlalchemy.orm.exc import UnmappedClassError
+
+import property_parser
+import sales_aggregates
 
 Base = declarative_base()  # pylint: disable=invalid-name
 
+SALES_DATA_TABLE = 'SalesData'
+PARTITION_PREFIX = SALES_DATA_TABLE + '_'
+UNKNOWN_PARTITION = 'Unknown'
+SALES_FACT_TABLE = 'SalesFact'
+DIMENSION_PREFIX = 'Dim_'
+SALES_AGGREGATE_TABLE = 'SalesAggregate'
+ADDRESS_INDEX_PREFIX = 'Address_'
+REPEAT_SALE_TABLE = 'RepeatSale'
+QUARANTINE_TABLE = 'QuarantinedLine'
+
+# Columns with repeated strings, stored in dimension tables when normalised
+DIMENSION_COLUMNS = [
+    property_parser.PropertyData.FILE_NAME.value,
+    property_parser.PropertyData.DISTRICT.value,
+    property_parser.PropertyData.STREET_NAME.value,
+    property_parser.PropertyData.SUBBURB.value,
+    property_parser.PropertyData.NATURE_OF_PROPERTY.value,
+    property_parser.PropertyData.ZONE.value,
+    property_parser.PropertyData.ZONE_TYPE.value,
+]
+
+# Columns identifying a sale across (overlapping) property files
+NATURAL_KEY_COLUMNS = [
+    property_parser.PropertyData.DISTRICT_CODE.value,
+    property_parser.PropertyData.PROPERTY_ID.value,
+    property_parser.PropertyData.CONTRACT_DATE.value,
+    property_parser.PropertyData.PURCHASE_PRICE.value,
+]
+
+# Flush duration the adaptive batch size of a memory budget aims for
+DEFAULT_TARGET_COMMIT_SECONDS = 2.0
+_BUDGET_SAMPLE_SIZE = 16
+
+# Columns of the full text address index
+ADDRESS_COLUMNS = [
+    property_parser.PropertyData.UNIT_NUMBER.value,
+    property_parser.PropertyData.HOUSE_NUMBER.value,
+    property_parser.PropertyData.STREET_NAME.value,
+    property_parser.PropertyData.SUBBURB.value,
+    property_parser.PropertyData.POST_CODE.value,
+]
+
+# Columns indexed for the usual query filters, see sales_query
+QUERY_INDEX_COLUMNS = [
+    property_parser.PropertyData.POST_CODE.value,
+    property_parser.PropertyData.SUBBURB.value,
+    property_parser.PropertyData.DISTRICT_CODE.value,
+    property_parser.PropertyData.CONTRACT_DATE.value,
+    property_parser.PropertyData.PROPERTY_ID.value,
+]
+
+# Columns of the sales used by the repeat sales, see update_repeat_sales()
+REPEAT_SALE_SOURCE_COLUMNS = [
+    property_parser.PropertyData.DISTRICT_CODE.value,
+    property_parser.PropertyData.PROPERTY_ID.value,
+    property_parser.PropertyData.POST_CODE.value,
+    property_parser.PropertyData.SUBBURB.value,
+    property_parser.PropertyData.CONTRACT_DATE.value,
+    property_parser.PropertyData.PURCHASE_PRICE.value,
+]
+
+# Columns of the sales used by the aggregates, see rebuild_aggregates()
+AGGREGATE_SOURCE_COLUMNS = [
+    property_parser.PropertyData.CONTRACT_DATE.value,
+    property_parser.PropertyData.PURCHASE_PRICE.value,
+    *sales_aggregates.AGGREGATE_LEVELS.values(),
+]
+
+# Columns the optional features need in the stored sales, for databases
+# storing a subset of the columns
+FEATURE_COLUMNS = {
+    'partitioned': [property_parser.PropertyData.FILE_NAME.value,
+                    property_parser.PropertyData.CONTRACT_DATE.value],
+    'dedup': NATURAL_KEY_COLUMNS,
+    'aggregates': AGGREGATE_SOURCE_COLUMNS,
+    'address_index': ADDRESS_COLUMNS,
+    'query_indexes': QUERY_INDEX_COLUMNS,
+    'repeat_sales': REPEAT_SALE_SOURCE_COLUMNS,
+}
+
+# SQL column types of the typed sales data layout
+_SQL_TYPES = {
+    int: Integer,
+    float: Float,
+    datetime.date: Date,
+}
+
+# SQL expressions converting the all-string layout to the typed layout
+_SQL_MIGRATIONS = {
+    int: 'CAST({} AS INTEGER)',
+    float: 'CAST({} AS REAL)',
+    datetime.date: "REPLACE({}, '/', '-')",
+}
+
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
@@ -42,6 +148,20 @@ class ScannedFile(Base):
     UniqueConstraint('size_bytes', 'checksum', name='uix_1')
 
 
+class QuarantineRow(NamedTuple):
+    """Quarantined line as stored in the database."""
+
+    id: int  # pylint: disable=invalid-name
+    file_name: str
+    line_no: int
+    line: str
+    error: str
+    # None for the lines quarantined before the paths were stored
+    full_path: Optional[str] = None
+    # Name of the property file class that parsed the file
+    parser: Optional[str] = None
+
+
 class SalesData():  # pylint: disable=too-few-public-methods
     """Sales Data DB."""
 
@@ -54,20 +174,37 @@ class SqliteForeignKeysListener(PoolListener):
         dbapi_con.execute('pragma foreign_keys=ON')
 
 
+class SqliteBulkLoadListener(PoolListener):
+    """Class to trade durability for insert speed."""
+
+    def connect(self, dbapi_con, con_record):
+        """Connect the bulk load listener."""
+        dbapi_con.execute('pragma synchronous=OFF')
+        dbapi_con.execute('pragma journal_mode=MEMORY')
+
+
 class SqliteDb():
     """SQLAlchemy Sqlite database connection."""
 
-    def __init__(self, db_path):
-        """Initialize the Sqlite Database."""
+    def __init__(self, db_path, bulk_load=False):
+        """Initialize the Sqlite Database.
+
+        With bulk_load the database may be corrupted by a crash, only use it
+        for databases that can be written again, like worker shards.
+        """
         self.connection_string = 'sqlite:///' + db_path
+        self._bulk_load = bulk_load
         self._session_func = None
         self._engine = None
 
     def __enter__(self):
+        listeners = [SqliteForeignKeysListener()]  # Enforce Foreign Keys
+        if self._bulk_load:
+            listeners.append(SqliteBulkLoadListener())
         self._engine = create_engine(
             self.connection_string,
             # echo=True,
-            listeners=[SqliteForeignKeysListener()])  # Enforce Foreign Keys
+            listeners=listeners)
 
         self._session_func = sessionmaker(bind=self._engine)
         return self
@@ -75,15 +212,68 @@ class SqliteDb():
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
-    def create(self, sales_data_columns):
-        """Create this SQL Database."""
+    def create(self, sales_data_columns, partitioned=False, typed=False,
+               normalised=False):
+        """Create this SQL Database.
+
+        In partitioned mode the sales data is not stored in a single table,
+        the tables for each contract year are created by the
+        PartitionedDataManager on demand and "SalesData" becomes a view.
+        In typed mode numbers and dates are stored with their SQL types
+        instead of strings, see property_parser.get_field_type().
+        In normalised mode the DIMENSION_COLUMNS are stored in dimension
+        tables referenced by the "SalesFact" table and "SalesData" becomes
+        a view with the flat column shape.
+        """
+        if partitioned and normalised:
+            raise ValueError('Partitioned and normalised layouts cannot '
+                             'be combined')
+
+        if partitioned or normalised:
+            ScannedFile.__table__.create(self._engine, checkfirst=True)
+            if normalised:
+                create_normalised_tables(self._engine, sales_data_columns,
+                                         typed)
+            return
+
         sales_table = Table(
-            'SalesData', Base.metadata,
+            SALES_DATA_TABLE, MetaData(),
             Column('id', Integer, primary_key=True),
-            *(Column(col, Unicode(255)) for col in sales_data_columns))
-        mapper(SalesData, sales_table)
+            *(sales_data_column(col, typed) for col in sales_data_columns))
+        # The class mapping is global, keep the first one for queries.
+        # Inserts use the table reflected from each database
+        if not _is_mapped(SalesData):
+            mapper(SalesData, sales_table)
 
         Base.metadata.create_all(self._engine)
+        sales_table.create(self._engine, checkfirst=True)
+
+    def is_partitioned(self) -> bool:
+        """Check if the existing sales data is stored in partitions."""
+        with self._engine.connect() as connection:
+            return bool(get_partitions(connection))
+
+    def is_normalised(self) -> bool:
+        """Check if the existing sales data uses the normalised layout."""
+        with self._engine.connect() as connection:
+            return is_normalised(connection)
+
+    def is_typed(self) -> bool:
+        """Check if the existing sales data uses the typed layout."""
+        with self._engine.connect() as connection:
+            return is_typed(connection)
+
+    def sales_data_columns(self) -> List[str]:
+        """Get the columns of the existing sales data, empty if none."""
+        with self._engine.connect() as connection:
+            return [row[1] for row in connection.execute(
+                text(F'PRAGMA table_info("{SALES_DATA_TABLE}")'))
+                    if row[1] != 'id']
+
+    def migrate_to_typed(self, sales_data_columns) -> None:
+        """Migrate the sales data from the all-string to the typed layout."""
+        with self.session_scope() as session:
+            migrate_to_typed(session, sales_data_columns)
 
     @contextmanager
     def session_scope(self):
@@ -111,6 +301,14 @@ class DataManager():
         self._session = session
         self._commit_count = 0
         self._property_total = 0
+        self._sales_table: Optional[Table] = None
+        self._deduplicator: Optional[SaleDeduplicator] = None
+        self._aggregates = False
+        self._address_index = False
+        self._query_indexes = False
+        self._repeat_sales = False
+        self._batch_budget: Optional[BatchBudget] = None
+        self._quarantine: Optional[bool] = None
 
     def __enter__(self):
         logger.info('DataManager.__enter__()')
@@ -120,6 +318,82 @@ class DataManager():
         self.commit()
         logger.debug(F'Added Properties: {self._property_total}')
         logger.debug(F'Commits: {self._commit_count}')
+        if self._deduplicator is not None:
+            logger.info(F'Dropped Duplicates: '
+                        F'{self._deduplicator.duplicate_total}')
+
+    @property
+    def duplicate_counts(self) -> Dict[str, int]:
+        """Get the number of dropped duplicate sales per file name."""
+        if self._deduplicator is None:
+            return {}
+        return dict(self._deduplicator.duplicate_counts)
+
+    def enable_deduplication(self) -> None:
+        """Drop sales already stored or added before, see NATURAL_KEY_COLUMNS.
+
+        The natural keys of all stored sales are loaded into memory and a
+        unique index enforces the natural key in the database.
+        """
+        self._deduplicator = SaleDeduplicator()
+        if _table_exists(self._session, SALES_DATA_TABLE):
+            self._deduplicator.load_keys(self._session, SALES_DATA_TABLE)
+        for table_name in self._sales_tables():
+            create_natural_key_index(self._session, table_name)
+        self._session.commit()
+
+    def enable_aggregates(self) -> None:
+        """Maintain the SalesAggregate table with every commit.
+
+        If the table does not exist yet, it is created and built from the
+        sales data already stored.
+        """
+        if create_aggregate_table(self._session):
+            rebuild_aggregates(self._session)
+            self._session.commit()
+        self._aggregates = True
+
+    def enable_address_index(self) -> None:
+        """Maintain a full text index of the sale addresses.
+
+        The FTS5 index is created (and filled) if missing and kept in sync by
+        triggers, see search_addresses().
+        """
+        for table_name in self._sales_tables():
+            create_address_index(self._session, table_name)
+        self._session.commit()
+        self._address_index = True
+
+    def enable_query_indexes(self) -> None:
+        """Index the QUERY_INDEX_COLUMNS of all (future) sales tables."""
+        for table_name in self._sales_tables():
+            create_query_indexes(self._session, table_name)
+        self._session.commit()
+        self._query_indexes = True
+
+    def enable_repeat_sales(self) -> None:
+        """Maintain the RepeatSale table with every commit.
+
+        If the table does not exist yet, it is created and built from the
+        sales data already stored. The property lookups need the query
+        indexes, they are enabled as well.
+        """
+        self.enable_query_indexes()
+        if create_repeat_sale_table(self._session):
+            rebuild_repeat_sales(self._session)
+            self._session.commit()
+        self._repeat_sales = True
+
+    def enable_memory_budget(
+            self, budget_bytes: int,
+            target_commit_seconds: float = DEFAULT_TARGET_COMMIT_SECONDS
+    ) -> None:
+        """Flush by the estimated memory of the buffered properties.
+
+        Besides the budget the batch size adapts to the measured insert
+        throughput, see BatchBudget. commit_max stays the upper limit.
+        """
+        self._batch_budget = BatchBudget(budget_bytes, target_commit_seconds)
 
     def add_scanned_file(self, scanned_file: ScannedFile) -> None:
         """Add a scanned file entry."""
@@ -132,13 +406,126 @@ class DataManager():
         return self._session.query(ScannedFile).filter_by(
             size_bytes=size, checksum=checksum).first()
 
+    def merge_shard(self, shard_path: str) -> Tuple[int, int]:
+        """Merge a shard database written by a parser worker.
+
+        The scanned files are merged with renumbered ids and extracted_from
+        links, files scanned before are kept once. The sales are copied by a
+        single INSERT ... SELECT from the attached shard if the data manager
+        does not process the batches (see _bulk_merge_table()), otherwise
+        they are added in chunks. Returns the number of processed files new
+        to this database and the number of merged sales.
+        """
+        with SqliteDb(shard_path) as shard:
+            if shard.is_typed() != is_typed(self._session):
+                raise ValueError(F'"{shard_path}" and the database use '
+                                 F'different column types')
+            shard_columns = set(shard.sales_data_columns())
+
+        # Databases cannot be attached within a transaction, the shard is
+        # attached to the connection of the next transaction
+        self.commit()
+        self._session.execute(text('ATTACH DATABASE :path AS shard'),
+                              {'path': shard_path})
+        try:
+            file_count = merge_attached_scanned_files(self._session, 'shard')
+            merge_attached_quarantine(self._session, 'shard')
+
+            table_name = self._bulk_merge_table()
+            if table_name is not None:
+                # The shard may store a subset of the columns
+                columns = ', '.join(
+                    F'"{col.name}"' for col in reflect_sales_table(
+                        self._session).columns if col.name in shard_columns)
+                sales_count = self._session.execute(text(
+                    F'INSERT INTO main."{table_name}" ({columns}) '
+                    F'SELECT {columns} FROM shard."{SALES_DATA_TABLE}" '
+                    F'ORDER BY id')).rowcount
+                self._session.commit()
+                return file_count, sales_count
+
+            self._session.commit()
+        except:
+            self._session.rollback()
+            raise
+        finally:
+            detach_database(self._session, 'shard')
+
+        sales_count = 0
+        with SqliteDb(shard_path) as shard:
+            with shard.session_scope() as shard_session:
+                for property_list in iter_sales_chunks(shard_session):
+                    self.add_property_list(property_list)
+                    sales_count += len(property_list)
+        self.commit()
+        return file_count, sales_count
+
+    def add_quarantined_lines(
+            self, file_path: str,
+            lines: List[property_parser.QuarantinedLine],
+            property_class: Type[property_parser.PropertyFile]) -> None:
+        """Store the quarantined lines of a file, replacing earlier ones.
+
+        The lines are stored by the full path of the file and the name of
+        the property class parsing it, see QuarantineRow.
+        """
+        if self._quarantine is None:
+            self._quarantine = _table_exists(self._session, QUARANTINE_TABLE)
+            if self._quarantine:
+                _upgrade_quarantine_table(self._session)
+        if not (lines or self._quarantine):
+            return
+        if not self._quarantine:
+            _quarantine_table(MetaData()).create(self._session.connection())
+            self._quarantine = True
+
+        table = _quarantine_table(MetaData())
+        file_name = _base_name(file_path)
+        self._session.execute(table.delete().where(or_(
+            table.c.Full_Path == file_path,
+            and_(table.c.Full_Path.is_(None),
+                 table.c.File_Name == file_name))))
+        if lines:
+            self._session.execute(table.insert(), [
+                {'File_Name': file_name, 'Full_Path': file_path,
+                 'Parser': property_class.__name__, 'Line_No': line.line_no,
+                 'Line': line.line, 'Error': line.error} for line in lines])
+
+    def get_quarantined_lines(self) -> List[QuarantineRow]:
+        """Get the quarantined lines of all files."""
+        if not _table_exists(self._session, QUARANTINE_TABLE):
+            return []
+        _upgrade_quarantine_table(self._session)
+        return [QuarantineRow(*row) for row in self._session.execute(text(
+            F'SELECT id, File_Name, Line_No, Line, Error, Full_Path, Parser '
+            F'FROM "{QUARANTINE_TABLE}" '
+            F'ORDER BY File_Name, Full_Path, Line_No'))]
+
+    def resolve_quarantined_line(self, line_id: int,
+                                 error: Optional[str] = None) -> None:
+        """Delete a quarantined line parsed again, or update its error."""
+        table = _quarantine_table(MetaData())
+        if error is None:
+            self._session.execute(table.delete().where(table.c.id == line_id))
+        else:
+            self._session.execute(table.update().where(
+                table.c.id == line_id).values(Error=error))
+
     def add_property_list(self, property_list) -> None:
         """Add a list of properties to Datamanager."""
+        if self._deduplicator is not None:
+            property_list = self._deduplicator.filter(property_list)
         count = len(property_list)
         self._property_list += property_list
         self._property_count += count
         self._property_total += count
 
+        if self._batch_budget is not None:
+            self._batch_budget.add(property_list)
+            if self._batch_budget.should_flush(self._property_count):
+                self.commit()
+                return
+
         if self._property_count >= self._commit_max:
             self.commit()
 
@@ -147,15 +534,1259 @@ class DataManager():
         logger.info('DataManager.commit()')
         if self._property_count > 0:
             logger.info(F'Property Count: {self._property_count}')
-            insert_bulk_sales_data(self._session, self._property_list)
+            start_time = time.perf_counter()
+            written = self._write_batch(self._property_list)
+            if self._aggregates:
+                update_aggregates(
+                    self._session,
+                    sales_aggregates.aggregate_properties(written))
+            if self._repeat_sales:
+                refresh_repeat_sales(self._session, _property_keys(written))
             self._session.commit()
+            if self._batch_budget is not None:
+                self._batch_budget.record_flush(
+                    self._property_count, time.perf_counter() - start_time)
             self._property_count = 0
             self._commit_count += 1
             del self._property_list[:]
             logger.info((F'Properties Added: {self._property_total:20}'
                          F', Commits: {self._commit_count:10}'))
+        else:
+            # Scanned file entries
+            self._session.commit()
+
+    def _write_batch(self, property_list) -> list:
+        """Write a batch of properties to the database.
+
+        Returns the properties written.
+        """
+        if self._sales_table is None:
+            self._sales_table = reflect_sales_table(self._session)
+        insert_bulk_sales_data(self._session, property_list,
+                               self._sales_table,
+                               self._deduplicator is not None)
+        return property_list
+
+    def _sales_tables(self) -> List[str]:
+        """Get the tables storing the sales."""
+        return [SALES_DATA_TABLE]
+
+    def _bulk_merge_table(self) -> Optional[str]:
+        """Get the table shards can be merged into by SQL, None if none.
+
+        Deduplication and the maintained tables need every batch.
+        """
+        if (self._deduplicator is not None or self._aggregates or
+                self._repeat_sales):
+            return None
+        return SALES_DATA_TABLE
+
+
+class BatchBudget():
+    """Decide when to flush the buffered properties of a DataManager.
+
+    A batch is flushed when the estimated memory of the buffered properties
+    reaches the budget, or when it has as many rows as can be inserted in
+    about target_commit_seconds at the measured insert throughput. Keeps
+    transactions large enough to be efficient without running out of memory.
+    """
+
+    def __init__(self, budget_bytes: int,
+                 target_commit_seconds: float = DEFAULT_TARGET_COMMIT_SECONDS,
+                 min_rows: int = 1000) -> None:
+        """Initialize the batch budget."""
+        if budget_bytes <= 0:
+            raise ValueError(F'Invalid memory budget: {budget_bytes}')
+        self.budget_bytes = budget_bytes
+        self._target_commit_seconds = target_commit_seconds
+        self._min_rows = min_rows
+        self.buffered_bytes = 0
+        # Rows per second, smoothed over the flushes
+        self.throughput: Optional[float] = None
+        self.row_limit: Optional[int] = None
+
+    def add(self, property_list) -> None:
+        """Account for properties added to the buffer."""
+        if not property_list:
+            return
+        # Estimate from a sample, measuring every property is too slow
+        step = max(1, len(property_list) // _BUDGET_SAMPLE_SIZE)
+        sample = property_list[::step]
+        sample_bytes = sum(estimate_property_bytes(prop) for prop in sample)
+        self.buffered_bytes += sample_bytes * len(property_list) // len(sample)
+
+    def should_flush(self, row_count: int) -> bool:
+        """Check if the buffered properties should be flushed."""
+        return (self.buffered_bytes >= self.budget_bytes or
+                (self.row_limit is not None and row_count >= self.row_limit))
+
+    def record_flush(self, row_count: int, seconds: float) -> None:
+        """Adapt the row limit to the throughput of a flush."""
+        self.buffered_bytes = 0
+        if row_count <= 0 or seconds <= 0:
+            return
+        throughput = row_count / seconds
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = 0.5 * (self.throughput + throughput)
+        self.row_limit = max(self._min_rows, int(
+            self.throughput * self._target_commit_seconds))
+        logger.debug(F'Insert Throughput: {throughput:.0f} rows/s, '
+                     F'Row Limit: {self.row_limit}')
+
+
+def estimate_property_bytes(prop: Dict) -> int:
+    """Estimate the memory used by a buffered property dict."""
+    return (sys.getsizeof(prop) +
+            sum(sys.getsizeof(value) for value in prop.values()))
+
+
+class PartitionedDataManager(DataManager):
+    """Manager for combined commits routed into contract year partitions.
+
+    Every contract year is stored in its own "SalesData_<year>" table and a
+    "SalesData" view unites all partitions, so existing queries keep working.
+    """
+
+    def __init__(self, session, sales_data_columns, commit_max=10000,
+                 partitions=None, typed=False):
+        """Initialize PartitionedDatamanager.
+
+        If partitions is given, only properties of these partitions are
+        written, everything else is dropped (used to reload partitions).
+        """
+        super().__init__(session, commit_max)
+        self._columns = list(sales_data_columns)
+        self._typed = typed
+        self._metadata = MetaData()
+        self._tables: Dict[str, Table] = {}
+        self._partitions: Optional[Set[str]] = (
+            set(partitions) if partitions is not None else None)
+
+    def get_partitions(self) -> List[str]:
+        """Get a sorted list of all partitions in the database."""
+        return get_partitions(self._session)
+
+    def drop_partition(self, partition: str) -> int:
+        """Drop the given partition to allow a cheap reload of it.
+
+        The scanned files (and the archives they were extracted from) that
+        contributed to the partition are flagged as not processed, so the
+        next parse run only processes these files again.
+        Returns the number of files flagged for reprocessing.
+        """
+        table_name = partition_table_name(partition)
+        if partition not in self.get_partitions():
+            logger.info(F'Partition "{partition}" does not exist')
+            return 0
+
+        file_names = {row[0] for row in self._session.execute(text(
+            F'SELECT DISTINCT File_Name FROM "{table_name}"'))}
+
+        logger.info(F'Drop Partition "{partition}"')
+        self._session.execute(text(F'DROP TABLE "{table_name}"'))
+        self._session.execute(text(
+            F'DROP TABLE IF EXISTS "{address_index_name(table_name)}"'))
+        table = self._tables.pop(partition, None)
+        if table is not None:
+            self._metadata.remove(table)
+        self._update_view()
+        if _table_exists(self._session, SALES_AGGREGATE_TABLE):
+            delete_partition_aggregates(self._session, partition)
+        if _table_exists(self._session, REPEAT_SALE_TABLE):
+            # Link the remaining sales of the affected properties again
+            refresh_repeat_sales(self._session,
+                                 partition_repeat_sale_keys(self._session,
+                                                            partition))
+
+        reset_count = 0
+        for scanned_file in self._session.query(ScannedFile):
+            if (scanned_file.processed and
+                    _base_name(scanned_file.full_path) in file_names):
+                entry = scanned_file
+                while entry is not None:
+                    if entry.processed:
+                        entry.processed = False
+                        reset_count += 1
+                    entry = entry.extracted_from
+
+        self._session.commit()
+        logger.info(F'Files flagged for reprocessing: {reset_count}')
+        return reset_count
+
+    def _write_batch(self, property_list) -> list:
+        """Write a batch of properties into the partition tables."""
+        batches: Dict[str, List[Dict[str, str]]] = {}
+        written = []
+        for prop in property_list:
+            partition = contract_year_partition(prop.get('Contract_Date', ''))
+            if self._partitions is None or partition in self._partitions:
+                batches.setdefault(partition, []).append(
+                    {col: prop.get(col) for col in self._columns})
+                written.append(prop)
+
+        view_outdated = False
+        for partition, batch in batches.items():
+            table = self._tables.get(partition)
+            if table is None:
+                table, created = self._setup_partition_table(partition)
+                view_outdated |= created
+            insert = table.insert()
+            if self._deduplicator is not None:
+                insert = insert.prefix_with('OR IGNORE')
+            self._session.execute(insert, batch)
+
+        if view_outdated:
+            self._update_view()
+        return written
+
+    def _setup_partition_table(self, partition: str):
+        """Set up the table of the given partition, create it if needed."""
+        table_name = partition_table_name(partition)
+        table = Table(
+            table_name, self._metadata,
+            Column('id', Integer, primary_key=True),
+            *(sales_data_column(col, self._typed) for col in self._columns))
+        Index(_contract_date_index_name(table_name), table.c.Contract_Date)
+
+        created = partition not in self.get_partitions()
+        if created:
+            logger.info(F'Create Partition "{partition}"')
+            table.create(self._session.connection())
+            if self._deduplicator is not None:
+                create_natural_key_index(self._session, table_name)
+            if self._address_index:
+                create_address_index(self._session, table_name)
+            if self._query_indexes:
+                create_query_indexes(self._session, table_name)
+        self._tables[partition] = table
+        return table, created
+
+    def _sales_tables(self) -> List[str]:
+        """Get the tables storing the sales."""
+        return [partition_table_name(part) for part in self.get_partitions()]
+
+    def _bulk_merge_table(self) -> Optional[str]:
+        """Sales are routed to their partition, see _write_batch()."""
+        return None
+
+    def _update_view(self) -> None:
+        """Recreate the SalesData view over all partitions."""
+        _create_partition_view(self._session, self._columns)
+
+
+class NormalisedDataManager(DataManager):
+    """Manager for combined commits into the normalised layout.
+
+    The DIMENSION_COLUMNS values are replaced by the ids of their dimension
+    table entries, resolved by an in-memory cache.
+    """
+
+    def __init__(self, session, commit_max=10000):
+        """Initialize NormalisedDatamanager."""
+        super().__init__(session, commit_max)
+        self._dimensions = DimensionCache(session)
+
+    def _write_batch(self, property_list) -> list:
+        """Write a batch of properties into the fact table."""
+        if self._sales_table is None:
+            self._sales_table = Table(SALES_FACT_TABLE, MetaData(),
+                                      autoload_with=self._session.connection())
+        insert_bulk_sales_data(
+            self._session,
+            [self._dimensions.encode(prop) for prop in property_list],
+            self._sales_table, self._deduplicator is not None)
+        return property_list
+
+    def _sales_tables(self) -> List[str]:
+        """Get the tables storing the sales."""
+        return [SALES_FACT_TABLE]
+
+    def _bulk_merge_table(self) -> Optional[str]:
+        """Sales are stored with dimension ids, see _write_batch()."""
+        return None
+
+
+class SaleDeduplicator():
+    """In-memory set of the natural keys of all sales, see NATURAL_KEY_COLUMNS.
+
+    Sales without a property id cannot be identified and are never dropped.
+    """
+
+    def __init__(self):
+        """Initialize the deduplicator."""
+        self._keys: Set[tuple] = set()
+        self.duplicate_counts: Dict[str, int] = {}
+        self.duplicate_total = 0
+
+    def load_keys(self, session, table_name: str) -> None:
+        """Load the natural keys of the sales stored in the given table."""
+        columns = ', '.join(NATURAL_KEY_COLUMNS)
+        self.add_keys(session.execute(text(
+            F'SELECT {columns} FROM "{table_name}"')))
+
+    def add_keys(self, rows) -> None:
+        """Add the natural keys of rows of the NATURAL_KEY_COLUMNS values."""
+        for row in rows:
+            self._keys.add(_natural_key(row))
+        logger.info(F'Loaded {len(self._keys)} natural keys')
+
+    def filter(self, property_list):
+        """Get the properties that are not duplicates of known sales."""
+        kept = []
+        for prop in property_list:
+            key = _natural_key([prop.get(col) for col in NATURAL_KEY_COLUMNS])
+            if key[1] is None:
+                kept.append(prop)
+            elif key in self._keys:
+                file_name = prop.get(
+                    property_parser.PropertyData.FILE_NAME.value, '')
+                self.duplicate_counts[file_name] = (
+                    self.duplicate_counts.get(file_name, 0) + 1)
+                self.duplicate_total += 1
+            else:
+                self._keys.add(key)
+                kept.append(prop)
+
+        dropped = len(property_list) - len(kept)
+        if dropped:
+            file_names = {prop.get(
+                property_parser.PropertyData.FILE_NAME.value, '')
+                          for prop in property_list}
+            logger.info(F'Dropped {dropped} duplicate sales of '
+                        F'{", ".join(sorted(file_names))}')
+        return kept
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def create_natural_key_index(session, table_name: str) -> None:
+    """Create the unique index of the natural key on the given table."""
+    columns = ', '.join(NATURAL_KEY_COLUMNS)
+    try:
+        session.execute(text(
+            F'CREATE UNIQUE INDEX IF NOT EXISTS '
+            F'"uix_{table_name}_Natural_Key" ON "{table_name}" ({columns}) '
+            F"WHERE Property_ID IS NOT NULL AND Property_ID != ''"))
+    except sqlalchemy.exc.IntegrityError:
+        session.rollback()
+        logger.warning(F'"{table_name}" contains duplicate sales, natural '
+                       F'key index not created')
+
+
+def has_natural_key_index(connection) -> bool:
+    """Check if the database enforces the natural key of the sales."""
+    pattern = _like_escape('uix_') + '%' + _like_escape('_Natural_Key')
+    return connection.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE type='index' "
+             "AND name LIKE :pattern ESCAPE '\\'"),
+        {'pattern': pattern}).scalar() > 0
+
+
+def _natural_key(values) -> tuple:
+    """Create the comparable natural key of the given column values."""
+    key = tuple(None if value is None else str(value) for value in values)
+    if key[1] == '':
+        return (key[0], None) + key[2:]
+    return key
+
+
+def _table_exists(connection, table_name: str) -> bool:
+    """Check if the given table or view exists."""
+    return connection.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE name=:name "
+             "AND type IN ('table', 'view')"),
+        {'name': table_name}).scalar() > 0
+
+
+class DimensionCache():
+    """In-memory cache of the dimension table ids of the normalised layout."""
+
+    def __init__(self, session):
+        """Initialize the dimension cache."""
+        self._session = session
+        self._metadata = MetaData()
+        self._ids: Dict[str, Dict[str, int]] = {}
+        self._tables: Dict[str, Table] = {}
+
+    def encode(self, prop):
+        """Get a copy of the property with dimension values replaced by ids."""
+        encoded = dict(prop)
+        for column in DIMENSION_COLUMNS:
+            if column in encoded:
+                encoded[dimension_id_column(column)] = self.get_id(
+                    column, encoded.pop(column))
+        return encoded
+
+    def get_id(self, column: str, value) -> Optional[int]:
+        """Get the dimension id of the value, add it if not known yet."""
+        if value is None:
+            return None
+
+        ids = self._ids.get(column)
+        if ids is None:
+            ids = self._load(column)
+
+        value_id = ids.get(value)
+        if value_id is None:
+            result = self._session.execute(self._tables[column].insert(),
+                                           {'value': value})
+            value_id = result.inserted_primary_key[0]
+            ids[value] = value_id
+        return value_id
+
+    def _load(self, column: str) -> Dict[str, int]:
+        """Load the known ids of the given dimension."""
+        table = _dimension_table(self._metadata, column)
+        self._tables[column] = table
+        ids = {row.value: row.id for row in self._session.execute(
+            table.select())}
+        self._ids[column] = ids
+        return ids
+
+
+def create_normalised_tables(engine, sales_data_columns, typed=False) -> None:
+    """Create the dimension and fact tables and the flat SalesData view."""
+    metadata = MetaData()
+    fact_columns = [Column('id', Integer, primary_key=True)]
+    for col in sales_data_columns:
+        if col in DIMENSION_COLUMNS:
+            dimension = _dimension_table(metadata, col)
+            fact_columns.append(Column(dimension_id_column(col), Integer,
+                                       ForeignKey(dimension.c.id)))
+        else:
+            fact_columns.append(sales_data_column(col, typed))
+    Table(SALES_FACT_TABLE, metadata, *fact_columns)
+
+    with engine.begin() as connection:
+        view_missing = not is_normalised(connection)
+        metadata.create_all(connection)
+        if view_missing:
+            _create_normalised_view(connection, sales_data_columns)
+
+
+def is_normalised(connection) -> bool:
+    """Check if the sales data uses the normalised layout."""
+    return connection.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE type='table' "
+             "AND name=:name"), {'name': SALES_FACT_TABLE}).scalar() > 0
+
+
+def dimension_table_name(column: str) -> str:
+    """Get the dimension table name of the given column."""
+    return DIMENSION_PREFIX + column
 
 
-def insert_bulk_sales_data(session, data_dic):
-    """Insert bulk data into this session."""
-    session.bulk_insert_mappings(SalesData, data_dic)
+def dimension_id_column(column: str) -> str:
+    """Get the fact table column name referencing the given dimension."""
+    return column + '_Id'
+
+
+def _dimension_table(metadata, column: str) -> Table:
+    """Create the dimension table of the given column."""
+    return Table(dimension_table_name(column), metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('value', Unicode(255), unique=True))
+
+
+def _create_normalised_view(connection, sales_data_columns) -> None:
+    """Recreate the flat SalesData view over the normalised tables."""
+    select_list = ['fact.id AS id']
+    joins = []
+    for col in sales_data_columns:
+        if col in DIMENSION_COLUMNS:
+            alias = F'dim_{len(joins)}'
+            select_list.append(F'{alias}.value AS {col}')
+            joins.append(F'LEFT JOIN "{dimension_table_name(col)}" {alias} '
+                         F'ON {alias}.id = fact.{dimension_id_column(col)}')
+        else:
+            select_list.append(F'fact.{col} AS {col}')
+
+    connection.execute(text(F'DROP VIEW IF EXISTS {SALES_DATA_TABLE}'))
+    connection.execute(text(
+        F'CREATE VIEW {SALES_DATA_TABLE} AS SELECT {", ".join(select_list)} '
+        F'FROM {SALES_FACT_TABLE} fact {" ".join(joins)}'))
+
+
+def sales_data_column(name: str, typed: bool = False) -> Column:
+    """Create the sales data column for the given PropertyData value."""
+    if typed:
+        sql_type = _SQL_TYPES.get(_get_field_type(name))
+        if sql_type:
+            return Column(name, sql_type)
+    return Column(name, Unicode(255))
+
+
+def migrate_to_typed(session, sales_data_columns) -> None:
+    """Migrate the sales data tables from the all-string to the typed layout.
+
+    Missing ("N/A" or empty) values become NULL, dates are stored ISO-8601
+    formatted. Partitioned databases migrate every partition, normalised
+    databases the fact table. The indexes and triggers of the tables, e.g.
+    the natural key and query indexes, are recreated.
+    """
+    partitions = get_partitions(session)
+    normalised = is_normalised(session)
+    if partitions:
+        table_names = [partition_table_name(part) for part in partitions]
+    elif normalised:
+        table_names = [SALES_FACT_TABLE]
+    else:
+        table_names = [SALES_DATA_TABLE]
+    if partitions or normalised:
+        session.execute(text(F'DROP VIEW IF EXISTS {SALES_DATA_TABLE}'))
+
+    for table_name in table_names:
+        if _table_is_typed(session, table_name):
+            continue
+
+        logger.info(F'Migrate "{table_name}" to typed layout')
+        source_table = Table(table_name, MetaData(),
+                             autoload_with=session.connection())
+        migrated_name = table_name + '_Typed'
+        Table(migrated_name, MetaData(),
+              *(_typed_column(col) for col in source_table.columns)
+              ).create(session.connection())
+
+        column_names = [col.name for col in source_table.columns]
+        select_list = ', '.join(_typed_select(col) for col in column_names)
+        session.execute(text(
+            F'INSERT INTO "{migrated_name}" ({", ".join(column_names)}) '
+            F'SELECT {select_list} FROM "{table_name}"'))
+        # Dropped with the table, the indexes come first as the triggers
+        # may use them
+        schema_sql = [row[0] for row in session.execute(
+            text("SELECT sql FROM sqlite_master WHERE tbl_name = :name "
+                 "AND type IN ('index', 'trigger') AND sql IS NOT NULL "
+                 "ORDER BY type = 'trigger'"), {'name': table_name})]
+        session.execute(text(F'DROP TABLE "{table_name}"'))
+        session.execute(text(
+            F'ALTER TABLE "{migrated_name}" RENAME TO "{table_name}"'))
+        for sql in schema_sql:
+            session.execute(text(sql))
+        if partitions:
+            session.execute(text(
+                F'CREATE INDEX IF NOT EXISTS '
+                F'"{_contract_date_index_name(table_name)}" '
+                F'ON "{table_name}" (Contract_Date)'))
+
+    if partitions:
+        _create_partition_view(session, sales_data_columns)
+    elif normalised:
+        _create_normalised_view(session, sales_data_columns)
+
+
+def get_partitions(connection) -> List[str]:
+    """Get a sorted list of all partitions in the database."""
+    result = connection.execute(
+        text("SELECT name FROM sqlite_master WHERE type='table' "
+             "AND name LIKE :prefix ESCAPE '\\'"),
+        {'prefix': _like_prefix(PARTITION_PREFIX)})
+    return sorted(row[0][len(PARTITION_PREFIX):] for row in result)
+
+
+def _create_partition_view(session, sales_data_columns) -> None:
+    """Recreate the SalesData view over all partitions."""
+    session.execute(text(F'DROP VIEW IF EXISTS {SALES_DATA_TABLE}'))
+    partitions = get_partitions(session)
+    if partitions:
+        columns = ', '.join(['id'] + list(sales_data_columns))
+        selects = ' UNION ALL '.join(
+            F'SELECT {columns} FROM "{partition_table_name(part)}"'
+            for part in partitions)
+        session.execute(text(F'CREATE VIEW {SALES_DATA_TABLE} AS {selects}'))
+
+
+def is_typed(connection) -> bool:
+    """Check if the sales data uses the typed layout."""
+    return _table_is_typed(connection, SALES_DATA_TABLE)
+
+
+def _table_is_typed(connection, table_name: str) -> bool:
+    """Check if the given sales data table uses the typed layout."""
+    columns = connection.execute(text(F'PRAGMA table_info("{table_name}")'))
+    for column in columns:
+        # The first column with a typed layout type decides, the table may
+        # store a subset of the columns
+        if _get_field_type(column[1]) is not str:
+            return str(column[2]).upper() in ('INTEGER', 'FLOAT', 'DATE')
+    return False
+
+
+def _typed_column(column: Column) -> Column:
+    """Copy a reflected all-string column with its typed layout type."""
+    typed_column = column.copy()
+    sql_type = _SQL_TYPES.get(_get_field_type(column.name))
+    if sql_type:
+        typed_column.type = sql_type()
+    return typed_column
+
+
+def _typed_select(column: str) -> str:
+    """Create the SQL expression selecting the typed value of a column."""
+    value = F"NULLIF(NULLIF(TRIM({column}), ''), 'N/A')"
+    migration = _SQL_MIGRATIONS.get(_get_field_type(column))
+    return migration.format(value) if migration else column
+
+
+def _get_field_type(column: str):
+    """Get the typed layout python type of the given column."""
+    try:
+        field = property_parser.PropertyData(column)
+    except ValueError:
+        return str
+    return property_parser.get_field_type(field)
+
+
+def _is_mapped(cls) -> bool:
+    """Check if the given class has a mapper."""
+    try:
+        class_mapper(cls)
+    except UnmappedClassError:
+        return False
+    return True
+
+
+def _contract_date_index_name(table_name: str) -> str:
+    """Get the name of the contract date index of a sales data table."""
+    return F'ix_{table_name}_Contract_Date'
+
+
+def contract_year_partition(contract_date) -> str:
+    """Get the partition for the given internal or typed contract date."""
+    if isinstance(contract_date, datetime.date):
+        return F'{contract_date.year:04}'
+    year = (contract_date or '')[:4]
+    if len(year) == 4 and year.isdigit():
+        return year
+    return UNKNOWN_PARTITION
+
+
+def partition_table_name(partition: str) -> str:
+    """Get the table name of the given partition."""
+    return PARTITION_PREFIX + partition
+
+
+def _like_escape(value: str) -> str:
+    """Escape the LIKE wildcards of the given value."""
+    return value.replace('\\', '\\\\').replace('_', '\\_')
+
+
+def _like_prefix(prefix: str) -> str:
+    """Create a escaped LIKE pattern matching the given prefix."""
+    return _like_escape(prefix) + '%'
+
+
+def _base_name(path: str) -> str:
+    """Get the file name of a path stored on Windows or Posix."""
+    return path.replace('\\', '/').split('/')[-1]
+
+
+def insert_bulk_sales_data(session, data_dic, sales_table=None,
+                           ignore_duplicates=False):
+    """Insert bulk data into this session.
+
+    With ignore_duplicates sales violating the natural key index are skipped.
+    """
+    if sales_table is None:
+        sales_table = reflect_sales_table(session)
+    columns = [col.name for col in sales_table.columns if col.name != 'id']
+    insert = sales_table.insert()
+    if ignore_duplicates:
+        insert = insert.prefix_with('OR IGNORE')
+    session.execute(insert,
+                    [{col: data.get(col) for col in columns}
+                     for data in data_dic])
+
+
+def merge_attached_scanned_files(session, schema: str) -> int:
+    """Merge the scanned files of an attached database into the main one.
+
+    Files are identified by size and checksum, new files keep the order of
+    the attached database and their extracted_from links are renumbered.
+    Returns the number of processed files new to the main database, not
+    counting the archives.
+    """
+    table = ScannedFile.__tablename__
+    session.execute(text(
+        F'CREATE INDEX IF NOT EXISTS main.ix_{table}_identity '
+        F'ON {table} (size_bytes, checksum)'))
+    last_id = session.execute(text(
+        F'SELECT COALESCE(MAX(id), 0) FROM main.{table}')).scalar()
+
+    session.execute(text(
+        F'INSERT INTO main.{table} '
+        F'(full_path, processed, size_bytes, checksum) '
+        F'SELECT full_path, processed, size_bytes, checksum '
+        F'FROM {schema}.{table} other WHERE id IN ('
+        F'SELECT MIN(id) FROM {schema}.{table} '
+        F'GROUP BY size_bytes, checksum) AND NOT EXISTS ('
+        F'SELECT 1 FROM main.{table} file '
+        F'WHERE file.size_bytes = other.size_bytes '
+        F'AND file.checksum = other.checksum) ORDER BY id'))
+
+    # Map the ids of the attached database to the main database
+    session.execute(text('CREATE TEMP TABLE IF NOT EXISTS scanned_file_map '
+                         '(other_id INTEGER PRIMARY KEY, id INTEGER)'))
+    session.execute(text('DELETE FROM scanned_file_map'))
+    session.execute(text(
+        F'INSERT INTO scanned_file_map SELECT other.id, ('
+        F'SELECT MIN(file.id) FROM main.{table} file '
+        F'WHERE file.size_bytes = other.size_bytes '
+        F'AND file.checksum = other.checksum) FROM {schema}.{table} other'))
+
+    session.execute(text(
+        F'UPDATE main.{table} SET extracted_from_id = ('
+        F'SELECT parent.id FROM scanned_file_map child '
+        F'JOIN {schema}.{table} other ON other.id = child.other_id '
+        F'JOIN scanned_file_map parent '
+        F'ON parent.other_id = other.extracted_from_id '
+        F'WHERE child.id = main.{table}.id) WHERE id > :last_id'),
+                    {'last_id': last_id})
+
+    processed_elsewhere = (
+        F'NOT COALESCE(processed, 0) AND id <= :last_id AND id IN ('
+        F'SELECT map.id FROM scanned_file_map map '
+        F'JOIN {schema}.{table} other ON other.id = map.other_id '
+        F'WHERE other.processed)')
+    not_archive = (F'id NOT IN (SELECT extracted_from_id FROM main.{table} '
+                   F'WHERE extracted_from_id IS NOT NULL)')
+    merged = session.execute(text(
+        F'SELECT COUNT(*) FROM main.{table} '
+        F'WHERE ((id > :last_id AND processed) OR {processed_elsewhere}) '
+        F'AND {not_archive}'), {'last_id': last_id}).scalar()
+    session.execute(text(
+        F'UPDATE main.{table} SET processed = 1 WHERE {processed_elsewhere}'),
+                    {'last_id': last_id})
+    return merged
+
+
+def copy_scanned_files(session, source_path: str) -> None:
+    """Copy the scanned files of another database keeping their ids.
+
+    The database is attached to the connection of the session, it must not
+    have started a transaction. The copy is committed.
+    """
+    table = ScannedFile.__tablename__
+    columns = 'id, full_path, processed, size_bytes, checksum, ' \
+              'extracted_from_id'
+    session.execute(text('ATTACH DATABASE :path AS source'),
+                    {'path': source_path})
+    try:
+        session.execute(text(
+            F'INSERT INTO main.{table} ({columns}) '
+            F'SELECT {columns} FROM source.{table} ORDER BY id'))
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        detach_database(session, 'source')
+
+
+def detach_database(session, schema: str) -> None:
+    """Detach a database from the connection of the session if attached.
+
+    Attached databases outlive the transactions of pooled connections, they
+    are detached once the transaction ended.
+    """
+    attached = [row[1] for row in session.execute(
+        text('PRAGMA database_list'))]
+    if schema in attached:
+        session.execute(text(F'DETACH DATABASE {schema}'))
+
+
+def iter_sales_chunks(session, chunk_size=10000) -> Iterator[List[Dict]]:
+    """Stream the stored sales in chunks, in the shape they were added.
+
+    Sales of typed databases are converted to the typed representation.
+    """
+    typed = is_typed(session)
+    result = session.execute(
+        F'SELECT * FROM "{SALES_DATA_TABLE}" ORDER BY id')
+    try:
+        for rows in iter(lambda: result.fetchmany(chunk_size), []):
+            chunk = []
+            for row in rows:
+                sale = dict(row)
+                del sale['id']
+                if typed:
+                    property_parser.convert_fields_to_typed(sale)
+                chunk.append(sale)
+            yield chunk
+    finally:
+        result.close()
+
+
+def reflect_sales_table(session) -> Table:
+    """Reflect the sales data table with the column types of the database."""
+    return Table(SALES_DATA_TABLE, MetaData(),
+                 autoload_with=session.connection())
+
+
+def _aggregate_table(metadata) -> Table:
+    """Define the sales aggregate table, see sales_aggregates."""
+    return Table(SALES_AGGREGATE_TABLE, metadata,
+                 Column('Level', String, primary_key=True),
+                 Column('Area', String, primary_key=True),
+                 Column('Quarter', String, primary_key=True),
+                 Column('Sales_Count', Integer),
+                 Column('Price_Count', Integer),
+                 Column('Price_Sum', Integer),
+                 Column('Price_Sketch', String))
+
+
+def create_aggregate_table(session) -> bool:
+    """Create the sales aggregate table, returns False if it exists."""
+    if _table_exists(session, SALES_AGGREGATE_TABLE):
+        return False
+    logger.info(F'Create "{SALES_AGGREGATE_TABLE}"')
+    _aggregate_table(MetaData()).create(session.connection())
+    return True
+
+
+def has_aggregates(connection) -> bool:
+    """Check if the database maintains sales aggregates."""
+    return _table_exists(connection, SALES_AGGREGATE_TABLE)
+
+
+def update_aggregates(session, aggregates) -> None:
+    """Merge the aggregated statistics of a batch into the aggregate table."""
+    if not aggregates:
+        return
+
+    table = _aggregate_table(MetaData())
+    quarters = {quarter for _, _, quarter in aggregates}
+    existing = {}
+    for row in session.execute(
+            table.select().where(table.c.Quarter.in_(quarters))):
+        existing[(row.Level, row.Area, row.Quarter)] = row
+
+    inserts = []
+    updates = []
+    for (level, area, quarter), stats in aggregates.items():
+        row = existing.get((level, area, quarter))
+        if row is not None:
+            merged = sales_aggregates.PriceStatistics(
+                row.Sales_Count, row.Price_Count, row.Price_Sum,
+                sales_aggregates.QuantileSketch.from_json(row.Price_Sketch))
+            merged.merge(stats)
+            stats = merged
+        values = {'Level': level, 'Area': area, 'Quarter': quarter,
+                  'Sales_Count': stats.sales_count,
+                  'Price_Count': stats.price_count,
+                  'Price_Sum': stats.price_sum,
+                  'Price_Sketch': stats.sketch.to_json()}
+        (updates if row is not None else inserts).append(values)
+
+    if inserts:
+        session.execute(table.insert(), inserts)
+    if updates:
+        session.execute(text(
+            F'UPDATE "{SALES_AGGREGATE_TABLE}" SET '
+            'Sales_Count=:Sales_Count, Price_Count=:Price_Count, '
+            'Price_Sum=:Price_Sum, Price_Sketch=:Price_Sketch '
+            'WHERE Level=:Level AND Area=:Area AND Quarter=:Quarter'),
+                        updates)
+
+
+def rebuild_aggregates(session, chunk_size=10000) -> None:
+    """Rebuild the aggregate table from the stored sales data."""
+    create_aggregate_table(session)
+    session.execute(text(F'DELETE FROM "{SALES_AGGREGATE_TABLE}"'))
+    if not _table_exists(session, SALES_DATA_TABLE):
+        return
+
+    logger.info(F'Rebuild "{SALES_AGGREGATE_TABLE}"')
+    columns = AGGREGATE_SOURCE_COLUMNS
+    result = session.execute(text(
+        F'SELECT {", ".join(columns)} FROM "{SALES_DATA_TABLE}"'))
+    aggregates: Dict[tuple, sales_aggregates.PriceStatistics] = {}
+    for rows in iter(lambda: result.fetchmany(chunk_size), []):
+        for key, stats in sales_aggregates.aggregate_properties(
+                dict(zip(columns, row)) for row in rows).items():
+            if key in aggregates:
+                aggregates[key].merge(stats)
+            else:
+                aggregates[key] = stats
+    update_aggregates(session, aggregates)
+
+
+def delete_partition_aggregates(session, partition: str) -> None:
+    """Delete the aggregates of the quarters of a contract year partition."""
+    if partition == UNKNOWN_PARTITION:
+        condition = 'Quarter = :pattern'
+        pattern = sales_aggregates.UNKNOWN_QUARTER
+    else:
+        condition = 'Quarter LIKE :pattern'
+        pattern = F'{partition}-Q%'
+    session.execute(text(
+        F'DELETE FROM "{SALES_AGGREGATE_TABLE}" WHERE {condition}'),
+                    {'pattern': pattern})
+
+
+def query_aggregates(session, level: str, area: Optional[str] = None,
+                     quarter: Optional[str] = None
+                     ) -> List[sales_aggregates.AggregateRow]:
+    """Get the sales statistics of a level (e.g. "suburb") per quarter.
+
+    Optionally filtered to a single area and/or quarter.
+    """
+    if level not in sales_aggregates.AGGREGATE_LEVELS:
+        raise ValueError(F'Unknown aggregation level "{level}"')
+    if not _table_exists(session, SALES_AGGREGATE_TABLE):
+        raise ValueError('The database does not maintain sales aggregates')
+
+    table = _aggregate_table(MetaData())
+    query = table.select().where(table.c.Level == level)
+    if area is not None:
+        query = query.where(table.c.Area == area)
+    if quarter is not None:
+        query = query.where(table.c.Quarter == quarter)
+    query = query.order_by(table.c.Area, table.c.Quarter)
+
+    rows = []
+    for row in session.execute(query):
+        stats = sales_aggregates.PriceStatistics(
+            row.Sales_Count, row.Price_Count, row.Price_Sum,
+            sales_aggregates.QuantileSketch.from_json(row.Price_Sketch))
+        rows.append(sales_aggregates.AggregateRow(
+            level, row.Area, row.Quarter, stats.sales_count,
+            stats.mean_price, stats.median_price))
+    return rows
+
+
+def address_index_name(table_name: str) -> str:
+    """Get the name of the address index of a sales table."""
+    return ADDRESS_INDEX_PREFIX + table_name
+
+
+def has_address_index(connection) -> bool:
+    """Check if the database maintains an address index."""
+    return connection.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE type='table' "
+             "AND name LIKE :prefix ESCAPE '\\' "
+             "AND sql LIKE 'CREATE VIRTUAL TABLE%'"),
+        {'prefix': _like_prefix(ADDRESS_INDEX_PREFIX)}).scalar() > 0
+
+
+def _address_source_table(table_name: str) -> str:
+    """Get the table (or view) with the flat sale rows of a sales table."""
+    return SALES_DATA_TABLE if table_name == SALES_FACT_TABLE else table_name
+
+
+def create_address_index(session, table_name: str) -> None:
+    """Create the FTS5 address index of a sales table, if missing.
+
+    Triggers keep the index in sync with the inserted and deleted sales,
+    the index rowid is the id of the sale.
+    """
+    table_columns = {row[1] for row in session.execute(
+        text(F'PRAGMA table_info("{table_name}")'))}
+    values = {}
+    for col in ADDRESS_COLUMNS:
+        if col in table_columns:
+            values[col] = F'new.{col}'
+        elif dimension_id_column(col) in table_columns:
+            values[col] = (F'(SELECT value FROM "{dimension_table_name(col)}"'
+                           F' WHERE id = new.{dimension_id_column(col)})')
+    if not values:
+        raise ValueError(F'"{table_name}" has no address columns')
+
+    index_name = address_index_name(table_name)
+    column_list = ', '.join(values)
+    if not _table_exists(session, index_name):
+        logger.info(F'Create address index "{index_name}"')
+        session.execute(text(
+            F'CREATE VIRTUAL TABLE "{index_name}" USING fts5('
+            F"{column_list}, prefix='2 3')"))
+        session.execute(text(
+            F'INSERT INTO "{index_name}" (rowid, {column_list}) '
+            F'SELECT id, {column_list} '
+            F'FROM "{_address_source_table(table_name)}"'))
+
+    # Recreated if missing, e.g. after migrating the table
+    session.execute(text(
+        F'CREATE TRIGGER IF NOT EXISTS "trg_{table_name}_Address_Insert" '
+        F'AFTER INSERT ON "{table_name}" BEGIN '
+        F'INSERT INTO "{index_name}" (rowid, {column_list}) '
+        F'VALUES (new.id, {", ".join(values.values())}); END'))
+    session.execute(text(
+        F'CREATE TRIGGER IF NOT EXISTS "trg_{table_name}_Address_Delete" '
+        F'AFTER DELETE ON "{table_name}" BEGIN '
+        F'DELETE FROM "{index_name}" WHERE rowid = old.id; END'))
+
+
+def address_query(search_text: str) -> str:
+    """Create a FTS5 query matching addresses with all words as prefixes."""
+    tokens = search_text.replace('"', ' ').split()
+    return ' '.join(F'"{token}"*' for token in tokens)
+
+
+def search_addresses(session, query: str, limit: Optional[int] = 100,
+                     prefix: bool = True) -> List[Dict]:
+    """Find sales by their address, best matches first.
+
+    With prefix, every word of the query has to prefix a word of the
+    address (e.g. "harr st pyrm"), otherwise query is a FTS5 query (e.g.
+    "Subburb: pyrmont AND Post_Code: 2009").
+    Returns the sales as dicts of the SalesData columns.
+    """
+    if prefix:
+        query = address_query(query)
+    if not query:
+        return []
+
+    if is_normalised(session):
+        table_names = [SALES_FACT_TABLE]
+    else:
+        table_names = ([partition_table_name(part)
+                        for part in get_partitions(session)] or
+                       [SALES_DATA_TABLE])
+
+    matches = []
+    for table_name in table_names:
+        index_name = address_index_name(table_name)
+        if not _table_exists(session, index_name):
+            raise ValueError(F'Address index "{index_name}" does not exist')
+        sql = (F'SELECT address.rank AS address_rank, sale.* '
+               F'FROM "{index_name}" address '
+               F'JOIN "{_address_source_table(table_name)}" sale '
+               F'ON sale.id = address.rowid '
+               F'WHERE "{index_name}" MATCH :query ORDER BY address.rank')
+        if limit is not None:
+            sql += F' LIMIT {int(limit)}'
+        for row in session.execute(text(sql), {'query': query}):
+            sale = dict(row)
+            matches.append((sale.pop('address_rank'), sale))
+
+    matches.sort(key=lambda match: match[0])
+    return [sale for _, sale in matches[:limit]]
+
+
+def _query_index_name(table_name: str, column: str) -> str:
+    """Get the name of the query index of a column."""
+    return F'ix_{table_name}_{column}'
+
+
+def create_query_indexes(session, table_name: str) -> None:
+    """Index the QUERY_INDEX_COLUMNS of a sales table, if missing.
+
+    Dimension columns of the normalised layout index their id column.
+    """
+    table_columns = {row[1] for row in session.execute(
+        text(F'PRAGMA table_info("{table_name}")'))}
+    for col in QUERY_INDEX_COLUMNS:
+        if col not in table_columns:
+            col = dimension_id_column(col)
+            if col not in table_columns:
+                continue
+        session.execute(text(
+            F'CREATE INDEX IF NOT EXISTS '
+            F'"{_query_index_name(table_name, col)}" '
+            F'ON "{table_name}" ({col})'))
+
+
+def has_query_indexes(connection) -> bool:
+    """Check if the database maintains the query indexes."""
+    # Any "ix_<table>_Property_ID" index
+    pattern = _like_escape('ix_') + '%' + _like_escape(
+        '_' + property_parser.PropertyData.PROPERTY_ID.value)
+    return connection.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE type='index' "
+             "AND name LIKE :pattern ESCAPE '\\'"),
+        {'pattern': pattern}).scalar() > 0
+
+
+def _repeat_sale_table(metadata) -> Table:
+    """Define the repeat sale table, pairs of consecutive property sales."""
+    return Table(REPEAT_SALE_TABLE, metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('District_Code', Unicode(255)),
+                 Column('Property_ID', Unicode(255)),
+                 Column('Post_Code', Integer),
+                 Column('Subburb', Unicode(255)),
+                 Column('Previous_Contract_Date', Date),
+                 Column('Previous_Price', Integer),
+                 Column('Contract_Date', Date),
+                 Column('Purchase_Price', Integer),
+                 Column('Holding_Days', Integer),
+                 Column('Price_Delta', Integer),
+                 Index('ix_RepeatSale_Property', 'District_Code',
+                       'Property_ID'),
+                 Index('ix_RepeatSale_Contract_Date', 'Contract_Date'),
+                 Index('ix_RepeatSale_Post_Code', 'Post_Code'),
+                 Index('ix_RepeatSale_Subburb', 'Subburb'))
+
+
+def create_repeat_sale_table(session) -> bool:
+    """Create the repeat sale table, returns False if it exists."""
+    if _table_exists(session, REPEAT_SALE_TABLE):
+        return False
+    logger.info(F'Create "{REPEAT_SALE_TABLE}"')
+    _repeat_sale_table(MetaData()).create(session.connection())
+    return True
+
+
+def _quarantine_table(metadata) -> Table:
+    """Define the dead letter table of the lines failing parsing."""
+    return Table(QUARANTINE_TABLE, metadata,
+                 Column('id', Integer, primary_key=True),
+                 Column('File_Name', Unicode(255)),
+                 Column('Line_No', Integer),
+                 Column('Line', Unicode),
+                 Column('Error', Unicode),
+                 Column('Full_Path', Unicode),
+                 Column('Parser', Unicode(255)),
+                 Index('ix_QuarantinedLine_File_Name', 'File_Name'),
+                 Index('ix_QuarantinedLine_Full_Path', 'Full_Path'))
+
+
+def _upgrade_quarantine_table(session, schema: str = 'main') -> None:
+    """Add the path and parser columns missing in older databases."""
+    table_columns = {row[1] for row in session.execute(text(
+        F'PRAGMA {schema}.table_info("{QUARANTINE_TABLE}")'))}
+    if 'Full_Path' in table_columns:
+        return
+    logger.info(F'Upgrade "{QUARANTINE_TABLE}"')
+    session.execute(text(
+        F'ALTER TABLE {schema}."{QUARANTINE_TABLE}" '
+        F'ADD COLUMN Full_Path VARCHAR'))
+    session.execute(text(
+        F'ALTER TABLE {schema}."{QUARANTINE_TABLE}" '
+        F'ADD COLUMN Parser VARCHAR(255)'))
+    session.execute(text(
+        F'CREATE INDEX {schema}.ix_QuarantinedLine_Full_Path '
+        F'ON "{QUARANTINE_TABLE}" (Full_Path)'))
+
+
+def merge_attached_quarantine(session, schema: str) -> None:
+    """Merge the quarantined lines of an attached database."""
+    attached = session.execute(text(
+        F"SELECT 1 FROM {schema}.sqlite_master "
+        F"WHERE type = 'table' AND name = :name"),
+                               {'name': QUARANTINE_TABLE}).first()
+    if attached is None:
+        return
+    if not _table_exists(session, QUARANTINE_TABLE):
+        _quarantine_table(MetaData()).create(session.connection())
+    else:
+        _upgrade_quarantine_table(session)
+    columns = 'File_Name, Line_No, Line, Error, Full_Path, Parser'
+    session.execute(text(
+        F'DELETE FROM main."{QUARANTINE_TABLE}" WHERE Full_Path IN ('
+        F'SELECT Full_Path FROM {schema}."{QUARANTINE_TABLE}") '
+        F'OR (Full_Path IS NULL AND File_Name IN ('
+        F'SELECT File_Name FROM {schema}."{QUARANTINE_TABLE}"))'))
+    session.execute(text(
+        F'INSERT INTO main."{QUARANTINE_TABLE}" ({columns}) '
+        F'SELECT {columns} FROM {schema}."{QUARANTINE_TABLE}" ORDER BY id'))
+
+
+def has_repeat_sales(connection) -> bool:
+    """Check if the database maintains the repeat sales."""
+    return _table_exists(connection, REPEAT_SALE_TABLE)
+
+
+def _property_keys(property_list) -> Set[tuple]:
+    """Get the (District_Code, Property_ID) keys of the sales with an id."""
+    return {(prop.get('District_Code'), prop.get('Property_ID'))
+            for prop in property_list if prop.get('Property_ID')}
+
+
+def partition_repeat_sale_keys(session, partition: str) -> Set[tuple]:
+    """Get the keys of the properties with repeat sales in a partition."""
+    if partition == UNKNOWN_PARTITION:
+        # Sales without contract date are never linked
+        return set()
+    return {tuple(row) for row in session.execute(text(
+        F'SELECT DISTINCT District_Code, Property_ID '
+        F'FROM "{REPEAT_SALE_TABLE}" '
+        F'WHERE Contract_Date LIKE :year OR Previous_Contract_Date LIKE :year'
+    ), {'year': partition + '-%'})}
+
+
+def rebuild_repeat_sales(session) -> None:
+    """Rebuild the repeat sale table from the stored sales data."""
+    create_repeat_sale_table(session)
+    session.execute(text(F'DELETE FROM "{REPEAT_SALE_TABLE}"'))
+    if not _table_exists(session, SALES_DATA_TABLE):
+        return
+
+    logger.info(F'Rebuild "{REPEAT_SALE_TABLE}"')
+    keys = {tuple(row) for row in session.execute(text(
+        F'SELECT District_Code, Property_ID FROM "{SALES_DATA_TABLE}" '
+        F"WHERE COALESCE(Property_ID, '') != '' "
+        F'GROUP BY District_Code, Property_ID HAVING COUNT(*) > 1'))}
+    refresh_repeat_sales(session, keys)
+
+
+def refresh_repeat_sales(session, keys: Set[tuple]) -> None:
+    """Link the sales of the given properties again.
+
+    All repeat sales of the (District_Code, Property_ID) keys are replaced
+    by pairs of their consecutive sales currently stored, this also links
+    sales arriving out of chronological order.
+    """
+    if not keys:
+        return
+
+    session.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS repeat_sale_keys '
+        '(District_Code, Property_ID)'))
+    session.execute(text('DELETE FROM repeat_sale_keys'))
+    session.execute(
+        text('INSERT INTO repeat_sale_keys VALUES (:district, :property)'),
+        [{'district': district, 'property': property_id}
+         for district, property_id in keys])
+    key_filter = ('(District_Code, Property_ID) IN '
+                  '(SELECT District_Code, Property_ID FROM repeat_sale_keys)')
+    session.execute(text(
+        F'DELETE FROM "{REPEAT_SALE_TABLE}" WHERE {key_filter}'))
+
+    columns = REPEAT_SALE_SOURCE_COLUMNS
+    sales: Dict[tuple, List[dict]] = {}
+    for row in session.execute(text(
+            F'SELECT {", ".join(columns)} FROM "{SALES_DATA_TABLE}" '
+            F'WHERE {key_filter}')):
+        sale = dict(zip(columns, row))
+        _typed_repeat_sale_fields(sale)
+        if sale['Contract_Date'] is not None:
+            sales.setdefault((row[0], row[1]), []).append(sale)
+
+    pairs = []
+    for property_sales in sales.values():
+        property_sales.sort(key=lambda sale: sale['Contract_Date'])
+        for previous, sale in zip(property_sales, property_sales[1:]):
+            if (previous['Contract_Date'] == sale['Contract_Date'] and
+                    previous['Purchase_Price'] == sale['Purchase_Price']):
+                # The same sale stored twice, not a repeat sale
+                continue
+            price_delta = None
+            if (sale['Purchase_Price'] is not None and
+                    previous['Purchase_Price'] is not None):
+                price_delta = (sale['Purchase_Price'] -
+                               previous['Purchase_Price'])
+            pairs.append(dict(
+                sale, Previous_Contract_Date=previous['Contract_Date'],
+                Previous_Price=previous['Purchase_Price'],
+                Holding_Days=(sale['Contract_Date'] -
+                              previous['Contract_Date']).days,
+                Price_Delta=price_delta))
+
+    if pairs:
+        session.execute(_repeat_sale_table(MetaData()).insert(), pairs)
+
+
+def _typed_repeat_sale_fields(sale: Dict) -> None:
+    """Convert the fields of a stored sale to the typed representation."""
+    for field in [property_parser.PropertyData.POST_CODE,
+                  property_parser.PropertyData.PURCHASE_PRICE,
+                  property_parser.PropertyData.CONTRACT_DATE]:
+        value = sale[field.value]
+        try:
+            sale[field.value] = property_parser.convert_to_typed(field, value)
+        except ValueError:
+            sale[field.value] = None
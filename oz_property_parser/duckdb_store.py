@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""Store the parsed sales in an embedded DuckDB database.
+
+DuckDB stores the sales by column, so the aggregate queries over all sales
+are much faster than on the SQLite database of db_store. The database has
+the same "SalesData" and "scanned_file" tables (the sales without an id
+column), e.g. for a typed database:
+
+    connection = duckdb.connect('ParseResult_Properties.duckdb')
+    connection.sql('SELECT Post_Code, median(Purchase_Price) '
+                   'FROM SalesData GROUP BY Post_Code')
+
+Only the flat layout is supported, optionally typed and deduplicated. The
+batches are appended through Arrow, DuckDB reads them without a copy.
+"""
+
+import datetime
+import logging
+
+from typing import Dict, List, Optional, Set
+
+import duckdb
+import pyarrow
+
+import db_store
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+SCANNED_FILE_TABLE = db_store.ScannedFile.__tablename__
+
+# DuckDB column types of the typed sales data layout
+_DUCKDB_TYPES = {
+    int: 'BIGINT',
+    float: 'DOUBLE',
+    datetime.date: 'DATE',
+}
+
+_ARROW_TYPES = {
+    int: pyarrow.int64(),
+    float: pyarrow.float64(),
+    datetime.date: pyarrow.date32(),
+}
+
+
+def _field_type(column: str) -> type:
+    """Get the typed representation type of a column."""
+    return property_parser.get_field_type(
+        property_parser.PropertyData(column))
+
+
+class DuckDb():
+    """Embedded DuckDB database connection."""
+
+    def __init__(self, db_path: str) -> None:
+        """Initialize the DuckDB database."""
+        self._db_path = db_path
+        self.connection: Optional[duckdb.DuckDBPyConnection] = None
+
+    def __enter__(self) -> 'DuckDb':
+        self.connection = duckdb.connect(self._db_path)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.connection.close()
+        self.connection = None
+
+    def create(self, sales_data_columns: List[str],
+               typed: bool = False) -> None:
+        """Create the tables of this database if missing.
+
+        In typed mode numbers and dates are stored with their SQL types
+        instead of strings, see property_parser.get_field_type().
+        """
+        self.connection.execute(
+            F'CREATE SEQUENCE IF NOT EXISTS {SCANNED_FILE_TABLE}_id')
+        self.connection.execute(
+            F'CREATE TABLE IF NOT EXISTS {SCANNED_FILE_TABLE} ('
+            F'id INTEGER PRIMARY KEY '
+            F"DEFAULT nextval('{SCANNED_FILE_TABLE}_id'), "
+            F'full_path VARCHAR, processed BOOLEAN, size_bytes VARCHAR, '
+            F'checksum VARCHAR, extracted_from_id INTEGER)')
+        columns = ', '.join(
+            F'"{col}" ' + (_DUCKDB_TYPES.get(_field_type(col), 'VARCHAR')
+                           if typed else 'VARCHAR')
+            for col in sales_data_columns)
+        self.connection.execute(
+            F'CREATE TABLE IF NOT EXISTS "{db_store.SALES_DATA_TABLE}" '
+            F'({columns})')
+
+    def is_typed(self) -> bool:
+        """Check if the existing sales data uses the typed layout."""
+        return any(data_type != 'VARCHAR'
+                   for _, data_type in self._sales_data_column_types())
+
+    def sales_data_columns(self) -> List[str]:
+        """Get the columns of the existing sales data, empty if none."""
+        return [column for column, _ in self._sales_data_column_types()]
+
+    def _sales_data_column_types(self) -> List[tuple]:
+        """Get the names and types of the sales data columns."""
+        return self.connection.execute(
+            'SELECT column_name, data_type FROM information_schema.columns '
+            'WHERE table_name = ? ORDER BY ordinal_position',
+            [db_store.SALES_DATA_TABLE]).fetchall()
+
+
+class DuckDbDataManager():
+    """Manager appending the properties to a DuckDB database in batches.
+
+    Same interface as db_store.DataManager for the scanned file bookkeeping:
+    the processed flags of the scanned files found or added are written
+    with the next batch, in the same transaction.
+    """
+
+    def __init__(self, connection: duckdb.DuckDBPyConnection,
+                 sales_data_columns: List[str], typed: bool = False,
+                 commit_max: int = 10000) -> None:
+        """Initialize the data manager of the given sales data columns."""
+        self._connection = connection
+        self._columns = list(sales_data_columns)
+        self._schema = pyarrow.schema([
+            (col, _ARROW_TYPES.get(_field_type(col), pyarrow.string())
+             if typed else pyarrow.string())
+            for col in self._columns])
+        self._typed = typed
+        self._commit_max = commit_max
+        self._property_list: List[Dict[str, property_parser.FieldValue]] = []
+        self._property_total = 0
+        self._commit_count = 0
+        # Scanned files of this run and their stored processed flag
+        self._scanned_files: Dict[int, db_store.ScannedFile] = {}
+        self._stored_processed: Dict[int, bool] = {}
+        # Ids of the scanned files found or added since the last flush
+        self._pending_ids: Set[int] = set()
+        self._deduplicator: Optional[db_store.SaleDeduplicator] = None
+
+    def __enter__(self) -> 'DuckDbDataManager':
+        self._connection.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self._flush()
+            self._connection.commit()
+        else:
+            self._connection.rollback()
+        logger.debug(F'Added Properties: {self._property_total}')
+        logger.debug(F'Commits: {self._commit_count}')
+        if self._deduplicator is not None:
+            logger.info(F'Dropped Duplicates: '
+                        F'{self._deduplicator.duplicate_total}')
+
+    @property
+    def duplicate_counts(self) -> Dict[str, int]:
+        """Get the number of dropped duplicate sales per file name."""
+        if self._deduplicator is None:
+            return {}
+        return dict(self._deduplicator.duplicate_counts)
+
+    def enable_deduplication(self) -> None:
+        """Drop sales already stored or added before, see SaleDeduplicator.
+
+        DuckDB has no partial unique indexes, the natural key is only
+        enforced by the deduplicator.
+        """
+        self._deduplicator = db_store.SaleDeduplicator()
+        columns = ', '.join(db_store.NATURAL_KEY_COLUMNS)
+        self._deduplicator.add_keys(self._connection.execute(
+            F'SELECT {columns} FROM "{db_store.SALES_DATA_TABLE}"'
+        ).fetchall())
+
+    def add_scanned_file(self, scanned_file: db_store.ScannedFile) -> None:
+        """Add a scanned file entry."""
+        scanned_file.id = self._connection.execute(
+            F'INSERT INTO {SCANNED_FILE_TABLE} '
+            F'(full_path, processed, size_bytes, checksum, extracted_from_id)'
+            F' VALUES (?, ?, ?, ?, ?) RETURNING id',
+            [scanned_file.full_path, bool(scanned_file.processed),
+             str(scanned_file.size_bytes), str(scanned_file.checksum),
+             scanned_file.extracted_from_id]).fetchone()[0]
+        self._track_scanned_file(scanned_file)
+
+    def find_scanned_file(self, size: int, checksum: int
+                          ) -> Optional[db_store.ScannedFile]:
+        """Find a scanned file."""
+        row = self._connection.execute(
+            F'SELECT id, full_path, processed, size_bytes, checksum, '
+            F'extracted_from_id FROM {SCANNED_FILE_TABLE} '
+            F'WHERE size_bytes = ? AND checksum = ? ORDER BY id LIMIT 1',
+            [str(size), str(checksum)]).fetchone()
+        if row is None:
+            return None
+        scanned_id = row[0]
+        if scanned_id not in self._scanned_files:
+            self._track_scanned_file(db_store.ScannedFile(
+                id=scanned_id, full_path=row[1], processed=row[2],
+                size_bytes=row[3], checksum=row[4],
+                extracted_from_id=row[5]))
+        self._pending_ids.add(scanned_id)
+        return self._scanned_files[scanned_id]
+
+    def add_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Add a list of properties, appended in batches of commit_max."""
+        if self._deduplicator is not None:
+            property_list = self._deduplicator.filter(property_list)
+        self._property_list += property_list
+        self._property_total += len(property_list)
+        if len(self._property_list) >= self._commit_max:
+            self.commit()
+
+    def commit(self) -> None:
+        """Commit the buffered properties and the scanned file flags."""
+        self._flush()
+        self._connection.commit()
+        self._connection.begin()
+
+    def _flush(self) -> None:
+        """Append the buffered properties and the scanned file flags."""
+        if self._property_list:
+            logger.info(F'Property Count: {len(self._property_list)}')
+            self._append_batch(self._property_list)
+            self._commit_count += 1
+            self._property_list = []
+            logger.info((F'Properties Added: {self._property_total:20}'
+                         F', Commits: {self._commit_count:10}'))
+        for scanned_id in self._pending_ids:
+            processed = bool(self._scanned_files[scanned_id].processed)
+            if processed != self._stored_processed[scanned_id]:
+                self._connection.execute(
+                    F'UPDATE {SCANNED_FILE_TABLE} SET processed = ? '
+                    F'WHERE id = ?', [processed, scanned_id])
+                self._stored_processed[scanned_id] = processed
+        # Processed files stay processed, the others may still change
+        self._pending_ids = {
+            scanned_id for scanned_id in self._pending_ids
+            if not self._scanned_files[scanned_id].processed}
+
+    def _append_batch(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Append a batch of properties as an Arrow table."""
+        values = {col: [prop.get(col) for prop in property_list]
+                  for col in self._columns}
+        if not self._typed:
+            for col_values in values.values():
+                col_values[:] = [None if value is None else str(value)
+                                 for value in col_values]
+        batch = pyarrow.Table.from_pydict(values, self._schema)
+        columns = ', '.join(F'"{col}"' for col in self._columns)
+        self._connection.register('property_batch', batch)
+        try:
+            self._connection.execute(
+                F'INSERT INTO "{db_store.SALES_DATA_TABLE}" ({columns}) '
+                F'SELECT {columns} FROM property_batch')
+        finally:
+            self._connection.unregister('property_batch')
+
+    def _track_scanned_file(self, scanned_file: db_store.ScannedFile) -> None:
+        """Remember a scanned file to write its processed flag on commit."""
+        self._scanned_files[scanned_file.id] = scanned_file
+        self._stored_processed[scanned_file.id] = bool(scanned_file.processed)
+        self._pending_ids.add(scanned_file.id)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""Write parsed properties straight to files, without a database.
+
+The sinks append to their output, ProcessedFileSink records the processed
+files in a manifest next to it so reruns skip them.
+"""
+
+import csv
+import json
+import logging
+import os
+
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Suffix of the manifest of the processed files next to the output
+MANIFEST_SUFFIX = '.processed'
+
+
+class PropertySink():
+    """Property file sink base class, same interface as DataManager."""
+
+    def __init__(self, file_path: str) -> None:
+        """Initialize the sink writing to the given file."""
+        self._file_path = file_path
+        self._file: Optional[IO[str]] = None
+        self._property_total = 0
+
+    def __enter__(self) -> 'PropertySink':
+        logger.info(F'Writing/Appending to: "{self._file_path}"')
+        self._file = open(self._file_path, 'a', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        logger.debug(F'Added Properties: {self._property_total}')
+
+    def add_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Write a list of properties to the file."""
+        self._write(property_list)
+        self._property_total += len(property_list)
+
+    def commit(self) -> None:
+        """Flush the written properties to the file."""
+        if self._file is not None:
+            self._file.flush()
+
+    def _write(self, property_list: List[Dict[str, property_parser.FieldValue]]
+               ) -> None:
+        """Write the properties in the format of this sink."""
+        raise NotImplementedError
+
+
+class CsvSink(PropertySink):
+    """Sink writing the properties as csv rows."""
+
+    def __init__(self, file_path: str, fieldnames: List[str]) -> None:
+        """Initialize the csv sink with the given columns."""
+        super().__init__(file_path)
+        self._fieldnames = fieldnames
+        self._writer: Optional['csv.DictWriter[str]'] = None
+
+    def __enter__(self) -> 'CsvSink':
+        write_header = (not os.path.exists(self._file_path) or
+                        os.path.getsize(self._file_path) == 0)
+        super().__enter__()
+        self._writer = csv.DictWriter(self._file, delimiter=',',
+                                      lineterminator='\n',
+                                      extrasaction='ignore',
+                                      fieldnames=self._fieldnames)
+        if write_header:
+            logger.debug(F'Writing Header Row')
+            self._writer.writeheader()
+        return self
+
+    def _write(self, property_list: List[Dict[str, property_parser.FieldValue]]
+               ) -> None:
+        """Write the properties as csv rows."""
+        if self._writer is None:
+            raise ValueError('CsvSink used outside of its context')
+        self._writer.writerows(property_list)
+
+
+class JsonlSink(PropertySink):
+    """Sink writing a JSON object per property and line."""
+
+    def _write(self, property_list: List[Dict[str, property_parser.FieldValue]]
+               ) -> None:
+        """Write the properties as JSON lines."""
+        if self._file is None:
+            raise ValueError('JsonlSink used outside of its context')
+        self._file.writelines(
+            json.dumps(prop, separators=(',', ':'), default=str) + '\n'
+            for prop in property_list)
+
+
+class ScannedFileRecord():  # pylint: disable=too-few-public-methods
+    """Scanned file recorded by a ProcessedFileSink.
+
+    Same fields as db_store.ScannedFile, a plain record so the file outputs
+    never import the database backend.
+    """
+
+    def __init__(self, full_path: str, processed: bool, size_bytes: int,
+                 checksum: int, extracted_from_id: Optional[int] = None,
+                 id: Optional[int] = None  # pylint: disable=redefined-builtin
+                 ) -> None:
+        """Initialize the scanned file record."""
+        self.id = id  # pylint: disable=invalid-name
+        self.full_path = full_path
+        self.processed = processed
+        self.size_bytes = size_bytes
+        self.checksum = checksum
+        self.extracted_from_id = extracted_from_id
+
+
+class ProcessedFileSink():
+    """Sink recording the processed files of another sink in a manifest.
+
+    Same interface as db_store.DataManager for the scanned file bookkeeping.
+    The scanned files are appended to the manifest (a JSON object per line,
+    later lines win) once the properties of the sink are committed. Sinks
+    only publishing their output when closed record on exit only.
+    """
+
+    def __init__(self, sink: Any, manifest_path: str,
+                 record_on_commit: bool = True) -> None:
+        """Initialize the sink recording the files of the given sink."""
+        self._sink = sink
+        self._manifest_path = manifest_path
+        self._record_on_commit = record_on_commit
+        # Scanned files by size and checksum, their recorded processed flag
+        self._scanned_files: Dict[Tuple[int, int], ScannedFileRecord] = {}
+        self._stored_processed: Dict[int, Optional[bool]] = {}
+        # Scanned files of this run not recorded as processed yet
+        self._pending: Dict[int, ScannedFileRecord] = {}
+        self._last_id = 0
+
+    def __enter__(self) -> 'ProcessedFileSink':
+        entries: Dict[int, Dict[str, Any]] = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding='utf-8') as manifest:
+                for line in manifest:
+                    entry = json.loads(line)
+                    entries[entry['id']] = entry
+        for entry in entries.values():
+            self._track(ScannedFileRecord(**entry))
+        self._stored_processed = {
+            scanned_file.id: scanned_file.processed
+            for scanned_file in self._scanned_files.values()}
+        self._sink.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._sink.__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None:
+            self._record()
+
+    def add_scanned_file(self, scanned_file: ScannedFileRecord) -> None:
+        """Add a scanned file entry."""
+        scanned_file.id = self._last_id + 1
+        self._track(scanned_file)
+        self._stored_processed[scanned_file.id] = None
+        self._pending[scanned_file.id] = scanned_file
+
+    def find_scanned_file(self, size: int, checksum: int
+                          ) -> Optional[ScannedFileRecord]:
+        """Find a scanned file."""
+        scanned_file = self._scanned_files.get((int(size), int(checksum)))
+        if scanned_file is not None:
+            self._pending[scanned_file.id] = scanned_file
+        return scanned_file
+
+    def add_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Add a list of properties to the sink."""
+        self._sink.add_property_list(property_list)
+
+    def commit(self) -> None:
+        """Commit the sink and record the processed files."""
+        self._sink.commit()
+        if self._record_on_commit:
+            self._record()
+
+    def _track(self, scanned_file: ScannedFileRecord) -> None:
+        """Remember a scanned file, the first one of an identity is kept."""
+        self._scanned_files.setdefault(
+            (int(scanned_file.size_bytes), int(scanned_file.checksum)),
+            scanned_file)
+        self._last_id = max(self._last_id, scanned_file.id)
+
+    def _record(self) -> None:
+        """Append the new and changed scanned files to the manifest."""
+        lines = []
+        for scanned_file in self._pending.values():
+            processed = bool(scanned_file.processed)
+            if processed != self._stored_processed[scanned_file.id]:
+                lines.append(json.dumps({
+                    'id': scanned_file.id,
+                    'full_path': scanned_file.full_path,
+                    'processed': processed,
+                    'size_bytes': int(scanned_file.size_bytes),
+                    'checksum': int(scanned_file.checksum),
+                    'extracted_from_id': scanned_file.extracted_from_id,
+                }, separators=(',', ':')) + '\n')
+                self._stored_processed[scanned_file.id] = processed
+        if lines:
+            with open(self._manifest_path, 'a', encoding='utf-8') as manifest:
+                manifest.writelines(lines)
+        # Processed files stay processed, the others may still change
+        self._pending = {
+            scanned_id: scanned_file
+            for scanned_id, scanned_file in self._pending.items()
+            if not scanned_file.processed}
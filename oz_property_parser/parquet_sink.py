@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""Write the parsed sales as a Parquet dataset.
+
+The dataset is a directory, each run adds its own "part-*.parquet" files
+so earlier runs are kept. With partition_by_year the files are written to
+Hive style "Contract_Year=YYYY" sub directories. The columns follow the
+PropertyData order with the types of the typed representation, read the
+dataset with e.g. pyarrow.parquet.read_table(dataset_path).
+"""
+
+import datetime
+import logging
+import os
+import time
+import uuid
+
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow
+import pyarrow.parquet
+
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+DEFAULT_COMPRESSION = 'snappy'
+
+YEAR_PARTITION = 'Contract_Year'
+# Partition of the sales without a contract date, read as null by pyarrow
+UNKNOWN_YEAR_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Low cardinality columns stored dictionary encoded
+DICTIONARY_COLUMNS = [
+    property_parser.PropertyData.DISTRICT_CODE.value,
+    property_parser.PropertyData.DISTRICT.value,
+    property_parser.PropertyData.SUBBURB.value,
+    property_parser.PropertyData.ZONE_CODE.value,
+    property_parser.PropertyData.ZONE.value,
+    property_parser.PropertyData.ZONE_TYPE.value,
+]
+
+_ARROW_TYPES = {
+    int: pyarrow.int64(),
+    float: pyarrow.float64(),
+    datetime.date: pyarrow.date32(),
+    str: pyarrow.string(),
+}
+
+_CONTRACT_DATE = property_parser.PropertyData.CONTRACT_DATE
+
+
+def arrow_schema(columns: List[str]) -> pyarrow.Schema:
+    """Get the schema of the given PropertyData columns."""
+    return pyarrow.schema([
+        (field.value, _ARROW_TYPES[property_parser.get_field_type(field)])
+        for field in property_parser.fields_from_names(columns)])
+
+
+class ParquetSink():
+    """Sink writing the properties to a Parquet dataset in row groups.
+
+    Same interface as file_sink.PropertySink. The properties are buffered
+    until a row group is complete, the files of a run only appear in the
+    dataset once the sink is closed without an error.
+    """
+
+    def __init__(self, dataset_path: str,
+                 columns: Optional[List[str]] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 compression: str = DEFAULT_COMPRESSION,
+                 partition_by_year: bool = False) -> None:
+        """Initialize the sink writing the given columns (all if None)."""
+        if row_group_size < 1:
+            raise ValueError('"row_group_size" must be at least 1')
+        self._dataset_path = dataset_path
+        self._schema = arrow_schema(
+            columns if columns is not None else
+            [field.value for field in property_parser.PropertyData])
+        if partition_by_year and _CONTRACT_DATE.value not in \
+                self._schema.names:
+            raise ValueError(F'Partitioning requires the '
+                             F'{_CONTRACT_DATE.value} column')
+        self._row_group_size = row_group_size
+        self._compression = compression
+        self._partition_by_year = partition_by_year
+        self._file_name = (F'part-{time.strftime("%Y%m%dT%H%M%S")}-'
+                           F'{uuid.uuid4().hex[:8]}.parquet')
+        # Buffered rows and writers per partition ('' if not partitioned)
+        self._buffers: Dict[
+            str, List[Dict[str, property_parser.FieldValue]]] = {}
+        self._writers: Dict[str, pyarrow.parquet.ParquetWriter] = {}
+        self._property_total = 0
+
+    def __enter__(self) -> 'ParquetSink':
+        logger.info(F'Writing to: "{self._dataset_path}"')
+        os.makedirs(self._dataset_path, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            for partition in list(self._buffers):
+                self._write_row_group(partition)
+        for partition, writer in self._writers.items():
+            writer.close()
+            temp_path, path = self._paths(partition)
+            if exc_type is None:
+                os.replace(temp_path, path)
+            else:
+                os.remove(temp_path)
+        self._writers = {}
+        logger.debug(F'Added Properties: {self._property_total}')
+
+    def add_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Buffer the properties, full row groups are written."""
+        for prop in property_list:
+            row = self._typed_row(prop)
+            partition = ''
+            if self._partition_by_year:
+                contract_date = row[_CONTRACT_DATE.value]
+                partition = (str(contract_date.year) if contract_date
+                             else UNKNOWN_YEAR_PARTITION)
+            buffer = self._buffers.setdefault(partition, [])
+            buffer.append(row)
+            if len(buffer) >= self._row_group_size:
+                self._write_row_group(partition)
+        self._property_total += len(property_list)
+
+    def commit(self) -> None:
+        """Nothing to do, row groups are written when complete."""
+
+    def _typed_row(self, prop: Dict[str, property_parser.FieldValue]
+                   ) -> Dict[str, property_parser.FieldValue]:
+        """Get the values of the schema columns in the typed representation."""
+        row = {}
+        for name in self._schema.names:
+            field = property_parser.PropertyData(name)
+            value = prop.get(name)
+            try:
+                row[name] = property_parser.convert_to_typed(field, value)
+            except ValueError:
+                logger.debug(F'Writing invalid {name} as null: "{value}"')
+                row[name] = None
+        return row
+
+    def _write_row_group(self, partition: str) -> None:
+        """Write the buffered rows of a partition as a row group."""
+        rows = self._buffers.pop(partition, [])
+        if not rows:
+            return
+        writer = self._writers.get(partition)
+        if writer is None:
+            temp_path, _ = self._paths(partition)
+            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+            writer = self._writers[partition] = pyarrow.parquet.ParquetWriter(
+                temp_path, self._schema, compression=self._compression,
+                use_dictionary=[name for name in self._schema.names
+                                if name in DICTIONARY_COLUMNS])
+        writer.write_table(pyarrow.Table.from_pylist(rows, self._schema))
+
+    def _paths(self, partition: str) -> Tuple[str, str]:
+        """Get the path written to and the final path of a partition file."""
+        directory = self._dataset_path
+        if partition:
+            directory = os.path.join(directory,
+                                     F'{YEAR_PARTITION}={partition}')
+        # Files starting with "." are ignored when reading the dataset
+        return (os.path.join(directory, '.' + self._file_name),
+                os.path.join(directory, self._file_name))
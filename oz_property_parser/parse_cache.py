@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""Cache of parsed property files to rebuild databases without parsing.
+
+Each parsed file is stored as a compressed batch identified by the size and
+checksum of the source file. Batches live in a directory per property file
+class and parser fingerprint, changing the parsing logic invalidates them.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+import zlib
+
+from typing import Dict, Iterator, List, NamedTuple, Optional, Type
+
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+CACHE_FORMAT_VERSION = 1
+
+_ENTRY_EXTENSION = '.batch'
+
+
+class CacheEntry(NamedTuple):
+    """Parsed property file stored in the cache."""
+
+    full_path: str
+    size_bytes: int
+    checksum: int
+    property_list: List[Dict[str, property_parser.FieldValue]]
+
+
+class ParseCache():
+    """Directory based cache of parsed property files."""
+
+    def __init__(self, cache_dir: str) -> None:
+        """Initialize the parse cache."""
+        self._cache_dir = cache_dir
+
+    def load(self, property_class: Type[property_parser.PropertyFile],
+             size: int, checksum: int) -> Optional[CacheEntry]:
+        """Load the cached parse result, None if not cached."""
+        entry_path = self._entry_path(property_class, size, checksum)
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            entry = _read_entry(entry_path)
+        except (OSError, ValueError, KeyError, zlib.error) as error:
+            logger.warning(F'Ignoring invalid cache entry "{entry_path}", '
+                           F'Error: "{error}"')
+            return None
+
+        logger.info(F'Loaded {len(entry.property_list)} properties from '
+                    F'cache "{entry_path}"')
+        return entry
+
+    def store(self, property_class: Type[property_parser.PropertyFile],
+              entry: CacheEntry) -> None:
+        """Store the parse result of a property file."""
+        entry_path = self._entry_path(property_class, entry.size_bytes,
+                                      entry.checksum)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        # Write to a temporary file first, never leave partial entries
+        temp_path = entry_path + '.tmp'
+        with open(temp_path, 'wb') as entry_file:
+            entry_file.write(_encode_entry(entry))
+        os.replace(temp_path, entry_path)
+        logger.debug(F'Stored cache entry "{entry_path}"')
+
+    def iter_entries(
+            self, property_classes: List[Type[property_parser.PropertyFile]]
+    ) -> Iterator[CacheEntry]:
+        """Iterate all valid entries of the given property file classes."""
+        for property_class in property_classes:
+            class_dir = self._class_dir(property_class)
+            if not os.path.isdir(class_dir):
+                continue
+            for file_name in sorted(os.listdir(class_dir)):
+                if file_name.endswith(_ENTRY_EXTENSION):
+                    entry_path = os.path.join(class_dir, file_name)
+                    try:
+                        yield _read_entry(entry_path)
+                    except (OSError, ValueError, KeyError,
+                            zlib.error) as error:
+                        logger.warning(
+                            F'Ignoring invalid cache entry "{entry_path}", '
+                            F'Error: "{error}"')
+
+    def _class_dir(
+            self, property_class: Type[property_parser.PropertyFile]) -> str:
+        """Get the cache directory of the current parser version."""
+        return os.path.join(self._cache_dir, F'{property_class.__name__}_'
+                            F'{parser_fingerprint(property_class)}')
+
+    def _entry_path(self, property_class: Type[property_parser.PropertyFile],
+                    size: int, checksum: int) -> str:
+        """Get the path of the entry of the given file identity."""
+        return os.path.join(self._class_dir(property_class),
+                            F'{size}_{checksum}{_ENTRY_EXTENSION}')
+
+
+@functools.lru_cache(maxsize=None)
+def parser_fingerprint(
+        property_class: Type[property_parser.PropertyFile]) -> str:
+    """Get a fingerprint of the parsing logic of the property file class.
+
+    Covers the source of the module defining the class, the generic
+    property_parser module and all project modules imported by them, e.g.
+    the lookup tables used to enrich the properties.
+    """
+    module = sys.modules[property_class.__module__]
+    modules = {module, property_parser}
+    project_dir = os.path.dirname(os.path.abspath(property_parser.__file__))
+    for candidate in list(vars(module).values()):
+        if (inspect.ismodule(candidate) and
+                getattr(candidate, '__file__', None) and
+                os.path.dirname(os.path.abspath(
+                    str(candidate.__file__))) == project_dir):
+            modules.add(candidate)
+
+    digest = hashlib.sha256(F'{CACHE_FORMAT_VERSION}'.encode('utf8'))
+    for source_module in sorted(modules, key=lambda mod: mod.__name__):
+        digest.update(inspect.getsource(source_module).encode('utf8'))
+    return digest.hexdigest()[:16]
+
+
+def _encode_entry(entry: CacheEntry) -> bytes:
+    """Encode the entry as compressed batch of rows in column order."""
+    columns = [str(field.value) for field in property_parser.PropertyData]
+    batch = {
+        'version': CACHE_FORMAT_VERSION,
+        'full_path': entry.full_path,
+        'size_bytes': entry.size_bytes,
+        'checksum': entry.checksum,
+        'columns': columns,
+        'rows': [[prop.get(col) for col in columns]
+                 for prop in entry.property_list]
+    }
+    return zlib.compress(json.dumps(batch, separators=(',', ':'),
+                                    default=str).encode('utf8'))
+
+
+def _read_entry(entry_path: str) -> CacheEntry:
+    """Read and decode the entry of the given path."""
+    with open(entry_path, 'rb') as entry_file:
+        batch = json.loads(zlib.decompress(entry_file.read()).decode('utf8'))
+
+    if batch['version'] != CACHE_FORMAT_VERSION:
+        raise ValueError(F'Unsupported cache version "{batch["version"]}"')
+
+    columns = batch['columns']
+    property_list: List[Dict[str, property_parser.FieldValue]] = [
+        {col: value for col, value in zip(columns, row) if value is not None}
+        for row in batch['rows']]
+    return CacheEntry(batch['full_path'], batch['size_bytes'],
+                      batch['checksum'], property_list)
@@ -3,35 +3,430 @@
 """Main program to run the property data extractor."""
 
 import argparse
+import contextlib
 import csv
+import datetime
+import io
 import logging
 import os
 import shutil
+import time
 import zlib
 
-from typing import List
+from typing import (IO, Any, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Tuple, Type, Union, TYPE_CHECKING)
 
 import archive_mgr
-import db_store
+import file_sink
+import parse_cache
 import property_file_manager as prop_mgr
 import property_parser
 import project_logger
 
+if TYPE_CHECKING:
+    # The database backend (and SQLAlchemy) is only imported when used
+    import db_store  # pylint: disable=unused-import
+    # NumPy and pyarrow are only required by the npy and parquet outputs
+    import column_store  # pylint: disable=unused-import
+    import parquet_sink  # pylint: disable=unused-import
+    # DuckDB is only required by the duckdb output
+    import duckdb_store  # pylint: disable=unused-import
+
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Data managers keeping the scanned file bookkeeping
+DataManager = Union['db_store.DataManager', 'duckdb_store.DuckDbDataManager',
+                    file_sink.ProcessedFileSink]
+
+# Sinks receiving the parsed properties
+Sink = Union[DataManager, file_sink.PropertySink,
+             'column_store.ColumnStoreSink', 'parquet_sink.ParquetSink']
+
+_OUTPUT_FORMATS = ['sql', 'duckdb', 'csv', 'jsonl', 'npy', 'parquet']
+
+# Options only supported by the sql output
+_SQL_OPTIONS = ['reload_years', 'normalised', 'rebuild', 'dedup',
+                'aggregates', 'address_index', 'query_indexes', 'repeat_sales',
+                'memory_budget', 'shard_workers', 'quarantine',
+                'reprocess_quarantine']
+
+# Options of the sql output also supported by the duckdb output
+_DUCKDB_OPTIONS = ['dedup']
+
+# Options only supported by the parquet output
+_PARQUET_OPTIONS = ['row_group_size', 'compression']
+
+_PARQUET_COMPRESSIONS = ['snappy', 'gzip', 'zstd', 'brotli', 'lz4', 'none']
+
+DEFAULT_COMMIT_MAX = 1000000
+
+DEFAULT_MAX_LINE_ERRORS = 100
+
+
+class IngestConfig(NamedTuple):
+    """Configuration of an ingestion run, see ingest()."""
+
+    # Directories searched for property files and archives
+    input_paths: List[str]
+    # Database, csv or jsonl file or column store or parquet dataset
+    # directory written to, depending on output
+    output_path: str
+    output: str = 'sql'
+    typed: bool = False
+    # Contract year partitions of the sql and parquet outputs
+    partitioned: bool = False
+    normalised: bool = False
+    reload_years: Optional[List[str]] = None
+    dedup: bool = False
+    aggregates: bool = False
+    address_index: bool = False
+    query_indexes: bool = False
+    repeat_sales: bool = False
+    cache_dir: Optional[str] = None
+    rebuild: bool = False
+    stream_archives: bool = False
+    unzip_workers: Optional[int] = None
+    commit_max: int = DEFAULT_COMMIT_MAX
+    # Flush by memory instead of commit_max only, in bytes
+    memory_budget: Optional[int] = None
+    # Parse in processes writing their own shard, see work_queue
+    shard_workers: Optional[int] = None
+    # Write without durability, see db_store.SqliteDb
+    bulk_load: bool = False
+    # Store lines failing parsing in the QuarantinedLine table, files with
+    # more than max_line_errors of them are aborted
+    quarantine: bool = False
+    max_line_errors: int = DEFAULT_MAX_LINE_ERRORS
+    # Parse the quarantined lines again instead of scanning input_paths
+    reprocess_quarantine: bool = False
+    # Only parse the matching sales, the files are still flagged processed
+    record_filter: Optional[property_parser.RecordFilter] = None
+    # Only extract these PropertyData columns, all if None. New databases
+    # only store these columns
+    columns: Optional[List[str]] = None
+    # Rows per row group and compression of the parquet output, see
+    # parquet_sink
+    row_group_size: Optional[int] = None
+    compression: Optional[str] = None
+
+
+class IngestSummary():  # pylint: disable=too-few-public-methods
+    """Summary of an ingestion run."""
+
+    def __init__(self) -> None:
+        """Initialize an empty summary."""
+        self.files_processed = 0
+        # Files processed by a previous run
+        self.files_skipped = 0
+        # Files that could not be identified or extracted
+        self.files_failed = 0
+        # Files exceeding the line error budget, not flagged processed
+        self.files_aborted = 0
+        self.lines_quarantined = 0
+        # Sales skipped by the record filter
+        self.lines_filtered = 0
+        self.property_count = 0
+        self.duplicate_counts: Dict[str, int] = {}
+        self.duration_seconds = 0.0
+
+    def __repr__(self) -> str:
+        """Represent the summary."""
+        return (F'IngestSummary(files_processed={self.files_processed}, '
+                F'files_skipped={self.files_skipped}, '
+                F'files_failed={self.files_failed}, '
+                F'files_aborted={self.files_aborted}, '
+                F'lines_quarantined={self.lines_quarantined}, '
+                F'lines_filtered={self.lines_filtered}, '
+                F'property_count={self.property_count}, '
+                F'duplicates={sum(self.duplicate_counts.values())}, '
+                F'duration_seconds={self.duration_seconds:.3f})')
+
+
+class ParseOptions():  # pylint: disable=too-few-public-methods
+    """Options shared by all files of a parse run."""
+
+    def __init__(self, typed: bool = False,
+                 interner: Optional[property_parser.StringInterner] = None,
+                 cache: Optional[parse_cache.ParseCache] = None,
+                 stream_archives: bool = False,
+                 unzip_workers: Optional[int] = None,
+                 max_line_errors: Optional[int] = None,
+                 record_filter: Optional[property_parser.RecordFilter] = None,
+                 columns: Optional[List[property_parser.PropertyData]] = None
+                 ) -> None:
+        """Initialize the parse options.
+
+        Lines failing parsing are quarantined if max_line_errors is given,
+        only the sales matching the record_filter are parsed and only the
+        given columns extracted, see property_parser.PropertyFile.
+        """
+        self.typed = typed
+        self.interner = interner
+        self.cache = cache
+        self.stream_archives = stream_archives
+        self.unzip_workers = unzip_workers
+        self.max_line_errors = max_line_errors
+        self.record_filter = record_filter
+        self.columns = columns
+        self.summary = IngestSummary()
+
+    def iter_archive_members(
+            self, archive_path: str) -> Iterator[archive_mgr.ArchiveMember]:
+        """Stream the archive members, zips in parallel if requested."""
+        if self.unzip_workers is not None:
+            return archive_mgr.iter_archive_members_parallel(
+                archive_path, self.unzip_workers)
+        return archive_mgr.iter_archive_members(archive_path)
+
+    def create_property_file(
+            self, file_path: str,
+            property_class: Optional[
+                Type[property_parser.PropertyFile]] = None
+    ) -> property_parser.PropertyFile:
+        """Create the property file object for the given path.
+
+        The class is identified from the path unless property_class is
+        given.
+        """
+        if property_class is None:
+            property_class = prop_mgr.get_property_file_from_path(file_path)
+        # The cache stores the untyped properties, convert after storing
+        return property_class(file_path, self.typed and self.cache is None,
+                              self.interner, self.max_line_errors,
+                              self.record_filter, self.columns)
+
+    def prepare_property_list(
+            self, property_list: List[Dict[str, property_parser.FieldValue]]
+    ) -> None:
+        """Prepare untyped properties (e.g. from the cache) for writing."""
+        for fields in property_list:
+            if self.typed:
+                property_parser.convert_fields_to_typed(fields)
+            if self.interner is not None:
+                self.interner.intern_fields(fields)
+
 
 def parse_args() -> argparse.Namespace:
     """Set up command line arguments for Transdump."""
     parser = argparse.ArgumentParser()
     parser.add_argument('dir',
                         help='Base search Dir for property Files')
+    parser.add_argument('--output', choices=_OUTPUT_FORMATS, default='sql',
+                        help='Output format, duckdb is an analytical '
+                             'database (see duckdb_store.py), csv, jsonl, '
+                             'npy (a NumPy column store, see column_store.py) '
+                             'and parquet (a dataset directory, see '
+                             'parquet_sink.py) stream the properties without '
+                             'a database, the files processed are recorded '
+                             'in <output>.processed (default: sql)')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='Store the sales data in contract year '
+                             'partitions (new databases and parquet only)')
+    parser.add_argument('--row-group-size', type=int, metavar='N',
+                        help='Rows per parquet row group')
+    parser.add_argument('--compression', choices=_PARQUET_COMPRESSIONS,
+                        help='Parquet compression')
+    parser.add_argument('--reload-year', metavar='YEAR', action='append',
+                        help='Drop the given contract year partition of a '
+                             'partitioned database and reload it, can be '
+                             'given multiple times')
+    parser.add_argument('--normalised', action='store_true',
+                        help='Store repeated strings in dimension tables '
+                             '(new databases only)')
+    parser.add_argument('--cache-dir',
+                        help='Cache parsed files in this directory and reuse '
+                             'them instead of parsing again')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Populate the database from the cache only, '
+                             'without scanning "dir" (requires --cache-dir)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Drop sales already stored, identified by '
+                             'district, property id, contract date and price')
+    parser.add_argument('--typed', action='store_true',
+                        help='Store numbers and dates typed, existing '
+                             'databases are migrated')
+    parser.add_argument('--aggregates', action='store_true',
+                        help='Maintain price statistics per suburb and '
+                             'district per quarter, see sales_aggregates.py')
+    parser.add_argument('--address-index', action='store_true',
+                        help='Maintain a full text index of the sale '
+                             'addresses, see db_store.search_addresses()')
+    parser.add_argument('--query-indexes', action='store_true',
+                        help='Index the columns filtered by sales_query')
+    parser.add_argument('--repeat-sales', action='store_true',
+                        help='Link consecutive sales of the same property, '
+                             'see sales_query.repeat_sales()')
+    parser.add_argument('--memory-budget', metavar='MB', type=int,
+                        help='Flush the buffered sales when they use about '
+                             'MB megabytes, batch sizes adapt to the insert '
+                             'throughput')
+    parser.add_argument('--stream-archives', action='store_true',
+                        help='Parse archives directly instead of extracting '
+                             'them to disk first')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='Store lines failing parsing in the '
+                             'QuarantinedLine table instead of failing')
+    parser.add_argument('--max-line-errors', type=int, metavar='N',
+                        default=DEFAULT_MAX_LINE_ERRORS,
+                        help='Abort files with more than N quarantined '
+                             'lines, they are parsed again by the next run '
+                             '(default: %(default)s)')
+    parser.add_argument('--reprocess-quarantine', action='store_true',
+                        help='Parse the quarantined lines again, without '
+                             'scanning "dir"')
+    parser.add_argument('--shard-workers', type=int, metavar='N',
+                        help='Parse in N processes writing their own shard '
+                             'database, merged into the result at the end')
+    parser.add_argument('--unzip-workers', metavar='N', type=int,
+                        help='Decompress zip members on N threads, only '
+                             'with --stream-archives members are parsed as '
+                             'they complete, extracted archives are parsed '
+                             'once fully extracted')
+    parser.add_argument('--columns', metavar='COLUMN,...',
+                        type=lambda value: value.split(','),
+                        help='Only extract these columns, e.g. '
+                             'Contract_Date,Purchase_Price,Post_Code. New '
+                             'databases only store these columns')
+    filters = parser.add_argument_group(
+        'filters', 'Only parse the matching sales, checked before parsing '
+                   'the lines. The files are flagged processed, so use a '
+                   'separate database for filtered runs')
+    filters.add_argument('--district', metavar='CODE', action='append',
+                         help='District code, e.g. 011, can be given '
+                              'multiple times')
+    filters.add_argument('--post-code', action='append',
+                         help='Post code, can be given multiple times')
+    filters.add_argument('--start-date', type=parse_date_arg,
+                         metavar='YYYY-MM-DD',
+                         help='First contract date (inclusive)')
+    filters.add_argument('--end-date', type=parse_date_arg,
+                         metavar='YYYY-MM-DD',
+                         help='Last contract date (inclusive)')
     return parser.parse_args()
 
 
+def parse_date_arg(value: str) -> datetime.date:
+    """Parse a YYYY-MM-DD date argument."""
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(F'Invalid date "{value}"')
+
+
+def record_filter_from_args(
+        args: argparse.Namespace) -> Optional[property_parser.RecordFilter]:
+    """Create the record filter of the arguments, None if no filter."""
+    if (args.district is None and args.post_code is None and
+            args.start_date is None and args.end_date is None):
+        return None
+    return property_parser.RecordFilter(
+        district_codes=(frozenset(args.district)
+                        if args.district is not None else None),
+        post_codes=(frozenset(args.post_code)
+                    if args.post_code is not None else None),
+        start_date=args.start_date, end_date=args.end_date)
+
+
 def validate_args(args: argparse.Namespace) -> None:
     """Validate the command line arguments."""
-    if (not os.path.exists(args.dir)) or (not os.path.isdir(args.dir)):
-        raise ValueError(F'"{args.dir}" is not a vaid directory')
+    validate_config(config_from_args(args))
+
+
+def config_from_args(args: argparse.Namespace) -> IngestConfig:
+    """Create the ingestion config of the command line arguments."""
+    return IngestConfig(
+        input_paths=[args.dir],
+        output_path=os.path.join(args.dir,
+                                 F'ParseResult_Properties.{args.output}'),
+        output=args.output, typed=args.typed, partitioned=args.partitioned,
+        normalised=args.normalised, reload_years=args.reload_year,
+        dedup=args.dedup, aggregates=args.aggregates,
+        address_index=args.address_index, query_indexes=args.query_indexes,
+        repeat_sales=args.repeat_sales, cache_dir=args.cache_dir,
+        rebuild=args.rebuild, stream_archives=args.stream_archives,
+        unzip_workers=args.unzip_workers, shard_workers=args.shard_workers,
+        quarantine=args.quarantine, max_line_errors=args.max_line_errors,
+        reprocess_quarantine=args.reprocess_quarantine,
+        record_filter=record_filter_from_args(args), columns=args.columns,
+        row_group_size=args.row_group_size, compression=args.compression,
+        memory_budget=(args.memory_budget * 2**20
+                       if args.memory_budget is not None else None))
+
+
+def validate_config(config: IngestConfig) -> None:
+    """Validate the ingestion config."""
+    for path in config.input_paths:
+        if (not os.path.exists(path)) or (not os.path.isdir(path)):
+            raise ValueError(F'"{path}" is not a vaid directory')
+    if config.output not in _OUTPUT_FORMATS:
+        raise ValueError(F'Unknown output "{config.output}"')
+    if config.unzip_workers is not None and config.unzip_workers < 1:
+        raise ValueError('"unzip_workers" must be at least 1')
+    if config.memory_budget is not None and config.memory_budget < 1:
+        raise ValueError('"memory_budget" must be at least 1')
+    if config.shard_workers is not None:
+        if config.shard_workers < 1:
+            raise ValueError('"shard_workers" must be at least 1')
+        if config.rebuild or config.reload_years:
+            raise ValueError('"shard_workers" cannot be combined with '
+                             '"rebuild" or "reload_years"')
+    if config.max_line_errors < 0:
+        raise ValueError('"max_line_errors" must not be negative')
+    if config.reprocess_quarantine and (config.rebuild or
+                                        config.shard_workers):
+        raise ValueError('"reprocess_quarantine" cannot be combined with '
+                         '"rebuild" or "shard_workers"')
+    if config.commit_max < 1:
+        raise ValueError('"commit_max" must be at least 1')
+    if config.columns is not None:
+        property_parser.fields_from_names(config.columns)
+        if not config.columns:
+            raise ValueError('"columns" must not be empty')
+        if config.cache_dir:
+            raise ValueError('"columns" cannot be combined with "cache_dir"')
+        if config.output == 'sql':
+            check_feature_columns({
+                'partitioned': config.partitioned or bool(config.reload_years),
+                'dedup': config.dedup, 'aggregates': config.aggregates,
+                'address_index': config.address_index,
+                'query_indexes': config.query_indexes,
+                'repeat_sales': config.repeat_sales}, config.columns)
+        elif config.output == 'duckdb':
+            check_feature_columns({'dedup': config.dedup}, config.columns)
+        elif (config.partitioned and
+              property_parser.PropertyData.CONTRACT_DATE.value
+              not in config.columns):
+            raise ValueError('"partitioned" requires the columns: '
+                             'Contract_Date')
+    if config.record_filter is not None:
+        if config.cache_dir or config.reprocess_quarantine:
+            # The cache stores the sales of whole files
+            raise ValueError('"record_filter" cannot be combined with '
+                             '"cache_dir" or "reprocess_quarantine"')
+        start_date = config.record_filter.start_date
+        end_date = config.record_filter.end_date
+        if (start_date is not None and end_date is not None and
+                start_date > end_date):
+            raise ValueError('The filter start date is after the end date')
+    if config.rebuild and not config.cache_dir:
+        raise ValueError('"rebuild" requires "cache_dir"')
+    if config.output != 'sql':
+        for option in _SQL_OPTIONS:
+            if config.output == 'duckdb' and option in _DUCKDB_OPTIONS:
+                continue
+            if getattr(config, option):
+                raise ValueError(F'"{option}" requires the sql output')
+    if config.output != 'parquet':
+        for option in _PARQUET_OPTIONS:
+            if getattr(config, option):
+                raise ValueError(F'"{option}" requires the parquet output')
+    if config.partitioned and config.output not in ('sql', 'parquet'):
+        raise ValueError('"partitioned" requires the sql or parquet output')
+    if config.row_group_size is not None and config.row_group_size < 1:
+        raise ValueError('"row_group_size" must be at least 1')
+    if (config.compression is not None and
+            config.compression not in _PARQUET_COMPRESSIONS):
+        raise ValueError(F'Unknown compression "{config.compression}"')
 
 
 def file_size(file_path) -> int:
@@ -49,15 +444,34 @@ def checksum_adler32(file_path) -> int:
     return csum
 
 
-def setup_scanned_file(sql_data_manager: db_store.DataManager, file_path: str,
-                       extracted_from=None):
-    """Set up the scanned file object for this file."""
-    size = file_size(file_path)
-    checksum = checksum_adler32(file_path)
+def file_obj_identity(file_obj: io.BytesIO) -> Tuple[int, int]:
+    """Get the size and adler32 checksum of a buffered file."""
+    return (file_obj.getbuffer().nbytes,
+            zlib.adler32(file_obj.getbuffer()) & 0xffffffff)
+
+
+def setup_scanned_file(sql_data_manager: DataManager,
+                       file_path: str, extracted_from=None,
+                       file_obj: Optional[io.BytesIO] = None):
+    """Set up the scanned file object for this file.
+
+    Files streamed from archives are identified by their buffered content.
+    """
+    if file_obj is not None:
+        size, checksum = file_obj_identity(file_obj)
+    else:
+        size = file_size(file_path)
+        checksum = checksum_adler32(file_path)
 
     db_file_entry = sql_data_manager.find_scanned_file(size, checksum)
     if not db_file_entry:
-        db_file_entry = db_store.ScannedFile(
+        if isinstance(sql_data_manager, file_sink.ProcessedFileSink):
+            # The file outputs don't need the database backend
+            scanned_file_class: Any = file_sink.ScannedFileRecord
+        else:
+            import db_store  # pylint: disable=import-outside-toplevel
+            scanned_file_class = db_store.ScannedFile
+        db_file_entry = scanned_file_class(
             full_path=file_path, processed=False, size_bytes=size,
             checksum=checksum, extracted_from_id=extracted_from)
         sql_data_manager.add_scanned_file(db_file_entry)
@@ -65,21 +479,26 @@ def setup_scanned_file(sql_data_manager: db_store.DataManager, file_path: str,
     return db_file_entry
 
 
-def write_property_to_sql(sql_data_manager: db_store.DataManager,
-                          property_file: property_parser.PropertyFile) -> None:
-    """Write the Property file data to SQL."""
+def write_property_to_sql(sql_data_manager: Sink,
+                          property_file: property_parser.PropertyFile) -> int:
+    """Write the Property file data to SQL (or any other sink).
+
+    Returns the number of properties written.
+    """
     property_data = property_file.get_lines_as_list()
 
     sql_data_manager.add_property_list(property_data)
+    return len(property_data)
 
 
-def get_csv_keys() -> List[str]:
-    """Create a list of csv keys."""
+def get_csv_keys(columns: Optional[List[str]] = None) -> List[str]:
+    """Create a list of csv keys, of the given columns only if given."""
     key_list = []
     ignore_keys: List[property_parser.PropertyData] = []
 
     for field in property_parser.PropertyData:
-        if field not in ignore_keys:
+        if field not in ignore_keys and (columns is None or
+                                         field.value in columns):
             key_list.append(field.value)
 
     logger.debug(F'Created Key List: {key_list}')
@@ -108,10 +527,177 @@ def write_property_to_csv(csv_path: str,
         dict_writer.writerows(csv_data)
 
 
-def parse_path(sql_data_manager: db_store.DataManager, path: str,
-               csv_path: str, parent_file_id=None) -> None:
-    """Parse the path for Property files."""
+def process_property_file(sink: Sink, file_path: str,
+                          property_file: property_parser.PropertyFile,
+                          db_file_entry, options: ParseOptions,
+                          file_obj: Optional[IO[bytes]] = None) -> bool:
+    """Parse the property file (or load it from the cache) into the sink.
+
+    If file_obj is given the property file is parsed from it, a cache
+    requires it to be buffered in memory. Returns False if the file was
+    aborted for exceeding the line error budget.
+    """
+    if options.cache is not None:
+        if db_file_entry is not None:
+            size = db_file_entry.size_bytes
+            checksum = db_file_entry.checksum
+        elif isinstance(file_obj, io.BytesIO):
+            size, checksum = file_obj_identity(file_obj)
+        else:
+            size = file_size(file_path)
+            checksum = checksum_adler32(file_path)
+
+        entry = options.cache.load(type(property_file), size, checksum)
+        if entry is not None:
+            options.prepare_property_list(entry.property_list)
+            sink.add_property_list(entry.property_list)
+            options.summary.files_processed += 1
+            options.summary.property_count += len(entry.property_list)
+            return True
+
+    logger.info('Parse Log File')
+    try:
+        if file_obj is not None:
+            property_file.parse_file_obj(file_obj)
+        else:
+            property_file.parse()
+        logger.info('Parsing complete')
+
+        quarantined = property_file.quarantined_lines
+        if options.cache is not None:
+            # Files with quarantined lines are parsed (and quarantined)
+            # again, the cache only stores the properties
+            if not quarantined:
+                # Store the untyped properties, so the cache serves every
+                # layout
+                options.cache.store(
+                    type(property_file), parse_cache.CacheEntry(
+                        file_path, size, checksum,
+                        property_file.get_lines_as_list()))
+            if options.typed:
+                property_file.convert_types()
+                quarantined = property_file.quarantined_lines
+    except property_parser.ErrorBudgetExceeded as error:
+        logger.error(F'Aborting "{file_path}": {error}')
+        options.summary.files_aborted += 1
+        return False
+    options.summary.lines_filtered += property_file.filtered_count
+
+    if options.max_line_errors is not None:
+        sink.add_quarantined_lines(file_path, quarantined,
+                                   type(property_file))
+        options.summary.lines_quarantined += len(quarantined)
+
+    logger.info('Export')
+    options.summary.property_count += write_property_to_sql(sink,
+                                                            property_file)
+    options.summary.files_processed += 1
+    logger.info('Export complete')
+    return True
+
+
+def rebuild_from_cache(sql_data_manager: 'db_store.DataManager',
+                       options: ParseOptions) -> None:
+    """Populate the database from the cache without parsing any file."""
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    if options.cache is None:
+        raise ValueError('Rebuild requires a parse cache')
+
+    for entry in options.cache.iter_entries(
+            prop_mgr.get_property_file_classes()):
+        db_file_entry = sql_data_manager.find_scanned_file(
+            entry.size_bytes, entry.checksum)
+        if not db_file_entry:
+            db_file_entry = db_store.ScannedFile(
+                full_path=entry.full_path, processed=False,
+                size_bytes=entry.size_bytes, checksum=entry.checksum)
+            sql_data_manager.add_scanned_file(db_file_entry)
+
+        if db_file_entry.processed:
+            logger.info(F'Skipping "{entry.full_path}", previously processed')
+            options.summary.files_skipped += 1
+            continue
+
+        logger.info(F'Rebuild "{entry.full_path}" from cache')
+        options.prepare_property_list(entry.property_list)
+        sql_data_manager.add_property_list(entry.property_list)
+        options.summary.files_processed += 1
+        options.summary.property_count += len(entry.property_list)
+        db_file_entry.processed = True
+
+
+def parse_archive_stream(
+        sql_data_manager: Optional[DataManager],
+        archive_path: str, sink: Sink, archive_file_id=None,
+        options: Optional[ParseOptions] = None,
+        members: Optional[Iterable[archive_mgr.ArchiveMember]] = None
+) -> None:
+    """Parse the property files of an archive without extracting it.
+
+    Only the given members are parsed if members is given.
+    """
+    if options is None:
+        options = ParseOptions()
+    if members is None:
+        members = options.iter_archive_members(archive_path)
+
+    for member in members:
+        if not prop_mgr.file_can_be_parsed(member.path):
+            logger.info(F'Cannot Parse "{member.path}", SKIP')
+            continue
+        logger.info(F'Process "{member.path}"')
+
+        file_obj: IO[bytes] = member.file_obj
+        db_file_entry = None
+        if sql_data_manager is not None or options.cache is not None:
+            # The identity of the member is needed before parsing it
+            try:
+                file_obj = io.BytesIO(member.file_obj.read())
+            except archive_mgr.ExtractionError as error:
+                logger.error(F'Extraction Error: "{error}"')
+                options.summary.files_failed += 1
+                continue
+        if sql_data_manager is not None:
+            db_file_entry = setup_scanned_file(
+                sql_data_manager, member.path, archive_file_id, file_obj)
+            if db_file_entry.processed:
+                logger.info(F'Skipping, File previously processed')
+                options.summary.files_skipped += 1
+                continue
+
+        processed = True
+        try:
+            property_file = options.create_property_file(member.path)
+        except ValueError as error:
+            logger.error(F'Failed to Identify Property File: {error}')
+            options.summary.files_failed += 1
+        else:
+            try:
+                processed = process_property_file(
+                    sink, member.path, property_file, db_file_entry,
+                    options, file_obj)
+            except archive_mgr.ExtractionError as error:
+                # Corrupt members fail, the other members are still parsed
+                logger.error(F'Extraction Error: "{error}"')
+                options.summary.files_failed += 1
+                processed = False
+
+        if db_file_entry is not None:
+            db_file_entry.processed = processed
+
+
+def parse_path(sql_data_manager: Optional[DataManager], path: str,
+               sink: Sink, parent_file_id=None,
+               options: Optional[ParseOptions] = None) -> None:
+    """Parse the path for Property files.
+
+    Without a sql_data_manager no scanned file bookkeeping is done and every
+    file found is processed.
+    """
     logger.info(F'Parse "{path}", ParentFileId: "{parent_file_id}"')
+    if options is None:
+        options = ParseOptions()
 
     for root, _, files in os.walk(path):
         for filename in files:
@@ -125,30 +711,57 @@ def parse_path(sql_data_manager: db_store.DataManager, path: str,
                 logger.info(F'Cannot Parse "{file_path}", SKIP')
                 continue
 
-            # Setup Scanned file in the DB
-            db_file_entry = setup_scanned_file(sql_data_manager,
-                                               file_path, parent_file_id)
+            db_file_entry = None
+            if sql_data_manager is not None:
+                # Setup Scanned file in the DB
+                db_file_entry = setup_scanned_file(sql_data_manager,
+                                                   file_path, parent_file_id)
 
-            # Don't process the file if done previously
-            if db_file_entry.processed:
-                logger.info(F'Skipping, File previously processed')
-                continue
+                # Don't process the file if done previously
+                if db_file_entry.processed:
+                    logger.info(F'Skipping, File previously processed')
+                    options.summary.files_skipped += 1
+                    continue
+
+            # Archives are processed unless a file of them was aborted
+            aborted_count = options.summary.files_aborted
+            processed = True
 
             # Check file for extraction
-            if archive_mgr.file_is_archive(file_path):
+            if (archive_mgr.file_is_archive(file_path) and
+                    options.stream_archives):
+                logger.info(F'Streaming "{file_path}"')
+                try:
+                    parse_archive_stream(
+                        sql_data_manager, file_path, sink,
+                        db_file_entry.id if db_file_entry else None, options)
+                except archive_mgr.ExtractionError as error:
+                    logger.exception(F'Extraction Error: "{error}"')
+                    options.summary.files_failed += 1
+                    continue
+
+                # Commit for each archive to not delay too much
+                sink.commit()
+
+            elif archive_mgr.file_is_archive(file_path):
                 dest_dir = os.path.join(root, 'EXTRACT_' + filename)
                 logger.info(F'Extracting "{file_path}" to "{dest_dir}"')
                 try:
-                    archive_mgr.extract(file_path, dest_dir)
+                    archive_mgr.extract(file_path, dest_dir,
+                                        options.unzip_workers)
                 except archive_mgr.ExtractionError as error:
-                    logger.exception('Extraction Error: "{error}"')
+                    logger.exception(F'Extraction Error: "{error}"')
+                    options.summary.files_failed += 1
+                    # Don't leave partially extracted files in the input tree
+                    shutil.rmtree(dest_dir, ignore_errors=True)
                 else:
                     # Recursion - Check the Extracted folder for Files as well
-                    parse_path(sql_data_manager, dest_dir, csv_path,
-                               db_file_entry.id)
+                    parse_path(sql_data_manager, dest_dir, sink,
+                               db_file_entry.id if db_file_entry else None,
+                               options)
 
                     # Commit for each archive to not delay too much
-                    sql_data_manager.commit()
+                    sink.commit()
 
                     # Delete the created folder again
                     logger.debug(F'Deleting Extration directory "{dest_dir}"')
@@ -163,32 +776,286 @@ def parse_path(sql_data_manager: db_store.DataManager, path: str,
             else:
                 # Process the file as property file
                 try:
-                    property_class = prop_mgr.get_property_file_from_path(
-                        file_path)
-                    property_file = property_class(file_path)
+                    property_file = options.create_property_file(file_path)
                 except ValueError as error:
                     logger.error(F'Failed to Identify Property File: {error}')
+                    options.summary.files_failed += 1
                 else:
-                    logger.info('Parse Log File')
-                    property_file.parse()
-                    logger.info('Parsing complete')
+                    processed = process_property_file(
+                        sink, file_path, property_file, db_file_entry,
+                        options)
 
-                    # logger.info('Export to CSV')
-                    # write_property_to_csv(csv_path, property_file)
+            # Flag the File as Processed
+            if db_file_entry is not None:
+                db_file_entry.processed = (
+                    processed and options.summary.files_aborted ==
+                    aborted_count)
 
-                    logger.info('Export to SQL')
-                    write_property_to_sql(sql_data_manager, property_file)
-                    logger.info('Export complete')
 
-            # Flag the File as Processed
-            db_file_entry.processed = True
+def reprocess_quarantine(sql_data_manager: 'db_store.DataManager',
+                         options: ParseOptions) -> None:
+    """Parse the quarantined lines again, e.g. after fixing the parser.
+
+    Lines parsed now are written and removed from the quarantine, the
+    error of the others is updated.
+    """
+    for row in sql_data_manager.get_quarantined_lines():
+        try:
+            # Lines quarantined by older versions only have the file name
+            property_file = options.create_property_file(
+                row.full_path or row.file_name,
+                None if row.parser is None
+                else prop_mgr.get_property_file_class(row.parser))
+            # Quarantined records hold the continuation lines as well
+            lines = row.line.split('\n')
+            property_list = [
+                property_file.parse_line(lines[0], row.line_no, lines[1:])
+                .get_field_dic()]
+            options.prepare_property_list(property_list)
+        except ValueError as error:
+            logger.info(F'Line {row.line_no} of "{row.file_name}" still '
+                        F'fails parsing: {error}')
+            sql_data_manager.resolve_quarantined_line(row.id, str(error))
+            continue
+
+        sql_data_manager.add_property_list(property_list)
+        sql_data_manager.resolve_quarantined_line(row.id)
+        options.summary.property_count += 1
+
+
+@contextlib.contextmanager
+def sql_data_manager_scope(config: IngestConfig, options: ParseOptions
+                           ) -> Iterator['db_store.DataManager']:
+    """Provide the data manager of the configured SQL database."""
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    db_path = config.output_path
+    columns = get_csv_keys(config.columns)
+    db_exists = os.path.exists(db_path)
+    with db_store.SqliteDb(db_path, config.bulk_load) as database:
+        typed = config.typed
+        partitioned = config.partitioned
+        normalised = config.normalised
+        if db_exists:
+            partitioned = partitioned or database.is_partitioned()
+            normalised = normalised or database.is_normalised()
+            columns = database_columns(config, options,
+                                       database.sales_data_columns())
+            if database.is_typed():
+                typed = True
+            elif typed:
+                database.migrate_to_typed(columns)
+        if config.reload_years and not partitioned:
+            raise ValueError('"reload_years" requires a partitioned database')
+        database.create(columns, partitioned, typed, normalised)
+        options.typed = typed
+
+        with database.session_scope() as session:
+            if partitioned:
+                data_manager = db_store.PartitionedDataManager(
+                    session, columns, config.commit_max, config.reload_years,
+                    typed)
+                for year in config.reload_years or []:
+                    data_manager.drop_partition(year)
+            elif normalised:
+                data_manager = db_store.NormalisedDataManager(
+                    session, config.commit_max)
+            else:
+                data_manager = db_store.DataManager(session, config.commit_max)
+            features = {
+                'partitioned': partitioned,
+                # The natural key index rejects duplicates of later runs
+                'dedup': (config.dedup or
+                          db_store.has_natural_key_index(session)),
+                'aggregates': (config.aggregates or
+                               db_store.has_aggregates(session)),
+                'address_index': (config.address_index or
+                                  db_store.has_address_index(session)),
+                'query_indexes': (config.query_indexes or
+                                  db_store.has_query_indexes(session)),
+                'repeat_sales': (config.repeat_sales or
+                                 db_store.has_repeat_sales(session)),
+            }
+            if config.columns is not None:
+                check_feature_columns(features, config.columns)
+
+            if config.memory_budget:
+                data_manager.enable_memory_budget(config.memory_budget)
+            if features['dedup']:
+                data_manager.enable_deduplication()
+            if features['aggregates']:
+                data_manager.enable_aggregates()
+            if features['address_index']:
+                data_manager.enable_address_index()
+            if features['query_indexes']:
+                data_manager.enable_query_indexes()
+            if features['repeat_sales']:
+                data_manager.enable_repeat_sales()
+
+            with data_manager as sql_data_manager:
+                yield sql_data_manager
+
+            options.summary.duplicate_counts = data_manager.duplicate_counts
+            for file_name, count in data_manager.duplicate_counts.items():
+                logger.info(F'Duplicates dropped of "{file_name}": {count}')
+
+
+def database_columns(config: IngestConfig, options: ParseOptions,
+                     stored_columns: List[str]) -> List[str]:
+    """Get the sales data columns of the output database.
+
+    Existing databases (with stored_columns) keep their columns, only these
+    are extracted unless columns are requested.
+    """
+    columns = get_csv_keys(config.columns)
+    if not stored_columns:
+        return columns
+    missing = set(columns) - set(stored_columns)
+    if config.columns is not None and missing:
+        raise ValueError(F'"{config.output_path}" does not store the '
+                         F'columns: {", ".join(sorted(missing))}')
+    if config.columns is None:
+        options.columns = property_parser.fields_from_names(stored_columns)
+    return stored_columns
+
+
+def check_feature_columns(features: Dict[str, bool],
+                          columns: List[str]) -> None:
+    """Check that the extracted columns include those of the features."""
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    for feature, enabled in features.items():
+        missing = set(db_store.FEATURE_COLUMNS[feature]) - set(columns)
+        if enabled and missing:
+            raise ValueError(F'"{feature}" requires the columns: '
+                             F'{", ".join(sorted(missing))}')
+
+
+def parse_to_sql(config: IngestConfig, options: ParseOptions) -> None:
+    """Parse the property files into the SQL database."""
+    with sql_data_manager_scope(config, options) as sql_data_manager:
+        if config.rebuild:
+            rebuild_from_cache(sql_data_manager, options)
+        elif config.reprocess_quarantine:
+            reprocess_quarantine(sql_data_manager, options)
+        else:
+            # Process Log Dirs
+            for path in config.input_paths:
+                parse_path(sql_data_manager, path, sql_data_manager,
+                           options=options)
+
+
+def parse_to_duckdb(config: IngestConfig, options: ParseOptions) -> None:
+    """Parse the property files into the DuckDB database."""
+    import duckdb_store  # pylint: disable=import-outside-toplevel
+
+    with duckdb_store.DuckDb(config.output_path) as database:
+        stored_columns = database.sales_data_columns()
+        columns = database_columns(config, options, stored_columns)
+        typed = config.typed
+        if stored_columns:
+            if typed and not database.is_typed():
+                raise ValueError(F'"{config.output_path}" does not use the '
+                                 F'typed layout')
+            typed = database.is_typed()
+        database.create(columns, typed)
+        options.typed = typed
+
+        data_manager = duckdb_store.DuckDbDataManager(
+            database.connection, columns, typed, config.commit_max)
+        if config.dedup:
+            data_manager.enable_deduplication()
+        with data_manager as duckdb_data_manager:
+            for path in config.input_paths:
+                parse_path(duckdb_data_manager, path, duckdb_data_manager,
+                           options=options)
+
+        options.summary.duplicate_counts = data_manager.duplicate_counts
+        for file_name, count in data_manager.duplicate_counts.items():
+            logger.info(F'Duplicates dropped of "{file_name}": {count}')
+
+
+def parse_to_file(config: IngestConfig, options: ParseOptions) -> None:
+    """Stream the property files to a file, column store or dataset.
+
+    The processed files are recorded in a manifest next to the output, see
+    file_sink.ProcessedFileSink.
+    """
+    sink: Union[file_sink.PropertySink, 'column_store.ColumnStoreSink',
+                'parquet_sink.ParquetSink']
+    if config.output == 'csv':
+        sink = file_sink.CsvSink(config.output_path,
+                                 get_csv_keys(config.columns))
+    elif config.output == 'npy':
+        import column_store  # pylint: disable=import-outside-toplevel
+        sink = column_store.ColumnStoreSink(
+            config.output_path,
+            get_csv_keys(config.columns) if config.columns else None)
+    elif config.output == 'parquet':
+        import parquet_sink  # pylint: disable=import-outside-toplevel
+        sink = parquet_sink.ParquetSink(
+            config.output_path, config.columns,
+            config.row_group_size or parquet_sink.DEFAULT_ROW_GROUP_SIZE,
+            config.compression or parquet_sink.DEFAULT_COMPRESSION,
+            config.partitioned)
+    else:
+        sink = file_sink.JsonlSink(config.output_path)
+
+    # Reruns skip the files recorded next to the output, the parquet files
+    # only appear once the sink is closed
+    with file_sink.ProcessedFileSink(
+            sink, config.output_path + file_sink.MANIFEST_SUFFIX,
+            record_on_commit=config.output != 'parquet') as tracked_sink:
+        for path in config.input_paths:
+            parse_path(tracked_sink, path, tracked_sink, options=options)
+
+
+def create_parse_options(config: IngestConfig) -> ParseOptions:
+    """Create the parse options of an ingestion run."""
+    cache = (parse_cache.ParseCache(config.cache_dir)
+             if config.cache_dir else None)
+    return ParseOptions(
+        config.typed, property_parser.StringInterner(), cache,
+        config.stream_archives, config.unzip_workers,
+        (config.max_line_errors
+         if config.quarantine or config.reprocess_quarantine else None),
+        config.record_filter,
+        (property_parser.fields_from_names(config.columns)
+         if config.columns is not None else None))
+
+
+def ingest(config: IngestConfig) -> IngestSummary:
+    """Ingest the property files of the input paths into the output.
+
+    Library entry point of the extractor, the logging configuration is left
+    to the caller.
+    """
+    validate_config(config)
+    if config.shard_workers:
+        # The work queue builds on the extractor
+        import work_queue  # pylint: disable=import-outside-toplevel
+        return work_queue.ingest_sharded(config)
+
+    start_time = time.perf_counter()
+    options = create_parse_options(config)
+    if config.output == 'sql':
+        parse_to_sql(config, options)
+    elif config.output == 'duckdb':
+        parse_to_duckdb(config, options)
+    else:
+        parse_to_file(config, options)
+
+    options.summary.duration_seconds = time.perf_counter() - start_time
+    logger.info(F'Ingestion complete: {options.summary}')
+    return options.summary
 
 
 def main() -> None:
     """Run the log parser."""
     # Parse command line arguments
     args = parse_args()
-    validate_args(args)
+    config = config_from_args(args)
+    validate_config(config)
 
     # Setup the logger
     project_logger.setup_logger(
@@ -196,19 +1063,7 @@ def main() -> None:
 
     logger.info(F'Command Line Arguments: "{args}"')
 
-    db_path = os.path.join(args.dir, F'ParseResult_Properties.sql')
-    with db_store.SqliteDb(db_path) as database:
-        if not os.path.exists(db_path):
-            columns = [str(fld.value) for fld in property_parser.PropertyData]
-            database.create(columns)
-
-        with database.session_scope() as session:
-            with db_store.DataManager(session, 1000000) as sql_data_manager:
-
-                # Process Log Dir
-                parse_path(
-                    sql_data_manager, args.dir,
-                    os.path.join(args.dir, F'ParseResult_Properties.csv'))
+    ingest(config)
 
 
 if __name__ == '__main__':
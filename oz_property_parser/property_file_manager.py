@@ -1,30 +1,159 @@
 #!/usr/bin/env python3
 
-"""Module to manage the different known Property Files and parsers."""
+"""Module to manage the different known Property Files and parsers.
 
+Property file classes are registered with register_property_file_class().
+Files are identified by the NAME_PATTERN of the classes, files with an
+unknown name (e.g. renamed by a mirror) by the CONTENT_PATTERN matching a
+line at the start of the file.
+"""
+
+import logging
 import os
+import re
 
-from typing import Type
+from typing import List, Match, Optional, Pattern, Type
 
 import property_parser
 import property_parser_nsw
 
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Bytes read from the start of a file to identify it by the content
+SNIFF_BYTES = 512
+
+
+class FormatRegistry():
+    """Property file classes identified by file name or content.
+
+    The patterns of all classes are compiled into a single regular
+    expression, the first registered class matching wins.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._classes: List[Type[property_parser.PropertyFile]] = []
+        self._name_regex: Optional[Pattern[str]] = None
+        self._content_regex: Optional[Pattern[str]] = None
+
+    def register(self, property_class: Type[property_parser.PropertyFile]
+                 ) -> Type[property_parser.PropertyFile]:
+        """Register a property file class, usable as a class decorator."""
+        if (property_class.NAME_PATTERN is None and
+                property_class.CONTENT_PATTERN is None):
+            raise ValueError(F'{property_class.__name__} has no name or '
+                             F'content pattern')
+        if property_class not in self._classes:
+            self._classes.append(property_class)
+            self._name_regex = self._content_regex = None
+        return property_class
+
+    def classes(self) -> List[Type[property_parser.PropertyFile]]:
+        """Get the registered classes in the order of registration."""
+        return list(self._classes)
+
+    def class_from_name(self, file_name: str
+                        ) -> Optional[Type[property_parser.PropertyFile]]:
+        """Get the class of the file name, None if unknown."""
+        if self._name_regex is None:
+            self._name_regex = re.compile(self._alternation('NAME_PATTERN'),
+                                          re.IGNORECASE)
+        match = self._name_regex.fullmatch(file_name)
+        return self._matched_class(match)
+
+    def class_from_content(self, head: bytes
+                           ) -> Optional[Type[property_parser.PropertyFile]]:
+        """Get the class of the start of a file, None if unknown."""
+        if self._content_regex is None:
+            self._content_regex = re.compile(
+                F'^(?:{self._alternation("CONTENT_PATTERN")})', re.MULTILINE)
+        # A partial character at the end does not matter
+        match = self._content_regex.search(
+            head.decode('utf8', errors='replace'))
+        return self._matched_class(match)
+
+    def _alternation(self, attribute: str) -> str:
+        """Join the patterns of the classes, a named group per class."""
+        patterns = [F'(?P<class_{idx}>{getattr(prop_class, attribute)})'
+                    for idx, prop_class in enumerate(self._classes)
+                    if getattr(prop_class, attribute) is not None]
+        # An empty alternation never matches
+        return '|'.join(patterns) or '(?!)'
+
+    def _matched_class(self, match: Optional[Match[str]]
+                       ) -> Optional[Type[property_parser.PropertyFile]]:
+        """Get the class of the named group that matched."""
+        if match is None or match.lastgroup is None:
+            return None
+        return self._classes[int(match.lastgroup[len('class_'):])]
+
+
+_REGISTRY = FormatRegistry()
+
 _PROPERTY_FILE_CLASSES = [
     property_parser_nsw.NswOldPropertyFile,
     property_parser_nsw.NswNewPropertyFile
 ]
 
 
+def register_property_file_class(
+        property_class: Type[property_parser.PropertyFile]
+) -> Type[property_parser.PropertyFile]:
+    """Register a property file class, usable as a class decorator."""
+    return _REGISTRY.register(property_class)
+
+
+for _property_class in _PROPERTY_FILE_CLASSES:
+    register_property_file_class(_property_class)
+
+
+def read_file_head(path: str) -> Optional[bytes]:
+    """Read the start of a file, None if it is not a readable file."""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            return file.read(SNIFF_BYTES)
+    except OSError as error:
+        logger.debug(F'Cannot read "{path}": {error}')
+        return None
+
+
 def get_property_file_from_path(
-        path: str) -> Type[property_parser.PropertyFile]:
-    """Get the correct nsw property file object for the given file path."""
-    filename = os.path.basename(path)
+        path: str,
+        head: Optional[bytes] = None) -> Type[property_parser.PropertyFile]:
+    """Get the correct property file class for the given file path.
+
+    Files with an unknown name are identified by the content, from head
+    if given or else the start of the file at path.
+    """
+    property_class = _REGISTRY.class_from_name(os.path.basename(path))
+    if property_class is None:
+        if head is None:
+            head = read_file_head(path)
+        if head:
+            property_class = _REGISTRY.class_from_content(head)
+            if property_class is not None:
+                logger.debug(F'Identified "{path}" as '
+                             F'{property_class.__name__} by the content')
+
+    if property_class is None:
+        raise ValueError(F'{path} is not a Valid Property File')
+    return property_class
+
+
+def get_property_file_classes() -> List[Type[property_parser.PropertyFile]]:
+    """Get all known property file classes."""
+    return _REGISTRY.classes()
 
-    for prop_class in _PROPERTY_FILE_CLASSES:
-        if prop_class.name_allowed(filename):
-            return prop_class
 
-    raise ValueError(F'{path} is not a Valid Property File')
+def get_property_file_class(
+        class_name: str) -> Type[property_parser.PropertyFile]:
+    """Get the registered property file class of the given name."""
+    for property_class in _REGISTRY.classes():
+        if property_class.__name__ == class_name:
+            return property_class
+    raise ValueError(F'{class_name} is not a known Property File class')
 
 
 def file_can_be_parsed(file_path: str) -> bool:
@@ -5,13 +5,19 @@
 import collections
 import datetime
 import enum
+import io
 import logging
 import os
+import re
 
-from typing import Dict, List, Iterator
+from typing import (IO, Dict, FrozenSet, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Tuple, Type, Union)
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Most continuation records buffered for a single property
+MAX_CONTINUATION_LINES = 64
+
 
 @enum.unique
 class PropertyData(enum.Enum):
@@ -55,20 +61,108 @@ class PropertyData(enum.Enum):
     # pylint: enable=invalid-name
 
 
+# Value of a field, strings unless converted to the typed representation
+FieldValue = Union[str, int, float, datetime.date, None]
+
+# Field types of the typed representation, all other fields are strings
+_FIELD_TYPES: Dict[PropertyData, type] = {
+    PropertyData.LINE_NO: int,
+    PropertyData.AREA: float,
+    PropertyData.POST_CODE: int,
+    PropertyData.CONTRACT_DATE: datetime.date,
+    PropertyData.SETTLEMENT_DATE: datetime.date,
+    PropertyData.PURCHASE_PRICE: int,
+}
+
+# Field values that represent a missing value in the typed representation
+MISSING_VALUES = ('', 'N/A')
+
+# Low cardinality fields, a few hundred distinct values over all files
+CATEGORICAL_FIELDS = frozenset([
+    PropertyData.FILE_NAME,
+    PropertyData.AREA_TYPE,
+    PropertyData.DISTRICT_CODE,
+    PropertyData.DISTRICT,
+    PropertyData.SUBBURB,
+    PropertyData.POST_CODE,
+    PropertyData.NATURE_OF_PROPERTY,
+    PropertyData.PRIMARY_PURPOSE,
+    PropertyData.ZONE_CODE,
+    PropertyData.ZONE,
+    PropertyData.ZONE_TYPE,
+])
+
+
+class ErrorBudgetExceeded(ValueError):
+    """Too many lines of a property file failed parsing."""
+
+
+class QuarantinedLine(NamedTuple):
+    """Line of a property file that failed parsing."""
+
+    line_no: int
+    line: str
+    error: str
+
+
+class RecordFilter(NamedTuple):
+    """Sales parsed from the property files, all given conditions match.
+
+    Evaluated on the raw fields of the lines of interest before they are
+    parsed, see PropertyFile.raw_filter_fields(). The contract date range
+    is inclusive, sales without a valid contract date never match it.
+    """
+
+    district_codes: Optional[FrozenSet[str]] = None
+    post_codes: Optional[FrozenSet[str]] = None
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+
+    def date_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        """Get the contract date range as "YYYYMMDD" strings."""
+        start_date = (self.start_date.strftime('%Y%m%d')
+                      if self.start_date is not None else None)
+        end_date = (self.end_date.strftime('%Y%m%d')
+                    if self.end_date is not None else None)
+        return start_date, end_date
+
+
 class Property():
     """Property Line base class."""
 
-    def __init__(self, line: str) -> None:
-        """Initialize Property Line."""
+    def __init__(self, line: str,
+                 continuation_lines: Sequence[str] = ()) -> None:
+        """Initialize Property Line.
+
+        Continuation lines are further records of the property, see
+        PropertyFile.record_key().
+        """
         self.line = line
+        self.continuation_lines = list(continuation_lines)
+        # Fields extracted, all if None, see PropertyFile
+        self.columns: Optional[FrozenSet[PropertyData]] = None
+        # Line number in the property file, set by PropertyFile.parse_line()
+        self.line_no = 0
 
-        self._fields: Dict[str, str] = collections.defaultdict(str)
+        self._fields: Dict[str, FieldValue] = collections.defaultdict(str)
 
     def parse(self) -> bool:
         """Parse the property line."""
         raise NotImplementedError
 
-    def get_field_dic(self) -> Dict[str, str]:
+    def wants(self, key: PropertyData) -> bool:
+        """Check if the field is extracted, parsers skip the others."""
+        return self.columns is None or key in self.columns
+
+    def intern_fields(self, interner: 'StringInterner') -> None:
+        """Share the values of the categorical fields through the interner."""
+        interner.intern_fields(self._fields)
+
+    def convert_types(self) -> None:
+        """Convert the parsed fields to the typed representation."""
+        convert_fields_to_typed(self._fields)
+
+    def get_field_dic(self) -> Dict[str, FieldValue]:
         """Get a list of all the fields as dictionaries."""
         return self._fields
 
@@ -76,10 +170,11 @@ class Property():
     def _keytransform(key: PropertyData) -> str:
         return str(key.value)
 
-    def __setitem__(self, key: PropertyData, value: str) -> None:
-        self._fields[self._keytransform(key)] = value
+    def __setitem__(self, key: PropertyData, value: FieldValue) -> None:
+        if self.columns is None or key in self.columns:
+            self._fields[self._keytransform(key)] = value
 
-    def __getitem__(self, key: PropertyData) -> str:
+    def __getitem__(self, key: PropertyData) -> FieldValue:
         return self._fields[self._keytransform(key)]
 
     def __iter__(self) -> Iterator[str]:
@@ -95,14 +190,69 @@ class Property():
         del self._fields[self._keytransform(key)]
 
 
+class StringInterner():
+    """Intern table for the values of the categorical fields of a run.
+
+    Properties buffered for writing share a single object per distinct
+    value instead of holding a copy each.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the intern table."""
+        self._values: Dict[FieldValue, FieldValue] = {}
+
+    def intern(self, value: FieldValue) -> FieldValue:
+        """Get the shared object of the given value."""
+        return self._values.setdefault(value, value)
+
+    def intern_fields(self, fields: Dict[str, FieldValue]) -> None:
+        """Intern the categorical fields of the given field dictionary."""
+        for field in CATEGORICAL_FIELDS:
+            key = str(field.value)
+            if key in fields:
+                fields[key] = self.intern(fields[key])
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
 class PropertyFile():
     """Property File base class."""
 
-    def __init__(self, file_path: str):
-        """Initialize the generic property file."""
+    # Regular expression matching the whole file name (ignoring case)
+    NAME_PATTERN: Optional[str] = None
+    # Regular expression matching a line at the start of the file, used to
+    # detect files with an unknown name, see property_file_manager
+    CONTENT_PATTERN: Optional[str] = None
+
+    def __init__(self, file_path: str, typed: bool = False,
+                 interner: Optional[StringInterner] = None,
+                 max_errors: Optional[int] = None,
+                 record_filter: Optional[RecordFilter] = None,
+                 columns: Optional[Iterable[PropertyData]] = None):
+        """Initialize the generic property file.
+
+        If typed is set the fields are converted to the typed representation
+        while parsing, see get_field_type(). If an interner is given the
+        values of the CATEGORICAL_FIELDS are interned.
+        If max_errors is given, lines failing to parse are quarantined
+        instead of failing the file, see quarantined_lines. More than
+        max_errors quarantined lines raise ErrorBudgetExceeded.
+        Only the sales matching the record_filter are parsed. If columns
+        are given only these fields are extracted, converted and enriched.
+        """
         self._file_path = file_path
         self._encoding = 'utf8'
+        self._typed = typed
+        self._interner = interner
+        self._max_errors = max_errors
         self._properties: List[Property] = []
+        self._quarantined: List[QuarantinedLine] = []
+        self._record_filter = record_filter
+        self._date_bounds = (record_filter.date_bounds()
+                             if record_filter is not None else (None, None))
+        self._filtered_count = 0
+        self._columns = frozenset(columns) if columns is not None else None
         self._idx = 0
 
     @property
@@ -110,10 +260,23 @@ class PropertyFile():
         """Get the file name."""
         return os.path.basename(self._file_path)
 
-    @staticmethod
-    def name_allowed(file_name_candidate: str) -> bool:
+    @property
+    def quarantined_lines(self) -> List[QuarantinedLine]:
+        """Get the lines that failed parsing in the tolerant mode."""
+        return list(self._quarantined)
+
+    @property
+    def filtered_count(self) -> int:
+        """Get the number of sales skipped by the record filter."""
+        return self._filtered_count
+
+    @classmethod
+    def name_allowed(cls, file_name_candidate: str) -> bool:
         """Check if the given name is allowed."""
-        raise NotImplementedError
+        if cls.NAME_PATTERN is None:
+            raise NotImplementedError
+        return re.fullmatch(cls.NAME_PATTERN, file_name_candidate,
+                            re.IGNORECASE) is not None
 
     def create_property_from_line(self, line: str) -> Property:
         """Create a property object for this class."""
@@ -123,25 +286,164 @@ class PropertyFile():
         """Check if File line is of interest."""
         raise NotImplementedError
 
+    def record_key(self, line: str) -> Optional[tuple]:
+        """Get the key grouping the records of a property, None if none.
+
+        Lines following a line of interest with the same key are passed to
+        its property as continuation lines. By default every property is
+        a single line.
+        """
+        # pylint: disable=no-self-use,unused-argument
+        return None
+
+    def raw_filter_fields(self, line: str) -> Tuple[str, str, str]:
+        """Get the fields of a line of interest evaluated by a RecordFilter.
+
+        Returns the district code, post code and contract date as
+        "YYYYMMDD" (empty if missing) without parsing the line, IndexError
+        if fields are missing.
+        """
+        raise NotImplementedError
+
+    def record_selected(self, line: str) -> bool:
+        """Check if the line of interest matches the record filter."""
+        record_filter = self._record_filter
+        if record_filter is None:
+            return True
+        try:
+            district_code, post_code, contract_date = \
+                self.raw_filter_fields(line)
+        except IndexError:
+            # Parse (and fail) the line as without a filter
+            return True
+
+        if (record_filter.district_codes is not None and
+                district_code not in record_filter.district_codes):
+            return False
+        if (record_filter.post_codes is not None and
+                post_code not in record_filter.post_codes):
+            return False
+        start_date, end_date = self._date_bounds
+        if start_date is not None or end_date is not None:
+            # "YYYYMMDD" strings compare like the dates
+            if len(contract_date) != 8 or not contract_date.isdigit():
+                return False
+            if start_date is not None and contract_date < start_date:
+                return False
+            if end_date is not None and contract_date > end_date:
+                return False
+        return True
+
     def parse(self) -> None:
         """Parse the property file."""
         with open(self._file_path, 'r', encoding=self._encoding) as prop_file:
-            for idx, raw_line in enumerate(prop_file, start=1):
-                line = raw_line.strip()
-                if self.line_of_interest(line):
-                    # For now let's assume we only need a single line for each
-                    # property. New NSW entries have multiple lines per
-                    # property but only 1 has data we are interested in
-                    # single line makes parsing a lot simpler for now
-                    prop = self.create_property_from_line(line)
-                    if prop.parse():
-                        prop[PropertyData.FILE_NAME] = self._file_name
-                        prop[PropertyData.LINE_NO] = str(idx)
-                        self._properties.append(prop)
-                    else:
-                        raise ValueError(F'Failed Parsing Line: "{line}"')
+            self.parse_lines(prop_file)
 
-    def get_lines_as_list(self) -> List[Dict[str, str]]:
+    def parse_file_obj(self, file_obj: IO[bytes]) -> None:
+        """Parse the property file from a binary file object.
+
+        Used for files streamed from archives, the file object is not closed.
+        """
+        text_file = io.TextIOWrapper(file_obj, encoding=self._encoding)
+        try:
+            self.parse_lines(text_file)
+        finally:
+            text_file.detach()
+
+    def parse_lines(self, lines: Iterable[str]) -> None:
+        """Parse the lines of the property file."""
+        for idx, line, continuation_lines in self._iter_records(lines):
+            if not self.record_selected(line):
+                self._filtered_count += 1
+                continue
+            try:
+                self._properties.append(
+                    self.parse_line(line, idx, continuation_lines))
+            except ValueError as error:
+                self._quarantine(
+                    idx, '\n'.join([line] + continuation_lines), error)
+
+    def _iter_records(self, lines: Iterable[str]
+                      ) -> Iterator[Tuple[int, str, List[str]]]:
+        """Group the lines of interest with their continuation lines.
+
+        Only the records of the current property are buffered, yields the
+        line number, the line of interest and the continuation lines.
+        """
+        record: Optional[Tuple[int, str, List[str]]] = None
+        record_key = None
+        for idx, raw_line in enumerate(lines, start=1):
+            line = raw_line.strip()
+            if record is not None:
+                if (record_key is not None and
+                        not self.line_of_interest(line) and
+                        self.record_key(line) == record_key):
+                    if len(record[2]) < MAX_CONTINUATION_LINES:
+                        record[2].append(line)
+                    else:
+                        logger.warning(F'Ignoring line {idx} of '
+                                       F'"{self._file_name}", too many '
+                                       F'records for a property')
+                    continue
+                yield record
+                record = None
+
+            if self.line_of_interest(line):
+                record = (idx, line, [])
+                record_key = self.record_key(line)
+
+        if record is not None:
+            yield record
+
+    def parse_line(self, line: str, line_no: int,
+                   continuation_lines: Sequence[str] = ()) -> Property:
+        """Parse a line of interest, ValueError if it fails parsing."""
+        prop = self.create_property_from_line(line)
+        prop.continuation_lines = list(continuation_lines)
+        prop.columns = self._columns
+        try:
+            parsed = prop.parse()
+        except IndexError:
+            raise ValueError(F'Missing Fields in Line: "{line}"')
+        if not parsed:
+            raise ValueError(F'Failed Parsing Line: "{line}"')
+
+        prop.line_no = line_no
+        prop[PropertyData.FILE_NAME] = self._file_name
+        prop[PropertyData.LINE_NO] = str(line_no)
+        if self._typed:
+            prop.convert_types()
+        if self._interner is not None:
+            prop.intern_fields(self._interner)
+        return prop
+
+    def _quarantine(self, line_no: int, line: str, error: ValueError) -> None:
+        """Quarantine a line failing parsing, raise if not tolerant."""
+        if self._max_errors is None:
+            raise error
+        logger.warning(F'Quarantine line {line_no} of "{self._file_name}": '
+                       F'{error}')
+        self._quarantined.append(QuarantinedLine(line_no, line, str(error)))
+        if len(self._quarantined) > self._max_errors:
+            raise ErrorBudgetExceeded(
+                F'More than {self._max_errors} lines of "{self._file_name}" '
+                F'failed parsing')
+
+    def convert_types(self) -> None:
+        """Convert already parsed properties to the typed representation."""
+        properties = []
+        for prop in self._properties:
+            try:
+                prop.convert_types()
+            except ValueError as error:
+                self._quarantine(prop.line_no, prop.line, error)
+                continue
+            if self._interner is not None:
+                prop.intern_fields(self._interner)
+            properties.append(prop)
+        self._properties = properties
+
+    def get_lines_as_list(self) -> List[Dict[str, FieldValue]]:
         """Get a list of all the properties."""
         data_list = []
 
@@ -170,6 +472,59 @@ class PropertyFile():
         return self._properties[idx]
 
 
+def fields_from_names(names: Iterable[str]) -> List[PropertyData]:
+    """Get the fields of the column names in PropertyData order.
+
+    ValueError if a name is not a PropertyData value.
+    """
+    names = set(names)
+    unknown = names - {field.value for field in PropertyData}
+    if unknown:
+        raise ValueError(F'Unknown columns: {", ".join(sorted(unknown))}')
+    return [field for field in PropertyData if field.value in names]
+
+
+def get_field_type(field: PropertyData) -> Type[object]:
+    """Get the type of the given field in the typed representation."""
+    return _FIELD_TYPES.get(field, str)
+
+
+def convert_to_typed(field: PropertyData, value: FieldValue) -> FieldValue:
+    """Convert the given string field value to the typed representation.
+
+    Empty and "N/A" values are converted to None.
+    """
+    field_type = _FIELD_TYPES.get(field, str)
+    if not isinstance(value, str) or field_type is str:
+        return value
+
+    value = value.strip()
+    if value in MISSING_VALUES:
+        return None
+    if field_type is datetime.date:
+        return convert_internal_to_date(value)
+    if field_type is int:
+        return int(value)
+    return float(value)
+
+
+def convert_fields_to_typed(fields: Dict[str, FieldValue]) -> None:
+    """Convert the given field dictionary to the typed representation."""
+    for field in _FIELD_TYPES:
+        key = str(field.value)
+        if key in fields:
+            fields[key] = convert_to_typed(field, fields[key])
+
+
+def convert_internal_to_date(date_str: str) -> datetime.date:
+    """Convert the given date of the internal format to a date object."""
+    try:
+        return datetime.date(int(date_str[0:4]), int(date_str[5:7]),
+                             int(date_str[8:10]))
+    except ValueError:
+        raise ValueError(F'Invalid internal date "{date_str}"')
+
+
 def convert_date_to_internal(date_str: str, date_format: str) -> str:
     """Convert the given date to the internal format."""
     return datetime.datetime.strptime(
@@ -4,6 +4,8 @@
 
 import logging
 
+from typing import Optional, Tuple
+
 import property_parser
 import property_definitions_nsw as nsw_def
 
@@ -19,8 +21,9 @@ class NswOldProperty(property_parser.Property):
 
         district_code = fields[1]
         self[property_parser.PropertyData.DISTRICT_CODE] = district_code
-        self[property_parser.PropertyData.DISTRICT] =\
-            nsw_def.get_district_from_code(district_code)
+        if self.wants(property_parser.PropertyData.DISTRICT):
+            self[property_parser.PropertyData.DISTRICT] =\
+                nsw_def.get_district_from_code(district_code)
 
         self[property_parser.PropertyData.PROPERTY_ID] = fields[4]
         self[property_parser.PropertyData.UNIT_NUMBER] = fields[5]
@@ -29,12 +32,13 @@ class NswOldProperty(property_parser.Property):
         self[property_parser.PropertyData.SUBBURB] = fields[8]
         self[property_parser.PropertyData.POST_CODE] = fields[9]
 
-        if fields[10]:
-            to_date = property_parser.convert_date_to_internal(
-                fields[10], '%d/%M/%Y')
-        else:
-            to_date = 'N/A'
-        self[property_parser.PropertyData.CONTRACT_DATE] = to_date
+        if self.wants(property_parser.PropertyData.CONTRACT_DATE):
+            if fields[10]:
+                to_date = property_parser.convert_date_to_internal(
+                    fields[10], '%d/%M/%Y')
+            else:
+                to_date = 'N/A'
+            self[property_parser.PropertyData.CONTRACT_DATE] = to_date
 
         self[property_parser.PropertyData.PURCHASE_PRICE] = fields[11]
         self[property_parser.PropertyData.LAND_DESCRIPTIONS] = fields[12]
@@ -44,8 +48,9 @@ class NswOldProperty(property_parser.Property):
 
         zone_code = fields[16]
         self[property_parser.PropertyData.ZONE_CODE] = fields[16]
-        self[property_parser.PropertyData.ZONE] =\
-            nsw_def.get_zone_from_old_code(zone_code)
+        if self.wants(property_parser.PropertyData.ZONE):
+            self[property_parser.PropertyData.ZONE] =\
+                nsw_def.get_zone_from_old_code(zone_code)
 
         return True
 
@@ -53,15 +58,20 @@ class NswOldProperty(property_parser.Property):
 class NswOldPropertyFile(property_parser.PropertyFile):
     """Nsw Old Style format Property File."""
 
+    NAME_PATTERN = r'ARCHIVE_SALES_.*\.DAT'
+    # Header without a file type, or a sale with a DD/MM/YYYY contract date
+    CONTENT_PATTERN = r'A;;|B(?:;[^;\n]*){9};\d{1,2}/\d{1,2}/\d{4};'
+
     def create_property_from_line(self, line: str) -> NswOldProperty:
         """Create a property object for this class."""
         return NswOldProperty(line)
 
-    @staticmethod
-    def name_allowed(file_name_candidate: str) -> bool:
-        """Check if the given name is allowed."""
-        return (file_name_candidate.upper().startswith('ARCHIVE_SALES_') and
-                file_name_candidate.upper().endswith('.DAT'))
+    def raw_filter_fields(self, line: str) -> Tuple[str, str, str]:
+        """Get the district code, post code and contract date of a line."""
+        fields = line.split(';', 11)
+        day, month, year = (fields[10].strip().split('/') + ['', ''])[:3]
+        return (fields[1].strip(), fields[9].strip(),
+                F'{year}{month:0>2}{day:0>2}' if year else '')
 
     def line_of_interest(self, line: str) -> bool:
         """Check if File line is of interest."""
@@ -77,8 +87,9 @@ class NswNewProperty(property_parser.Property):
 
         district_code = fields[1]
         self[property_parser.PropertyData.DISTRICT_CODE] = district_code
-        self[property_parser.PropertyData.DISTRICT] =\
-            nsw_def.get_district_from_code(district_code)
+        if self.wants(property_parser.PropertyData.DISTRICT):
+            self[property_parser.PropertyData.DISTRICT] =\
+                nsw_def.get_district_from_code(district_code)
 
         self[property_parser.PropertyData.PROPERTY_ID] = fields[2]
         self[property_parser.PropertyData.UNIT_NUMBER] = fields[6]
@@ -89,49 +100,64 @@ class NswNewProperty(property_parser.Property):
         self[property_parser.PropertyData.AREA] = fields[11]
         self[property_parser.PropertyData.AREA_TYPE] = fields[12]
 
-        if fields[13]:
-            to_date = property_parser.convert_date_to_internal(
-                fields[13], '%Y%M%d')
-        else:
-            to_date = 'N/A'
-        self[property_parser.PropertyData.CONTRACT_DATE] = to_date
-
-        if fields[14]:
-            to_date = property_parser.convert_date_to_internal(
-                fields[14], '%Y%M%d')
-        else:
-            to_date = 'N/A'
-        self[property_parser.PropertyData.SETTLEMENT_DATE] = to_date
+        for field, idx in [
+                (property_parser.PropertyData.CONTRACT_DATE, 13),
+                (property_parser.PropertyData.SETTLEMENT_DATE, 14)]:
+            if self.wants(field):
+                if fields[idx]:
+                    to_date = property_parser.convert_date_to_internal(
+                        fields[idx], '%Y%M%d')
+                else:
+                    to_date = 'N/A'
+                self[field] = to_date
 
         self[property_parser.PropertyData.PURCHASE_PRICE] = fields[15]
 
         zone_code = fields[16]
         self[property_parser.PropertyData.ZONE_CODE] = zone_code
-        self[property_parser.PropertyData.ZONE] =\
-            nsw_def.get_zone_from_new_code(zone_code)
-        self[property_parser.PropertyData.ZONE_TYPE] =\
-            nsw_def.get_type_from_new_zone_code(zone_code)
+        if self.wants(property_parser.PropertyData.ZONE):
+            self[property_parser.PropertyData.ZONE] =\
+                nsw_def.get_zone_from_new_code(zone_code)
+        if self.wants(property_parser.PropertyData.ZONE_TYPE):
+            self[property_parser.PropertyData.ZONE_TYPE] =\
+                nsw_def.get_type_from_new_zone_code(zone_code)
 
         self[property_parser.PropertyData.NATURE_OF_PROPERTY] = fields[17]
         self[property_parser.PropertyData.PRIMARY_PURPOSE] = fields[18]
         self[property_parser.PropertyData.LOT_NUMBER] = fields[19]
 
+        # Descriptions exceeding a C record continue in the next ones
+        if self.wants(property_parser.PropertyData.LAND_DESCRIPTIONS):
+            self[property_parser.PropertyData.LAND_DESCRIPTIONS] = ''.join(
+                property_parser.split_str(line, ';')[5]
+                for line in self.continuation_lines
+                if line.upper().startswith('C'))
+
         return True
 
 
 class NswNewPropertyFile(property_parser.PropertyFile):
     """Nsw New Style format Property File."""
 
+    NAME_PATTERN = r'.*_SALES_DATA_NNME_.*\.DAT'
+    # Sales data header, or a record with a "YYYYMMDD HH:MM" download time
+    CONTENT_PATTERN = r'A;RTSALEDATA;|[BCD](?:;[^;\n]*){3};\d{8} \d\d:\d\d;'
+
     def create_property_from_line(self, line: str) -> NswNewProperty:
         """Create a property object for this class."""
         return NswNewProperty(line)
 
-    @staticmethod
-    def name_allowed(file_name_candidate: str) -> bool:
-        """Check if the given name is allowed."""
-        return ('_SALES_DATA_NNME_' in file_name_candidate.upper() and
-                file_name_candidate.upper().endswith('.DAT'))
+    def raw_filter_fields(self, line: str) -> Tuple[str, str, str]:
+        """Get the district code, post code and contract date of a line."""
+        fields = line.split(';', 14)
+        return fields[1].strip(), fields[10].strip(), fields[13].strip()
 
     def line_of_interest(self, line: str) -> bool:
         """Check if File line is of interest."""
         return line.upper().startswith('B')
+
+    def record_key(self, line: str) -> Optional[tuple]:
+        """Get the district, property id and sale counter of a B/C/D line."""
+        if line[:1].upper() not in ('B', 'C', 'D'):
+            return None
+        return tuple(line.split(';', 4)[1:4])
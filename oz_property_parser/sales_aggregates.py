@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""Sales price statistics per suburb and district per quarter.
+
+The statistics are mergeable, so they can be maintained incrementally from
+each batch of sales written to the database. Medians (and other quantiles)
+are approximated by a QuantileSketch with a bounded relative error.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import math
+import sys
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import property_parser
+
+# Aggregation levels and the field they group the sales by
+AGGREGATE_LEVELS = {
+    'suburb': property_parser.PropertyData.SUBBURB.value,
+    'district': property_parser.PropertyData.DISTRICT.value,
+}
+
+UNKNOWN_QUARTER = 'Unknown'
+
+# Relative accuracy of the quantiles estimated by the sketch
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# (Level, Area, Quarter)
+AggregateKey = Tuple[str, str, str]
+
+
+class QuantileSketch():
+    """Mergeable quantile sketch with logarithmic buckets.
+
+    Positive values are counted in buckets growing by a constant factor
+    (like DDSketch), estimated quantiles are within the relative accuracy of
+    the true value. Values <= 0 are counted separately as 0.
+    """
+
+    def __init__(self,
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        """Initialize an empty sketch."""
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(F'Invalid relative accuracy: '
+                             F'{relative_accuracy}')
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._zero_count = 0
+        self._buckets: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        """Get the number of values added."""
+        return self._zero_count + sum(self._buckets.values())
+
+    def add(self, value: float) -> None:
+        """Add a value to the sketch."""
+        if value <= 0:
+            self._zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Merge the values of another sketch into this sketch."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        self._zero_count += other._zero_count
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Estimate the given quantile (0 to 1), None if empty."""
+        if not 0 <= quantile <= 1:
+            raise ValueError(F'Invalid quantile: {quantile}')
+        total = len(self)
+        if total == 0:
+            return None
+
+        rank = quantile * (total - 1)
+        seen = self._zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        raise AssertionError('Quantile rank out of range')
+
+    def to_json(self) -> str:
+        """Serialise the sketch."""
+        return json.dumps({'accuracy': self.relative_accuracy,
+                           'zero': self._zero_count,
+                           'buckets': self._buckets},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> 'QuantileSketch':
+        """Deserialise a sketch created by to_json()."""
+        values = json.loads(data)
+        sketch = cls(values['accuracy'])
+        sketch._zero_count = values['zero']
+        sketch._buckets = {int(index): count
+                           for index, count in values['buckets'].items()}
+        return sketch
+
+
+class PriceStatistics():
+    """Mergeable price statistics of a group of sales."""
+
+    def __init__(self, sales_count: int = 0, price_count: int = 0,
+                 price_sum: int = 0,
+                 sketch: Optional[QuantileSketch] = None) -> None:
+        """Initialize the statistics."""
+        self.sales_count = sales_count
+        self.price_count = price_count
+        self.price_sum = price_sum
+        self.sketch = sketch if sketch is not None else QuantileSketch()
+
+    def add(self, price: Optional[int]) -> None:
+        """Add a sale, price is None if unknown."""
+        self.sales_count += 1
+        if price is not None:
+            self.price_count += 1
+            self.price_sum += price
+            self.sketch.add(price)
+
+    def merge(self, other: 'PriceStatistics') -> None:
+        """Merge the statistics of another group into this one."""
+        self.sales_count += other.sales_count
+        self.price_count += other.price_count
+        self.price_sum += other.price_sum
+        self.sketch.merge(other.sketch)
+
+    @property
+    def mean_price(self) -> Optional[float]:
+        """Get the mean price of the sales with a price."""
+        if self.price_count == 0:
+            return None
+        return self.price_sum / self.price_count
+
+    @property
+    def median_price(self) -> Optional[float]:
+        """Get the approximate median price."""
+        return self.sketch.quantile(0.5)
+
+
+class AggregateRow(NamedTuple):
+    """Statistics of an area in a quarter as read from the database."""
+
+    level: str
+    area: str
+    quarter: str
+    sales_count: int
+    mean_price: Optional[float]
+    median_price: Optional[float]
+
+
+def contract_quarter(contract_date: property_parser.FieldValue) -> str:
+    """Get the quarter ("YYYY-Qn") of an internal, ISO or typed date."""
+    if isinstance(contract_date, datetime.date):
+        year, month = contract_date.year, contract_date.month
+    else:
+        # Internal "YYYY/MM/DD" and ISO "YYYY-MM-DD" share the positions
+        date = str(contract_date or '')
+        if not (len(date) >= 7 and date[:4].isdigit() and
+                date[5:7].isdigit()):
+            return UNKNOWN_QUARTER
+        year, month = int(date[:4]), int(date[5:7])
+        if not 1 <= month <= 12:
+            return UNKNOWN_QUARTER
+    return F'{year:04}-Q{(month - 1) // 3 + 1}'
+
+
+def price_value(price: property_parser.FieldValue) -> Optional[int]:
+    """Get the price of a string or typed price, None if missing."""
+    if price is None or isinstance(price, int):
+        return price
+    try:
+        return int(price)
+    except ValueError:
+        return None
+
+
+def aggregate_properties(
+        property_list: Iterable[Dict[str, property_parser.FieldValue]]
+) -> Dict[AggregateKey, PriceStatistics]:
+    """Aggregate the price statistics of the properties for every level."""
+    aggregates: Dict[AggregateKey, PriceStatistics] = {}
+    for prop in property_list:
+        quarter = contract_quarter(
+            prop.get(property_parser.PropertyData.CONTRACT_DATE.value))
+        price = price_value(
+            prop.get(property_parser.PropertyData.PURCHASE_PRICE.value))
+        for level, field in AGGREGATE_LEVELS.items():
+            key = (level, str(prop.get(field) or ''), quarter)
+            stats = aggregates.get(key)
+            if stats is None:
+                stats = aggregates[key] = PriceStatistics()
+            stats.add(price)
+    return aggregates
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Set up command line arguments for the aggregate report."""
+    parser = argparse.ArgumentParser(
+        description='Print the sales statistics of a parse result database')
+    parser.add_argument('db_path', help='Parse result database')
+    parser.add_argument('--level', choices=list(AGGREGATE_LEVELS),
+                        default='suburb', help='Aggregation level')
+    parser.add_argument('--area', help='Only this suburb or district')
+    parser.add_argument('--quarter', help='Only this quarter, e.g. 2018-Q1')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild the aggregates from the sales data '
+                             'first (also creates them if missing)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Print the aggregated sales statistics as csv."""
+    # The database backend is only needed for the report
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    args = parse_args(argv)
+    with db_store.SqliteDb(args.db_path) as database:
+        with database.session_scope() as session:
+            if args.rebuild:
+                db_store.rebuild_aggregates(session)
+            rows = db_store.query_aggregates(session, args.level, args.area,
+                                             args.quarter)
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(AggregateRow._fields)
+    writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""Query the stored sales data.
+
+Queries work on every database layout through the SalesData table (or
+view) and stream their results, large results are never held in memory.
+Create the indexes for the filters with DataManager.enable_query_indexes().
+"""
+
+import datetime
+import logging
+
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+import db_store
+import property_parser
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+DEFAULT_CHUNK_SIZE = 1000
+
+_CONTRACT_DATE = property_parser.PropertyData.CONTRACT_DATE.value
+_PURCHASE_PRICE = property_parser.PropertyData.PURCHASE_PRICE.value
+
+# Contract dates of the all-string layout, others (e.g. "N/A") are missing
+_STRING_DATE_PATTERN = '[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]'
+
+_REPEAT_SALE_COLUMNS = [
+    'District_Code', 'Property_ID', 'Post_Code', 'Subburb',
+    'Previous_Contract_Date', 'Previous_Price', 'Contract_Date',
+    'Purchase_Price', 'Holding_Days', 'Price_Delta']
+_REPEAT_SALE_DATE_INDEXES = [
+    _REPEAT_SALE_COLUMNS.index('Previous_Contract_Date'),
+    _REPEAT_SALE_COLUMNS.index('Contract_Date')]
+
+
+class SalesFilter(NamedTuple):
+    """Filter of a sales query, all given conditions have to match.
+
+    Date and price ranges are inclusive.
+    """
+
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+    post_code: Optional[int] = None
+    suburb: Optional[str] = None
+    district_code: Optional[str] = None
+    property_id: Optional[str] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+
+
+class RepeatSale(NamedTuple):
+    """Consecutive sales of the same property."""
+
+    district_code: str
+    property_id: str
+    post_code: Optional[int]
+    suburb: str
+    previous_contract_date: datetime.date
+    previous_price: Optional[int]
+    contract_date: datetime.date
+    purchase_price: Optional[int]
+    holding_days: int
+    price_delta: Optional[int]
+
+
+def query_sales(session, sales_filter: SalesFilter,
+                chunk_size: int = DEFAULT_CHUNK_SIZE
+                ) -> Iterator[Dict[str, property_parser.FieldValue]]:
+    """Stream the sales matching the filter, ordered by contract date.
+
+    Sales without a contract date come first. The sales are returned in the
+    typed representation, regardless of the database layout.
+    """
+    typed = db_store.is_typed(session)
+    conditions: List[str] = []
+    params: Dict[str, Any] = {}
+
+    def add_condition(condition: str, name: str, value: Any) -> None:
+        if value is not None:
+            conditions.append(condition)
+            params[name] = value
+
+    date_order = _CONTRACT_DATE
+    if not typed:
+        # Strings compare lexically, "N/A" would sort after every date
+        valid_date = F"{_CONTRACT_DATE} GLOB '{_STRING_DATE_PATTERN}'"
+        date_order = F'{valid_date}, {_CONTRACT_DATE}'
+        if (sales_filter.start_date is not None or
+                sales_filter.end_date is not None):
+            conditions.append(valid_date)
+    add_condition(F'{_CONTRACT_DATE} >= :start_date', 'start_date',
+                  _date_value(sales_filter.start_date, typed))
+    add_condition(F'{_CONTRACT_DATE} <= :end_date', 'end_date',
+                  _date_value(sales_filter.end_date, typed))
+    # The column affinity converts the values to the stored type
+    add_condition('Post_Code = :post_code', 'post_code',
+                  sales_filter.post_code)
+    add_condition('Subburb = :suburb', 'suburb', sales_filter.suburb)
+    add_condition('District_Code = :district_code', 'district_code',
+                  sales_filter.district_code)
+    add_condition('Property_ID = :property_id', 'property_id',
+                  sales_filter.property_id)
+
+    price = _PURCHASE_PRICE
+    if not typed and (sales_filter.min_price is not None or
+                      sales_filter.max_price is not None):
+        # Strings compare lexically, skip missing prices (cast to 0)
+        conditions.append(F"{price} GLOB '[0-9]*'")
+        price = F'CAST({price} AS INTEGER)'
+    add_condition(F'{price} >= :min_price', 'min_price',
+                  sales_filter.min_price)
+    add_condition(F'{price} <= :max_price', 'max_price',
+                  sales_filter.max_price)
+
+    sql = F'SELECT * FROM "{db_store.SALES_DATA_TABLE}"'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += F' ORDER BY {date_order}, id'
+    logger.debug(F'Query Sales: "{sql}", {params}')
+
+    result = session.execute(text(sql), params)
+    try:
+        for rows in iter(lambda: result.fetchmany(chunk_size), []):
+            for row in rows:
+                yield _typed_sale(dict(row))
+    finally:
+        result.close()
+
+
+def sales_in_date_range(session, start_date: datetime.date,
+                        end_date: datetime.date,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE
+                        ) -> Iterator[Dict[str, property_parser.FieldValue]]:
+    """Stream the sales with a contract date in the range."""
+    return query_sales(session, SalesFilter(start_date=start_date,
+                                            end_date=end_date), chunk_size)
+
+
+def sales_in_area(session, post_code: Optional[int] = None,
+                  suburb: Optional[str] = None,
+                  district_code: Optional[str] = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE
+                  ) -> Iterator[Dict[str, property_parser.FieldValue]]:
+    """Stream the sales of a post code, suburb and/or district."""
+    if post_code is None and suburb is None and district_code is None:
+        raise ValueError('No area given')
+    return query_sales(session, SalesFilter(
+        post_code=post_code, suburb=suburb, district_code=district_code),
+                       chunk_size)
+
+
+def sales_in_price_band(session, min_price: Optional[int] = None,
+                        max_price: Optional[int] = None,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE
+                        ) -> Iterator[Dict[str, property_parser.FieldValue]]:
+    """Stream the sales with a purchase price in the band."""
+    return query_sales(session, SalesFilter(min_price=min_price,
+                                            max_price=max_price), chunk_size)
+
+
+def sales_of_property(session, property_id: str,
+                      district_code: Optional[str] = None
+                      ) -> Iterator[Dict[str, property_parser.FieldValue]]:
+    """Stream the sales of a property, property ids are unique per district."""
+    return query_sales(session, SalesFilter(property_id=property_id,
+                                            district_code=district_code))
+
+
+def repeat_sales(session, post_code: Optional[int] = None,
+                 suburb: Optional[str] = None,
+                 district_code: Optional[str] = None,
+                 start_date: Optional[datetime.date] = None,
+                 end_date: Optional[datetime.date] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE
+                 ) -> Iterator[RepeatSale]:
+    """Stream the repeat sales of a region and date range (inclusive).
+
+    The date range applies to the later sale of each pair, see
+    DataManager.enable_repeat_sales().
+    """
+    if not db_store.has_repeat_sales(session):
+        raise ValueError('The database does not maintain repeat sales')
+
+    conditions: List[str] = []
+    params: Dict[str, Any] = {}
+    for condition, name, value in [
+            ('Post_Code = :post_code', 'post_code', post_code),
+            ('Subburb = :suburb', 'suburb', suburb),
+            ('District_Code = :district_code', 'district_code',
+             district_code),
+            ('Contract_Date >= :start_date', 'start_date',
+             _date_value(start_date, True)),
+            ('Contract_Date <= :end_date', 'end_date',
+             _date_value(end_date, True))]:
+        if value is not None:
+            conditions.append(condition)
+            params[name] = value
+
+    sql = (F'SELECT {", ".join(_REPEAT_SALE_COLUMNS)} '
+           F'FROM "{db_store.REPEAT_SALE_TABLE}"')
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY Contract_Date, id'
+    return _iter_repeat_sales(session.execute(text(sql), params), chunk_size)
+
+
+def _iter_repeat_sales(result, chunk_size: int) -> Iterator[RepeatSale]:
+    """Stream the repeat sales of a query result."""
+    try:
+        for rows in iter(lambda: result.fetchmany(chunk_size), []):
+            for row in rows:
+                values = list(row)
+                for idx in _REPEAT_SALE_DATE_INDEXES:
+                    values[idx] = property_parser.convert_internal_to_date(
+                        values[idx])
+                yield RepeatSale(*values)
+    finally:
+        result.close()
+
+
+def _date_value(date: Optional[datetime.date], typed: bool) -> Optional[str]:
+    """Get the stored representation of a date."""
+    if date is None:
+        return None
+    return date.isoformat() if typed else date.strftime('%Y/%m/%d')
+
+
+def _typed_sale(sale: Dict[str, property_parser.FieldValue]
+                ) -> Dict[str, property_parser.FieldValue]:
+    """Convert a stored sale to the typed representation."""
+    for field in property_parser.PropertyData:
+        value = sale.get(field.value)
+        if isinstance(value, str):
+            try:
+                sale[field.value] = property_parser.convert_to_typed(
+                    field, value)
+            except ValueError:
+                logger.debug(F'Keeping invalid {field.value}: "{value}"')
+    return sale
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+
+"""Distribute an ingestion over several workers with a leased work queue.
+
+A coordinator enqueues the property files, archives and zip members found in
+the input directories. Workers (on any machine sharing the filesystem) claim
+items with a time-limited lease, renew it by heartbeats while parsing and
+write into their own shard database. Items of crashed workers are claimed
+again once their lease expires, up to max_attempts times. Finally the shards
+are merged into the result database.
+
+The queue is a SQLite database, its locking requires a filesystem with
+working file locks and the lease expiry clocks of the machines to agree.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+
+from typing import (Any, Callable, Dict, Iterable, List, NamedTuple,
+                    Optional)
+
+import archive_mgr
+import property_data_extractor
+import property_file_manager as prop_mgr
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_SECONDS = 5.0
+
+# Item states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+_CREATE_QUEUE_SQL = '''
+CREATE TABLE IF NOT EXISTS WorkItem (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    member TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    UNIQUE (path, member)
+)'''
+
+
+class WorkItem(NamedTuple):
+    """File, archive or zip member to be parsed by a worker."""
+
+    id: int  # pylint: disable=invalid-name
+    path: str
+    # Name of the zip member, '' for files and whole archives
+    member: str
+    attempts: int
+
+
+class WorkQueue():
+    """SQLite work queue with leased items.
+
+    Connections cannot be shared between threads, open a WorkQueue per
+    thread.
+    """
+
+    def __init__(self, queue_path: str,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 clock: Callable[[], float] = time.time) -> None:
+        """Open (and create) the queue database."""
+        if lease_seconds <= 0:
+            raise ValueError('"lease_seconds" must be positive')
+        if max_attempts < 1:
+            raise ValueError('"max_attempts" must be at least 1')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._clock = clock
+        # Transactions are started explicitly, see _transaction()
+        self._connection = sqlite3.connect(queue_path, timeout=60,
+                                           isolation_level=None)
+        self._connection.execute(_CREATE_QUEUE_SQL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """Close the queue database."""
+        self._connection.close()
+
+    def add(self, path: str, member: str = '') -> bool:
+        """Add an item, False if it was queued before."""
+        cursor = self._connection.execute(
+            'INSERT OR IGNORE INTO WorkItem (path, member) VALUES (?, ?)',
+            (path, member))
+        return cursor.rowcount == 1
+
+    def claim(self, worker_id: str) -> Optional[WorkItem]:
+        """Lease the next pending item to the worker, None if there is none.
+
+        Expired leases are released first, the items are pending again or
+        failed after max_attempts.
+        """
+        now = self._clock()
+        with self._transaction():
+            self._connection.execute(
+                'UPDATE WorkItem SET worker = NULL, lease_expires = NULL, '
+                'state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                "last_error = COALESCE(last_error, 'Lease expired') "
+                'WHERE state = ? AND lease_expires < ?',
+                (self.max_attempts, FAILED, PENDING, LEASED, now))
+            row = self._connection.execute(
+                'SELECT id, path, member, attempts FROM WorkItem '
+                'WHERE state = ? ORDER BY id LIMIT 1', (PENDING,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE WorkItem SET state = ?, worker = ?, '
+                'lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+                (LEASED, worker_id, now + self.lease_seconds, row[0]))
+        return WorkItem(row[0], row[1], row[2], row[3] + 1)
+
+    def heartbeat(self, item_id: int, worker_id: str) -> bool:
+        """Renew the lease of the item, False if the worker lost it."""
+        cursor = self._connection.execute(
+            'UPDATE WorkItem SET lease_expires = ? '
+            'WHERE id = ? AND worker = ? AND state = ?',
+            (self._clock() + self.lease_seconds, item_id, worker_id, LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, item_id: int, worker_id: str,
+                 error: Optional[str] = None) -> bool:
+        """Mark the item done, False if the worker lost the lease.
+
+        The error of an item not processed completely is kept, e.g. of an
+        aborted zip member, see archive_done().
+        """
+        cursor = self._connection.execute(
+            'UPDATE WorkItem SET state = ?, lease_expires = NULL, '
+            'last_error = ? WHERE id = ? AND worker = ? AND state = ?',
+            (DONE, error, item_id, worker_id, LEASED))
+        return cursor.rowcount == 1
+
+    def archive_done(self, path: str) -> bool:
+        """Check if all items of the path are done without an error."""
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM WorkItem WHERE path = ? '
+            'AND (state != ? OR last_error IS NOT NULL)',
+            (path, DONE)).fetchone()[0] == 0
+
+    def fail(self, item_id: int, worker_id: str, error: str) -> bool:
+        """Release the item for a retry, failed after max_attempts.
+
+        Returns False if the worker lost the lease.
+        """
+        cursor = self._connection.execute(
+            'UPDATE WorkItem SET worker = NULL, lease_expires = NULL, '
+            'state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+            'last_error = ? WHERE id = ? AND worker = ? AND state = ?',
+            (self.max_attempts, FAILED, PENDING, error, item_id, worker_id,
+             LEASED))
+        return cursor.rowcount == 1
+
+    def counts(self) -> Dict[str, int]:
+        """Get the number of items per state."""
+        counts = {state: 0 for state in [PENDING, LEASED, DONE, FAILED]}
+        counts.update(self._connection.execute(
+            'SELECT state, COUNT(*) FROM WorkItem GROUP BY state'))
+        return counts
+
+    def failed_items(self) -> List[WorkItem]:
+        """Get the items that failed max_attempts times."""
+        return [WorkItem(*row) for row in self._connection.execute(
+            'SELECT id, path, member, attempts FROM WorkItem '
+            'WHERE state = ? ORDER BY id', (FAILED,))]
+
+    def _transaction(self):
+        """Run the statements of a with block in a write transaction."""
+        return _Transaction(self._connection)
+
+
+class _Transaction():
+    """Write transaction locking the queue database on begin."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        """Initialize the transaction."""
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class _Heartbeat(threading.Thread):
+    """Renew the lease of an item until stopped."""
+
+    def __init__(self, queue_path: str, lease_seconds: float,
+                 item: WorkItem, worker_id: str) -> None:
+        """Initialize the heartbeat thread."""
+        super().__init__(name=F'heartbeat-{item.id}', daemon=True)
+        self._queue_path = queue_path
+        self._lease_seconds = lease_seconds
+        self._item = item
+        self._worker_id = worker_id
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        """Renew the lease every third of the lease time."""
+        with WorkQueue(self._queue_path, self._lease_seconds) as queue:
+            while not self._stopped.wait(self._lease_seconds / 3):
+                if not queue.heartbeat(self._item.id, self._worker_id):
+                    logger.warning(F'Lost the lease of "{self._item.path}"')
+                    return
+
+    def stop(self) -> None:
+        """Stop renewing the lease."""
+        self._stopped.set()
+        self.join()
+
+
+def default_worker_id() -> str:
+    """Get a worker id unique across the machines."""
+    return F'{socket.gethostname()}-{os.getpid()}'
+
+
+def enqueue(queue: WorkQueue, input_paths: Iterable[str]) -> int:
+    """Add the files of the input directories to the queue.
+
+    Zip files are split into their members, other archives are parsed as a
+    whole. Returns the number of new items.
+    """
+    added = 0
+    for path in input_paths:
+        for root, _, files in os.walk(path):
+            for filename in files:
+                file_path = os.path.join(root, filename)
+                if archive_mgr.file_is_archive(file_path):
+                    if file_path.lower().endswith('.zip'):
+                        try:
+                            members = archive_mgr.list_zip_members(file_path)
+                        except archive_mgr.ExtractionError as error:
+                            logger.error(F'Cannot list "{file_path}": {error}')
+                            continue
+                        added += sum(
+                            queue.add(file_path, member)
+                            for member in members
+                            if (archive_mgr.file_is_archive(member) or
+                                prop_mgr.file_can_be_parsed(member)))
+                    else:
+                        added += queue.add(file_path)
+                elif prop_mgr.file_can_be_parsed(file_path):
+                    added += queue.add(file_path)
+                else:
+                    logger.info(F'Cannot Parse "{file_path}", SKIP')
+    logger.info(F'Queued {added} items')
+    return added
+
+
+class _Worker():  # pylint: disable=too-few-public-methods
+    """Parse the claimed items into a shard database."""
+
+    def __init__(self, data_manager, options) -> None:
+        """Initialize the worker."""
+        self._data_manager = data_manager
+        self._options = options
+        # Scanned files of the archives with queued members
+        self._archives: Dict[str, Any] = {}
+
+    def process(self, item: WorkItem) -> bool:
+        """Parse the item and commit it to the shard.
+
+        Returns False if a zip member failed or was aborted, its archive is
+        not processed.
+        """
+        processed = True
+        if item.member:
+            summary = self._options.summary
+            failed_count = summary.files_failed + summary.files_aborted
+            property_data_extractor.parse_archive_stream(
+                self._data_manager, item.path, self._data_manager,
+                self._archive_entry(item.path).id, self._options,
+                archive_mgr.iter_zip_member(item.path, item.member))
+            processed = (
+                summary.files_failed + summary.files_aborted == failed_count)
+        else:
+            self._process_file(item.path)
+        self._data_manager.commit()
+        return processed
+
+    def complete_archive(self, archive_path: str) -> None:
+        """Flag an archive processed once all its members are done."""
+        self._archive_entry(archive_path).processed = True
+        self._data_manager.commit()
+
+    def _archive_entry(self, archive_path: str):
+        """Get the scanned file of an archive with queued members."""
+        if archive_path not in self._archives:
+            self._archives[archive_path] = (
+                property_data_extractor.setup_scanned_file(
+                    self._data_manager, archive_path))
+        return self._archives[archive_path]
+
+    def _process_file(self, file_path: str) -> None:
+        """Parse a property file or a whole archive."""
+        db_file_entry = property_data_extractor.setup_scanned_file(
+            self._data_manager, file_path)
+        if db_file_entry.processed:
+            logger.info(F'Skipping, File previously processed')
+            self._options.summary.files_skipped += 1
+            return
+
+        if archive_mgr.file_is_archive(file_path):
+            aborted_count = self._options.summary.files_aborted
+            property_data_extractor.parse_archive_stream(
+                self._data_manager, file_path, self._data_manager,
+                db_file_entry.id, self._options)
+            # Archives are processed unless a file of them was aborted
+            db_file_entry.processed = (
+                self._options.summary.files_aborted == aborted_count)
+        else:
+            processed = True
+            try:
+                property_file = self._options.create_property_file(file_path)
+            except ValueError as error:
+                logger.error(F'Failed to Identify Property File: {error}')
+                self._options.summary.files_failed += 1
+            else:
+                processed = property_data_extractor.process_property_file(
+                    self._data_manager, file_path, property_file,
+                    db_file_entry, self._options)
+            db_file_entry.processed = processed
+
+
+def run_worker(queue_path: str,
+               config: property_data_extractor.IngestConfig,
+               worker_id: Optional[str] = None,
+               lease_seconds: float = DEFAULT_LEASE_SECONDS,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+               poll_seconds: float = DEFAULT_POLL_SECONDS
+               ) -> property_data_extractor.IngestSummary:
+    """Process queued items into the shard database config.output_path.
+
+    The worker stops when no item is pending or leased by another worker.
+    """
+    if config.output != 'sql':
+        raise ValueError('Workers require the sql output')
+    property_data_extractor.validate_config(config)
+    worker_id = worker_id or default_worker_id()
+    start_time = time.perf_counter()
+
+    options = property_data_extractor.create_parse_options(config)
+    with WorkQueue(queue_path, lease_seconds, max_attempts) as queue, \
+            property_data_extractor.sql_data_manager_scope(
+                config, options) as data_manager:
+        worker = _Worker(data_manager, options)
+        while True:
+            item = queue.claim(worker_id)
+            if item is None:
+                if queue.counts()[LEASED] == 0:
+                    break
+                # Items of other workers may still expire
+                time.sleep(poll_seconds)
+                continue
+
+            logger.info(F'Worker "{worker_id}" processes "{item.path}" '
+                        F'"{item.member}", attempt {item.attempts}')
+            heartbeat = _Heartbeat(queue_path, lease_seconds, item, worker_id)
+            heartbeat.start()
+            try:
+                processed = worker.process(item)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception(F'Failed to process "{item.path}"')
+                queue.fail(item.id, worker_id, repr(error))
+                continue
+            finally:
+                heartbeat.stop()
+
+            if not queue.complete(item.id, worker_id,
+                                  None if processed else 'Not processed'):
+                logger.warning(F'Lease of "{item.path}" lost before '
+                               F'completion, it may be processed twice')
+            elif item.member and queue.archive_done(item.path):
+                # The worker completing the last member flags the archive,
+                # the flag is kept when merging the shards
+                worker.complete_archive(item.path)
+
+    options.summary.duration_seconds = time.perf_counter() - start_time
+    logger.info(F'Worker "{worker_id}" complete: {options.summary}')
+    return options.summary
+
+
+def merge_shards(config: property_data_extractor.IngestConfig,
+                 shard_paths: Iterable[str]
+                 ) -> property_data_extractor.IngestSummary:
+    """Merge the shard databases of the workers into config.output_path.
+
+    See DataManager.merge_shard(), sales of files processed by several
+    shards are only dropped with config.dedup.
+    """
+    if config.output != 'sql':
+        raise ValueError('Merging requires the sql output')
+    property_data_extractor.validate_config(config)
+    start_time = time.perf_counter()
+
+    options = property_data_extractor.create_parse_options(config)
+    with property_data_extractor.sql_data_manager_scope(
+            config, options) as data_manager:
+        for shard_path in shard_paths:
+            logger.info(F'Merge "{shard_path}"')
+            file_count, sales_count = data_manager.merge_shard(shard_path)
+            options.summary.files_processed += file_count
+            options.summary.property_count += sales_count
+
+    options.summary.duration_seconds = time.perf_counter() - start_time
+    logger.info(F'Merge complete: {options.summary}')
+    return options.summary
+
+
+def _run_shard_worker(queue_path: str,
+                      config: property_data_extractor.IngestConfig,
+                      worker_id: str) -> property_data_extractor.IngestSummary:
+    """Run a worker of a sharded ingestion in its own process."""
+    return run_worker(queue_path, config, worker_id, poll_seconds=0.5)
+
+
+def ingest_sharded(config: property_data_extractor.IngestConfig
+                   ) -> property_data_extractor.IngestSummary:
+    """Ingest with config.shard_workers processes writing their own shards.
+
+    The workers parse the queued input files into shard databases next to
+    the output, written without durability (see SqliteDb bulk_load) and
+    seeded with the scanned files of the output to skip processed files.
+    The shards are merged into the output and removed afterwards, also if
+    the ingestion fails. Shards left by a killed ingestion are not merged,
+    their directory must be removed first.
+    """
+    start_time = time.perf_counter()
+    shard_dir = config.output_path + '.shards'
+    if os.path.exists(shard_dir):
+        raise ValueError(F'"{shard_dir}" of an interrupted ingestion exists, '
+                         F'remove it first')
+    os.makedirs(shard_dir)
+    try:
+        summary = _ingest_shards(config, shard_dir)
+    finally:
+        shutil.rmtree(shard_dir)
+
+    summary.duration_seconds = time.perf_counter() - start_time
+    logger.info(F'Sharded ingestion complete: {summary}')
+    return summary
+
+
+def _ingest_shards(config: property_data_extractor.IngestConfig,
+                   shard_dir: str) -> property_data_extractor.IngestSummary:
+    """Parse into shards in the given directory and merge them."""
+    # The database backend is only needed for the shards
+    import db_store  # pylint: disable=import-outside-toplevel
+
+    queue_path = os.path.join(shard_dir, 'queue.sql')
+    with WorkQueue(queue_path) as queue:
+        enqueue(queue, config.input_paths)
+
+    typed = config.typed
+    if os.path.exists(config.output_path):
+        with db_store.SqliteDb(config.output_path) as database:
+            typed = typed or database.is_typed()
+    shard_config = property_data_extractor.IngestConfig(
+        input_paths=[], output_path='', typed=typed,
+        cache_dir=config.cache_dir, unzip_workers=config.unzip_workers,
+        commit_max=config.commit_max, memory_budget=config.memory_budget,
+        bulk_load=True, quarantine=config.quarantine,
+        max_line_errors=config.max_line_errors,
+        record_filter=config.record_filter, columns=config.columns)
+    columns = property_data_extractor.get_csv_keys(config.columns)
+    shard_paths = []
+    for idx in range(config.shard_workers or 1):
+        shard_path = os.path.join(shard_dir, F'shard_{idx}.sql')
+        with db_store.SqliteDb(shard_path, bulk_load=True) as shard:
+            shard.create(columns, typed=typed)
+            if os.path.exists(config.output_path):
+                with shard.session_scope() as session:
+                    db_store.copy_scanned_files(session, config.output_path)
+        shard_paths.append(shard_path)
+
+    summary = property_data_extractor.IngestSummary()
+    with concurrent.futures.ProcessPoolExecutor(len(shard_paths)) as pool:
+        futures = [
+            pool.submit(_run_shard_worker, queue_path,
+                        shard_config._replace(output_path=shard_path),
+                        F'{default_worker_id()}-shard-{idx}')
+            for idx, shard_path in enumerate(shard_paths)]
+        for future in futures:
+            worker_summary = future.result()
+            summary.files_skipped += worker_summary.files_skipped
+            summary.files_failed += worker_summary.files_failed
+            summary.files_aborted += worker_summary.files_aborted
+            summary.lines_quarantined += worker_summary.lines_quarantined
+            summary.lines_filtered += worker_summary.lines_filtered
+    with WorkQueue(queue_path) as queue:
+        for item in queue.failed_items():
+            logger.error(F'Failed to process "{item.path}" "{item.member}"')
+            summary.files_failed += 1
+
+    merge_summary = merge_shards(config._replace(shard_workers=None),
+                                 shard_paths)
+    summary.files_processed = merge_summary.files_processed
+    summary.property_count = merge_summary.property_count
+    summary.duplicate_counts = merge_summary.duplicate_counts
+    return summary
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Set up command line arguments for the work queue."""
+    parser = argparse.ArgumentParser(
+        description='Distribute the ingestion over several workers')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser(
+        'enqueue', help='Queue the property files of the directories')
+    enqueue_parser.add_argument('queue', help='Queue database')
+    enqueue_parser.add_argument('dirs', nargs='+',
+                                help='Base search Dirs for property Files')
+
+    work_parser = commands.add_parser(
+        'work', help='Process queued items into a shard database')
+    work_parser.add_argument('queue', help='Queue database')
+    work_parser.add_argument('shard', help='Shard database of this worker')
+    work_parser.add_argument('--worker-id',
+                             help='Unique worker id (default: host-pid)')
+    work_parser.add_argument('--lease-seconds', type=float,
+                             default=DEFAULT_LEASE_SECONDS,
+                             help='Lease time of claimed items')
+    work_parser.add_argument('--max-attempts', type=int,
+                             default=DEFAULT_MAX_ATTEMPTS,
+                             help='Attempts before an item failed')
+
+    merge_parser = commands.add_parser(
+        'merge', help='Merge the shard databases into the result database')
+    merge_parser.add_argument('output', help='Result database')
+    merge_parser.add_argument('shards', nargs='+', help='Shard databases')
+    merge_parser.add_argument('--dedup', action='store_true',
+                              help='Drop sales stored in several shards')
+
+    for command_parser in [work_parser, merge_parser]:
+        command_parser.add_argument('--typed', action='store_true',
+                                    help='Store numbers and dates typed')
+
+    status_parser = commands.add_parser(
+        'status', help='Print the number of items per state')
+    status_parser.add_argument('queue', help='Queue database')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run a work queue command."""
+    args = parse_args(argv)
+    if args.command == 'enqueue':
+        with WorkQueue(args.queue) as queue:
+            enqueue(queue, args.dirs)
+    elif args.command == 'work':
+        run_worker(args.queue, property_data_extractor.IngestConfig(
+            input_paths=[], output_path=args.shard, typed=args.typed),
+                   args.worker_id, args.lease_seconds, args.max_attempts)
+    elif args.command == 'merge':
+        merge_shards(property_data_extractor.IngestConfig(
+            input_paths=[], output_path=args.output, typed=args.typed,
+            dedup=args.dedup), args.shards)
+    else:
+        with WorkQueue(args.queue) as queue:
+            for state, count in queue.counts().items():
+                print(F'{state}: {count}')
+            for item in queue.failed_items():
+                print(F'failed: "{item.path}" "{item.member}"')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 #!/urs/bin/env python3
 
+import gzip
+import tarfile
+import zipfile
+
 import pytest
 
 import archive_mgr
@@ -30,3 +34,225 @@ def test_file_is_archived(archive_name):
 def test_extract_invalid_archive():
     with pytest.raises(archive_mgr.ExtractionError):
         archive_mgr.extract(R'File.rar', R'fake_dest_dir')
+
+
+COMPOUND_ARCHIVES = [
+    (R'Test.tar', True),
+    (R'Test.tar.gz', True),
+    (R'Test.TGZ', True),
+    (R'path_to/Test.tar.bz2', True),
+    (R'C:\Path\To\Test.tar.xz', True),
+    (R'Test.DAT.gz', True),
+    (R'Test.DAT.bz2', True),
+    (R'Test.DAT.xz', True),
+    (R'Test.gz.DAT', False),
+    (R'Test.targz', False)
+]
+@pytest.mark.parametrize('archive_name, supported', COMPOUND_ARCHIVES)
+def test_file_is_archive_compound(archive_name, supported):
+    assert archive_mgr.file_is_archive(archive_name) == supported
+
+
+def _create_nested_archive(base_dir):
+    zip_path = base_dir / 'inner.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        zip_ref.writestr('A.DAT', b'Zip Content')
+        zip_ref.writestr('folder/', b'')
+    gz_path = base_dir / 'B.DAT.gz'
+    with gzip.open(gz_path, 'wb') as gz_file:
+        gz_file.write(b'Gzip Content')
+
+    tar_path = base_dir / 'outer.tar.gz'
+    with tarfile.open(tar_path, 'w:gz') as tar_ref:
+        tar_ref.add(zip_path, arcname='inner.zip')
+        tar_ref.add(gz_path, arcname='sub/B.DAT.gz')
+    return tar_path
+
+
+def test_iter_archive_members_nested(tmp_path):
+    tar_path = _create_nested_archive(tmp_path)
+
+    members = {}
+    for member in archive_mgr.iter_archive_members(str(tar_path)):
+        members[member.path] = member.file_obj.read()
+
+    assert members == {
+        F'{tar_path}/inner.zip/A.DAT': b'Zip Content',
+        F'{tar_path}/sub/B.DAT.gz/B.DAT': b'Gzip Content'
+    }
+
+
+def test_iter_archive_members_invalid(tmp_path):
+    with pytest.raises(archive_mgr.ExtractionError):
+        list(archive_mgr.iter_archive_members(str(tmp_path / 'File.rar')))
+
+    bad_zip = tmp_path / 'Bad.zip'
+    bad_zip.write_bytes(b'No Zip')
+    with pytest.raises(archive_mgr.ExtractionError):
+        list(archive_mgr.iter_archive_members(str(bad_zip)))
+
+
+def test_extract_tar_and_gz(tmp_path):
+    tar_path = _create_nested_archive(tmp_path)
+    dest_dir = tmp_path / 'extract'
+
+    archive_mgr.extract(str(tar_path), str(dest_dir))
+    assert (dest_dir / 'inner.zip').exists()
+
+    archive_mgr.extract(str(dest_dir / 'sub' / 'B.DAT.gz'), str(dest_dir))
+    assert (dest_dir / 'B.DAT').read_bytes() == b'Gzip Content'
+
+
+def test_extract_tar_unsafe_member(tmp_path):
+    member_path = tmp_path / 'evil.DAT'
+    member_path.write_bytes(b'Evil')
+    tar_path = tmp_path / 'evil.tar'
+    with tarfile.open(tar_path, 'w') as tar_ref:
+        tar_ref.add(member_path, arcname='../evil.DAT')
+
+    with pytest.raises(archive_mgr.ExtractionError):
+        archive_mgr.extract(str(tar_path), str(tmp_path / 'extract'))
+
+
+def _create_multi_member_zip(base_dir, count):
+    zip_path = base_dir / 'multi.zip'
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for idx in range(count):
+            zip_ref.writestr(F'dir/{idx}.DAT', F'Content {idx}\n' * 1000)
+    return zip_path
+
+
+PARALLEL_WORKERS = [
+    (None),
+    (1),
+    (4)
+]
+@pytest.mark.parametrize('max_workers', PARALLEL_WORKERS)
+def test_iter_archive_members_parallel(tmp_path, max_workers):
+    zip_path = _create_multi_member_zip(tmp_path, 20)
+
+    members = {}
+    for member in archive_mgr.iter_archive_members_parallel(str(zip_path),
+                                                            max_workers):
+        members[member.path] = member.file_obj.read()
+
+    assert members == {F'{zip_path}/dir/{idx}.DAT':
+                       (F'Content {idx}\n' * 1000).encode()
+                       for idx in range(20)}
+
+
+def test_iter_archive_members_parallel_nested(tmp_path):
+    tar_path = _create_nested_archive(tmp_path)
+    zip_path = tmp_path / 'outer.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        zip_ref.write(tar_path, 'outer.tar.gz')
+
+    paths = [member.path for member in
+             archive_mgr.iter_archive_members_parallel(str(zip_path), 2)]
+
+    assert sorted(paths) == [
+        F'{zip_path}/outer.tar.gz/inner.zip/A.DAT',
+        F'{zip_path}/outer.tar.gz/sub/B.DAT.gz/B.DAT'
+    ]
+
+
+def test_iter_archive_members_parallel_stop_early(tmp_path):
+    zip_path = _create_multi_member_zip(tmp_path, 50)
+
+    members = archive_mgr.iter_archive_members_parallel(str(zip_path), 2)
+    next(members)
+    members.close()
+
+
+def test_extract_zip_parallel(tmp_path):
+    zip_path = _create_multi_member_zip(tmp_path, 20)
+    dest_dir = tmp_path / 'extract'
+
+    archive_mgr.extract(str(zip_path), str(dest_dir), max_workers=4)
+
+    assert sorted(path.name for path in (dest_dir / 'dir').iterdir()) == \
+        sorted(F'{idx}.DAT' for idx in range(20))
+
+
+def test_extract_zip_parallel_invalid(tmp_path):
+    bad_zip = tmp_path / 'Bad.zip'
+    bad_zip.write_bytes(b'No Zip')
+    with pytest.raises(archive_mgr.ExtractionError):
+        archive_mgr.extract(str(bad_zip), str(tmp_path / 'extract'), 2)
+
+
+def test_iter_zip_member(tmp_path):
+    zip_path = tmp_path / 'outer.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        zip_ref.write(_create_nested_archive(tmp_path), 'outer.tar.gz')
+        zip_ref.writestr('C.DAT', b'Plain Content')
+        zip_ref.writestr('folder/', b'')
+
+    assert archive_mgr.list_zip_members(str(zip_path)) == \
+        ['outer.tar.gz', 'C.DAT']
+
+    members = {member.path: member.file_obj.read() for member in
+               archive_mgr.iter_zip_member(str(zip_path), 'C.DAT')}
+    assert members == {F'{zip_path}/C.DAT': b'Plain Content'}
+
+    members = {member.path: member.file_obj.read() for member in
+               archive_mgr.iter_zip_member(str(zip_path), 'outer.tar.gz')}
+    assert members == {
+        F'{zip_path}/outer.tar.gz/inner.zip/A.DAT': b'Zip Content',
+        F'{zip_path}/outer.tar.gz/sub/B.DAT.gz/B.DAT': b'Gzip Content'
+    }
+
+    with pytest.raises(archive_mgr.ExtractionError):
+        list(archive_mgr.iter_zip_member(str(zip_path), 'Missing.DAT'))
+
+
+def _truncated_gz(base_dir):
+    gz_path = base_dir / 'B.DAT.gz'
+    with gzip.open(gz_path, 'wb') as gz_file:
+        gz_file.write(b'Gzip Content\n' * 1000)
+    gz_path.write_bytes(gz_path.read_bytes()[:-20])
+    return gz_path
+
+
+def _corrupt_zip(base_dir):
+    """Zip with a corrupt second member."""
+    zip_path = _create_multi_member_zip(base_dir, 3)
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        info = zip_ref.getinfo('dir/1.DAT')
+    data = bytearray(zip_path.read_bytes())
+    # Past the local header of the member, in the deflated data
+    data[info.header_offset + 50] ^= 0xFF
+    zip_path.write_bytes(bytes(data))
+    return zip_path
+
+
+def test_iter_archive_members_truncated_gz(tmp_path):
+    members = archive_mgr.iter_archive_members(str(_truncated_gz(tmp_path)))
+    with pytest.raises(archive_mgr.ExtractionError, match='B.DAT.gz/B.DAT'):
+        next(members).file_obj.read()
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_iter_archive_members_corrupt_zip(tmp_path, parallel):
+    zip_path = _corrupt_zip(tmp_path)
+    members = (archive_mgr.iter_archive_members_parallel(str(zip_path), 2) if parallel
+               else archive_mgr.iter_archive_members(str(zip_path)))
+
+    read = {}
+    for member in members:
+        try:
+            read[member.path] = member.file_obj.read()
+        except archive_mgr.ExtractionError:
+            read[member.path] = None
+    # Only the corrupt member fails
+    assert read == {F'{zip_path}/dir/{idx}.DAT':
+                    None if idx == 1 else (F'Content {idx}\n' * 1000).encode()
+                    for idx in range(3)}
+
+
+def test_extract_truncated_gz(tmp_path):
+    dest_dir = tmp_path / 'extract'
+    with pytest.raises(archive_mgr.ExtractionError):
+        archive_mgr.extract(str(_truncated_gz(tmp_path)), str(dest_dir))
+    # No partially decompressed file is left behind
+    assert list(dest_dir.iterdir()) == []
@@ -0,0 +1,127 @@
+"""Test the NumPy column store."""
+
+import datetime
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import column_store  # pylint: disable=wrong-import-position
+import property_data_extractor  # pylint: disable=wrong-import-position
+
+_COLUMNS = ['Post_Code', 'Contract_Date', 'Subburb', 'Area', 'Purchase_Price']
+
+_SALES = [
+    {'Post_Code': '2336', 'Contract_Date': '1990/11/20', 'Subburb': 'ABERDEEN',
+     'Area': '802.3', 'Purchase_Price': '14500'},
+    {'Post_Code': '', 'Contract_Date': 'N/A', 'Subburb': 'WESTON',
+     'Area': '', 'Purchase_Price': 'invalid'},
+    {'Post_Code': 2326, 'Contract_Date': datetime.date(2017, 11, 21), 'Subburb': 'ABERDEEN',
+     'Area': None, 'Purchase_Price': 515000},
+]
+
+
+#####
+
+
+def test_column_store_sink(tmp_path):
+    store_path = str(tmp_path / 'store')
+    with column_store.ColumnStoreSink(store_path, _COLUMNS, batch_rows=2) as sink:
+        sink.add_property_list(_SALES)
+
+    columns = column_store.load_columns(store_path)
+    assert list(columns) == _COLUMNS
+    assert isinstance(columns['Post_Code'], np.memmap)
+    assert columns['Post_Code'].tolist() == [2336, column_store.MISSING_INT, 2326]
+    assert columns['Contract_Date'].dtype == np.dtype('datetime64[D]')
+    assert columns['Contract_Date'][[0, 2]].tolist() == [datetime.date(1990, 11, 20),
+                                                         datetime.date(2017, 11, 21)]
+    assert np.isnat(columns['Contract_Date'][1])
+    assert np.isnan(columns['Area'][1:]).all()
+    assert columns['Purchase_Price'].tolist() == [14500, column_store.MISSING_INT, 515000]
+    assert columns['Subburb'].tolist() == [0, 1, 0]
+    assert column_store.load_dictionary(store_path, 'Subburb') == ['ABERDEEN', 'WESTON']
+    # Plain np.load works as well
+    assert np.load(column_store.column_file(store_path, 'Post_Code')).shape == (3,)
+
+
+def test_column_store_append(tmp_path):
+    store_path = str(tmp_path / 'store')
+    with column_store.ColumnStoreSink(store_path, _COLUMNS) as sink:
+        sink.add_property_list(_SALES[:2])
+    # Existing stores keep their columns
+    with column_store.ColumnStoreSink(store_path) as sink:
+        sink.add_property_list(_SALES[2:] + [{'Subburb': 'KURRI KURRI'}])
+
+    assert column_store.decode_column(store_path, 'Subburb') == [
+        'ABERDEEN', 'WESTON', 'ABERDEEN', 'KURRI KURRI']
+    assert column_store.load_columns(store_path)['Post_Code'].tolist() == [
+        2336, -1, 2326, -1]
+
+    with pytest.raises(ValueError, match='stores the columns'):
+        with column_store.ColumnStoreSink(store_path, ['Post_Code']):
+            pass
+
+
+def test_column_store_uncommitted_rows(tmp_path):
+    store_path = str(tmp_path / 'store')
+    with column_store.ColumnStoreSink(store_path, _COLUMNS) as sink:
+        sink.add_property_list(_SALES[:1])
+
+    # Rows appended without a commit (e.g. by a crashed run) are dropped
+    with pytest.raises(RuntimeError):
+        with column_store.ColumnStoreSink(store_path, batch_rows=1) as sink:
+            sink.add_property_list([{'Subburb': 'LOST'}])
+            raise RuntimeError('Crash')
+    assert len(column_store.load_columns(store_path)['Subburb']) == 1
+
+    with column_store.ColumnStoreSink(store_path) as sink:
+        sink.add_property_list(_SALES[1:2])
+    assert column_store.decode_column(store_path, 'Subburb') == ['ABERDEEN', 'WESTON']
+
+
+#####
+
+
+def _write_input(tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'ARCHIVE_SALES_1990.DAT').write_text('\n'.join([
+        'A;;VALNET1;20150909 11:33;;',
+        'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+        'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+        'Z;105333;105332;;']) + '\n')
+    return str(input_dir)
+
+
+def test_ingest_npy(tmp_path):
+    store_path = str(tmp_path / 'sales.npy')
+    config = property_data_extractor.IngestConfig(
+        input_paths=[_write_input(tmp_path)], output_path=store_path, output='npy',
+        columns=['Post_Code', 'Contract_Date', 'Purchase_Price'])
+
+    summary = property_data_extractor.ingest(config)
+    assert summary.property_count == 2
+    columns = column_store.load_columns(store_path)
+    assert list(columns) == ['Post_Code', 'Contract_Date', 'Purchase_Price']
+    assert columns['Purchase_Price'].sum() == 30000
+
+    # The processed files are skipped
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 1)
+    assert len(column_store.load_columns(store_path)['Purchase_Price']) == 2
+
+
+def test_export_database(tmp_path):
+    db_path = str(tmp_path / 'sales.sql')
+    property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[_write_input(tmp_path)], output_path=db_path))
+    store_path = str(tmp_path / 'sales.npy')
+
+    assert column_store.export_database(db_path, store_path) == 2
+    columns = column_store.load_columns(store_path)
+    with sqlite3.connect(db_path) as conn:
+        assert len(columns) == len(conn.execute('PRAGMA table_info(SalesData)').fetchall()) - 1
+    assert column_store.decode_column(store_path, 'District') == ['UPPER HUNTER (Former)'] * 2
+    assert columns['Contract_Date'].max() == np.datetime64('1991-11-20')
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+
+import datetime
+
+import pytest
+import sqlalchemy
+
+import db_store
+import property_parser
+import property_parser_nsw
+
+
+################################
+# Module Function Tests
+################################
+CONTRACT_YEAR_PARTITIONS = [
+    ('1990', '1990/11/20'),
+    ('2018', '2018/01/15'),
+    (db_store.UNKNOWN_PARTITION, 'N/A'),
+    (db_store.UNKNOWN_PARTITION, ''),
+]
+@pytest.mark.parametrize('expected_partition, contract_date', CONTRACT_YEAR_PARTITIONS)
+def test_contract_year_partition(expected_partition, contract_date):
+    assert db_store.contract_year_partition(contract_date) == expected_partition
+
+
+def test_partition_table_name():
+    assert db_store.partition_table_name('1990') == 'SalesData_1990'
+
+
+########################################
+# Tests for Class PartitionedDataManager
+########################################
+COLUMNS = ['File_Name', 'Contract_Date', 'Purchase_Price']
+
+
+def _add_partitioned_sales(database, sales, partitions=None):
+    with database.session_scope() as session:
+        with db_store.PartitionedDataManager(session, COLUMNS, 2, partitions) as manager:
+            manager.add_property_list(sales)
+
+
+def test_partitioned_data_manager(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, partitioned=True)
+        _add_partitioned_sales(database, [
+            {'File_Name': 'A.DAT', 'Contract_Date': '1990/11/20', 'Purchase_Price': '100'},
+            {'File_Name': 'B.DAT', 'Contract_Date': '2018/01/15', 'Purchase_Price': '200'},
+            {'File_Name': 'B.DAT', 'Contract_Date': 'N/A', 'Purchase_Price': '300'}])
+
+        with database.session_scope() as session:
+            manager = db_store.PartitionedDataManager(session, COLUMNS)
+            assert manager.get_partitions() == ['1990', '2018', db_store.UNKNOWN_PARTITION]
+            prices = session.execute('SELECT Purchase_Price FROM SalesData ORDER BY Purchase_Price')
+            assert [row[0] for row in prices] == ['100', '200', '300']
+            year_count = session.execute('SELECT COUNT(*) FROM SalesData_2018').scalar()
+            assert year_count == 1
+
+
+def test_partitioned_data_manager_reload(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, partitioned=True)
+        with database.session_scope() as session:
+            with db_store.DataManager(session) as manager:
+                archive = db_store.ScannedFile(full_path='x/ARCHIVE.zip', processed=True)
+                manager.add_scanned_file(archive)
+                manager.add_scanned_file(db_store.ScannedFile(
+                    full_path='x/EXTRACT_ARCHIVE.zip/A.DAT', processed=True,
+                    extracted_from_id=archive.id))
+                manager.add_scanned_file(db_store.ScannedFile(
+                    full_path='x/B.DAT', processed=True))
+
+        sales = [{'File_Name': 'A.DAT', 'Contract_Date': '1990/11/20', 'Purchase_Price': '100'},
+                 {'File_Name': 'B.DAT', 'Contract_Date': '2018/01/15', 'Purchase_Price': '200'}]
+        _add_partitioned_sales(database, sales)
+
+        with database.session_scope() as session:
+            manager = db_store.PartitionedDataManager(session, COLUMNS)
+            assert manager.drop_partition('1990') == 2
+            assert manager.drop_partition('1990') == 0
+            assert manager.get_partitions() == ['2018']
+            processed = {entry.full_path: entry.processed
+                         for entry in session.query(db_store.ScannedFile)}
+            assert processed == {'x/ARCHIVE.zip': False,
+                                 'x/EXTRACT_ARCHIVE.zip/A.DAT': False,
+                                 'x/B.DAT': True}
+
+        _add_partitioned_sales(database, sales, ['1990'])
+
+        with database.session_scope() as session:
+            assert session.execute('SELECT COUNT(*) FROM SalesData').scalar() == 2
+
+
+################################
+# Tests for the typed layout
+################################
+UNTYPED_SALES = [
+    {'File_Name': 'A.DAT', 'Contract_Date': '1990/11/20', 'Purchase_Price': '100'},
+    {'File_Name': 'B.DAT', 'Contract_Date': 'N/A', 'Purchase_Price': ''}]
+TYPED_SALES = [('A.DAT', '1990-11-20', 100), ('B.DAT', None, None)]
+
+
+def test_typed_create(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, typed=True)
+        assert database.is_typed()
+        with database.session_scope() as session:
+            with db_store.DataManager(session) as manager:
+                manager.add_property_list([
+                    {'File_Name': 'A.DAT', 'Contract_Date': datetime.date(1990, 11, 20),
+                     'Purchase_Price': 100},
+                    {'File_Name': 'B.DAT', 'Contract_Date': None, 'Purchase_Price': None}])
+            sales = session.execute('SELECT File_Name, Contract_Date, Purchase_Price FROM SalesData')
+            assert [tuple(row) for row in sales] == TYPED_SALES
+
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_migrate_to_typed(tmp_path, partitioned):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, partitioned=partitioned)
+        with database.session_scope() as session:
+            if partitioned:
+                manager = db_store.PartitionedDataManager(session, COLUMNS)
+            else:
+                manager = db_store.DataManager(session)
+            with manager:
+                manager.add_property_list(UNTYPED_SALES)
+        assert not database.is_typed()
+
+        database.migrate_to_typed(COLUMNS)
+
+        assert database.is_typed()
+        with database.session_scope() as session:
+            sales = session.execute(
+                'SELECT File_Name, Contract_Date, Purchase_Price FROM SalesData ORDER BY File_Name')
+            assert [tuple(row) for row in sales] == TYPED_SALES
+
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_migrate_to_typed_indexes(tmp_path, partitioned):
+    def _indexes(session):
+        return sorted(row[0] for row in session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(DEDUP_COLUMNS, partitioned=partitioned)
+        with database.session_scope() as session:
+            if partitioned:
+                manager = db_store.PartitionedDataManager(session, DEDUP_COLUMNS)
+            else:
+                manager = db_store.DataManager(session)
+            manager.enable_deduplication()
+            manager.enable_query_indexes()
+            with manager:
+                manager.add_property_list(DEDUP_SALES)
+            indexes = _indexes(session)
+            assert db_store.has_natural_key_index(session)
+            assert db_store.has_query_indexes(session)
+
+        database.migrate_to_typed(DEDUP_COLUMNS)
+
+        with database.session_scope() as session:
+            assert _indexes(session) == indexes
+            # The natural key is still enforced
+            table_name = db_store.partition_table_name('2018') if partitioned else 'SalesData'
+            with pytest.raises(sqlalchemy.exc.IntegrityError):
+                session.execute(
+                    F'INSERT INTO "{table_name}" (District_Code, Property_ID, Contract_Date, Purchase_Price) '
+                    F"VALUES ('001', '1', '2018-01-15', 100)")
+
+
+#######################################
+# Tests for Class NormalisedDataManager
+#######################################
+def test_normalised_data_manager(tmp_path):
+    columns = ['File_Name', 'District', 'Purchase_Price']
+    sales = [{'File_Name': 'A.DAT', 'District': 'DUNGOG', 'Purchase_Price': '100'},
+             {'File_Name': 'A.DAT', 'District': 'CESSNOCK', 'Purchase_Price': '200'},
+             {'File_Name': 'B.DAT', 'District': 'DUNGOG', 'Purchase_Price': '300'}]
+
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(columns, normalised=True)
+        assert database.is_normalised()
+        for _ in range(2):
+            with database.session_scope() as session:
+                with db_store.NormalisedDataManager(session) as manager:
+                    manager.add_property_list(sales)
+
+        with database.session_scope() as session:
+            flat = session.execute('SELECT File_Name, District, Purchase_Price FROM SalesData ORDER BY id')
+            assert [dict(row) for row in flat] == sales * 2
+            districts = session.execute('SELECT value FROM Dim_District ORDER BY id')
+            assert [row[0] for row in districts] == ['DUNGOG', 'CESSNOCK']
+            fact_columns = session.execute('SELECT * FROM SalesFact').keys()
+            assert list(fact_columns) == ['id', 'File_Name_Id', 'District_Id', 'Purchase_Price']
+
+        database.migrate_to_typed(columns)
+        assert database.is_typed()
+        with database.session_scope() as session:
+            prices = session.execute('SELECT Purchase_Price FROM SalesData WHERE District = "DUNGOG"')
+            assert [row[0] for row in prices] == [100, 300, 100, 300]
+
+
+def test_create_partitioned_normalised(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        with pytest.raises(ValueError):
+            database.create(COLUMNS, partitioned=True, normalised=True)
+
+
+################################
+# Tests for sale deduplication
+################################
+def test_sale_deduplicator():
+    deduplicator = db_store.SaleDeduplicator()
+    sale = {'File_Name': 'A.DAT', 'District_Code': '001', 'Property_ID': '42',
+            'Contract_Date': '2018/01/15', 'Purchase_Price': '100'}
+    without_id = dict(sale, Property_ID='')
+
+    assert deduplicator.filter([sale, without_id]) == [sale, without_id]
+    assert deduplicator.filter([dict(sale, File_Name='B.DAT'), without_id,
+                                dict(sale, Purchase_Price='200')]) == [
+                                    without_id, dict(sale, Purchase_Price='200')]
+    assert deduplicator.duplicate_counts == {'B.DAT': 1}
+    assert deduplicator.duplicate_total == 1
+    assert len(deduplicator) == 2
+
+
+DEDUP_COLUMNS = ['File_Name', 'District_Code', 'Property_ID', 'Contract_Date', 'Purchase_Price']
+DEDUP_SALES = [
+    {'File_Name': 'A.DAT', 'District_Code': '001', 'Property_ID': '1',
+     'Contract_Date': '2018/01/15', 'Purchase_Price': '100'},
+    {'File_Name': 'A.DAT', 'District_Code': '001', 'Property_ID': '2',
+     'Contract_Date': '1990/01/15', 'Purchase_Price': '100'}]
+
+
+@pytest.mark.parametrize('layout', ['plain', 'partitioned', 'normalised'])
+def test_data_manager_deduplication(tmp_path, layout):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(DEDUP_COLUMNS, partitioned=layout == 'partitioned',
+                        normalised=layout == 'normalised')
+
+        for file_name in ['A.DAT', 'B.DAT']:
+            with database.session_scope() as session:
+                if layout == 'partitioned':
+                    manager = db_store.PartitionedDataManager(session, DEDUP_COLUMNS)
+                elif layout == 'normalised':
+                    manager = db_store.NormalisedDataManager(session)
+                else:
+                    manager = db_store.DataManager(session)
+                manager.enable_deduplication()
+                with manager:
+                    manager.add_property_list([dict(sale, File_Name=file_name)
+                                               for sale in DEDUP_SALES * 2])
+                assert manager.duplicate_counts == {
+                    file_name: 2 if file_name == 'A.DAT' else 4}
+
+        with database.session_scope() as session:
+            assert session.execute('SELECT COUNT(*) FROM SalesData').scalar() == 2
+
+
+################################
+# Tests for sales aggregates
+################################
+AGGREGATE_COLUMNS = ['File_Name', 'District', 'Subburb', 'Contract_Date', 'Purchase_Price']
+AGGREGATE_SALES = [
+    {'File_Name': 'A.DAT', 'District': 'SYDNEY', 'Subburb': 'PYRMONT',
+     'Contract_Date': '2018/01/15', 'Purchase_Price': '100'},
+    {'File_Name': 'A.DAT', 'District': 'SYDNEY', 'Subburb': 'ULTIMO',
+     'Contract_Date': '2018/02/15', 'Purchase_Price': '300'},
+    {'File_Name': 'A.DAT', 'District': 'SYDNEY', 'Subburb': 'PYRMONT',
+     'Contract_Date': '1990/11/20', 'Purchase_Price': ''}]
+
+
+def _aggregate_summary(session, level):
+    return [(row.area, row.quarter, row.sales_count, row.mean_price)
+            for row in db_store.query_aggregates(session, level)]
+
+
+@pytest.mark.parametrize('layout', ['plain', 'partitioned', 'normalised'])
+def test_data_manager_aggregates(tmp_path, layout):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(AGGREGATE_COLUMNS, partitioned=layout == 'partitioned',
+                        normalised=layout == 'normalised')
+
+        # Stored before the aggregates are enabled, built on enabling
+        for sales in [AGGREGATE_SALES[:1], AGGREGATE_SALES[1:]]:
+            with database.session_scope() as session:
+                if layout == 'partitioned':
+                    manager = db_store.PartitionedDataManager(session, AGGREGATE_COLUMNS, 1)
+                elif layout == 'normalised':
+                    manager = db_store.NormalisedDataManager(session, 1)
+                else:
+                    manager = db_store.DataManager(session, 1)
+                if db_store.has_aggregates(session):
+                    manager.enable_aggregates()
+                with manager:
+                    manager.add_property_list(sales)
+                    manager.enable_aggregates()
+                    manager.add_property_list(sales)
+
+        with database.session_scope() as session:
+            assert _aggregate_summary(session, 'district') == [
+                ('SYDNEY', '1990-Q4', 2, None),
+                ('SYDNEY', '2018-Q1', 4, 200.0)]
+            incremental = _aggregate_summary(session, 'suburb')
+            assert incremental == [
+                ('PYRMONT', '1990-Q4', 2, None),
+                ('PYRMONT', '2018-Q1', 2, 100.0),
+                ('ULTIMO', '2018-Q1', 2, 300.0)]
+
+            db_store.rebuild_aggregates(session)
+            assert _aggregate_summary(session, 'suburb') == incremental
+
+            rows = db_store.query_aggregates(session, 'suburb', 'ULTIMO', '2018-Q1')
+            assert len(rows) == 1
+            assert rows[0].median_price == pytest.approx(300, rel=0.01)
+
+
+def test_partitioned_reload_aggregates(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(AGGREGATE_COLUMNS, partitioned=True)
+        for partitions in [None, ['2018']]:
+            with database.session_scope() as session:
+                manager = db_store.PartitionedDataManager(
+                    session, AGGREGATE_COLUMNS, partitions=partitions)
+                for partition in partitions or []:
+                    manager.drop_partition(partition)
+                manager.enable_aggregates()
+                with manager:
+                    manager.add_property_list(AGGREGATE_SALES)
+
+        with database.session_scope() as session:
+            assert _aggregate_summary(session, 'district') == [
+                ('SYDNEY', '1990-Q4', 1, None),
+                ('SYDNEY', '2018-Q1', 2, 200.0)]
+
+
+def test_query_aggregates_invalid(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(AGGREGATE_COLUMNS)
+        with database.session_scope() as session:
+            with pytest.raises(ValueError):
+                db_store.query_aggregates(session, 'suburb')
+            db_store.create_aggregate_table(session)
+            with pytest.raises(ValueError):
+                db_store.query_aggregates(session, 'state')
+            assert db_store.query_aggregates(session, 'suburb') == []
+
+
+################################
+# Tests for the address index
+################################
+ADDRESS_SALES_COLUMNS = ['File_Name', 'Unit_Number', 'House_Number', 'Street_Name', 'Subburb',
+                         'Post_Code', 'Contract_Date', 'Purchase_Price']
+ADDRESS_SALES = [
+    {'File_Name': 'A.DAT', 'Unit_Number': '', 'House_Number': '12', 'Street_Name': 'HARRIS ST',
+     'Subburb': 'PYRMONT', 'Post_Code': '2009', 'Contract_Date': '2018/01/15',
+     'Purchase_Price': '100'},
+    {'File_Name': 'A.DAT', 'Unit_Number': '4', 'House_Number': '7', 'Street_Name': 'HARRIS RD',
+     'Subburb': 'ULTIMO', 'Post_Code': '2007', 'Contract_Date': '1990/11/20',
+     'Purchase_Price': '200'},
+    {'File_Name': 'A.DAT', 'Unit_Number': '', 'House_Number': '1', 'Street_Name': 'JONES ST',
+     'Subburb': 'PYRMONT', 'Post_Code': '2009', 'Contract_Date': '2018/02/15',
+     'Purchase_Price': '300'}]
+
+ADDRESS_SEARCHES = [
+    ('harr', True, ['100', '200']),
+    ('harris st pyrm', True, ['100']),
+    ('jon 2009', True, ['300']),
+    ('smith', True, []),
+    ('', True, []),
+    ('Subburb: pyrmont AND Post_Code: 2009', False, ['100', '300']),
+]
+@pytest.mark.parametrize('layout', ['plain', 'partitioned', 'normalised'])
+@pytest.mark.parametrize('query, prefix, expected_prices', ADDRESS_SEARCHES)
+def test_search_addresses(tmp_path, layout, query, prefix, expected_prices):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(ADDRESS_SALES_COLUMNS, partitioned=layout == 'partitioned',
+                        normalised=layout == 'normalised')
+
+        # The index is filled from existing sales on creation and by triggers afterwards
+        for sales in [ADDRESS_SALES[:1], ADDRESS_SALES[1:]]:
+            with database.session_scope() as session:
+                if layout == 'partitioned':
+                    manager = db_store.PartitionedDataManager(session, ADDRESS_SALES_COLUMNS)
+                elif layout == 'normalised':
+                    manager = db_store.NormalisedDataManager(session)
+                else:
+                    manager = db_store.DataManager(session)
+                if db_store.has_address_index(session):
+                    manager.enable_address_index()
+                with manager:
+                    manager.add_property_list(sales)
+                manager.enable_address_index()
+
+        with database.session_scope() as session:
+            sales = db_store.search_addresses(session, query, prefix=prefix)
+            assert sorted(sale['Purchase_Price'] for sale in sales) == expected_prices
+
+
+def test_search_addresses_sync(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(ADDRESS_SALES_COLUMNS, partitioned=True)
+        with database.session_scope() as session:
+            manager = db_store.PartitionedDataManager(session, ADDRESS_SALES_COLUMNS)
+            assert not db_store.has_address_index(session)
+            manager.enable_address_index()
+            with manager:
+                manager.add_property_list(ADDRESS_SALES)
+            assert db_store.has_address_index(session)
+
+            session.execute('DELETE FROM SalesData_2018 WHERE Purchase_Price = 100')
+            manager.drop_partition('1990')
+            sales = db_store.search_addresses(session, 'harr OR jones', prefix=False)
+            assert [sale['Purchase_Price'] for sale in sales] == ['300']
+            assert db_store.search_addresses(session, 'jones', limit=0) == []
+
+
+################################
+# Tests for Class BatchBudget
+################################
+def test_batch_budget():
+    budget = db_store.BatchBudget(10000, target_commit_seconds=2.0, min_rows=10)
+    sale = {'File_Name': 'A.DAT', 'Contract_Date': '2018/01/15', 'Purchase_Price': '100'}
+    sale_bytes = db_store.estimate_property_bytes(sale)
+    assert sale_bytes > 0
+
+    budget.add([sale] * 40)
+    assert budget.buffered_bytes == 40 * sale_bytes
+    assert budget.should_flush(40) == (40 * sale_bytes >= 10000)
+    budget.add([sale] * 1000)
+    assert budget.should_flush(1040)
+
+    budget.record_flush(1040, 1.0)
+    assert budget.buffered_bytes == 0
+    assert budget.row_limit == 2080
+    assert not budget.should_flush(2079)
+    assert budget.should_flush(2080)
+
+    # The throughput is smoothed, the row limit has a lower bound
+    budget.record_flush(4, 1.0)
+    assert budget.row_limit == 1044
+    budget.record_flush(1, 100.0)
+    assert budget.row_limit == 522
+    budget.record_flush(0, 0)
+    assert budget.row_limit == 522
+
+    with pytest.raises(ValueError):
+        db_store.BatchBudget(0)
+
+
+def test_data_manager_memory_budget(tmp_path):
+    sales = [{'File_Name': 'A.DAT', 'Contract_Date': '2018/01/15', 'Purchase_Price': str(idx)}
+             for idx in range(100)]
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS)
+        with database.session_scope() as session:
+            manager = db_store.DataManager(session, commit_max=1000000)
+            manager.enable_memory_budget(50 * db_store.estimate_property_bytes(sales[0]))
+            with manager:
+                manager.add_property_list(sales[:49])
+                assert session.execute('SELECT COUNT(*) FROM SalesData').scalar() == 0
+                manager.add_property_list(sales[49:])
+                assert session.execute('SELECT COUNT(*) FROM SalesData').scalar() == 100
+
+
+def test_quarantine_upgrade(tmp_path):
+    line = property_parser.QuarantinedLine(3, 'B;011', 'Too short')
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS)
+        with database.session_scope() as session:
+            # Quarantine of an older version, without the paths
+            session.execute('CREATE TABLE "QuarantinedLine" (id INTEGER PRIMARY KEY, '
+                            'File_Name VARCHAR(255), Line_No INTEGER, Line VARCHAR, Error VARCHAR)')
+            session.execute("INSERT INTO QuarantinedLine (File_Name, Line_No, Line, Error) "
+                            "VALUES ('A.DAT', 2, 'B;', 'Old'), ('B.DAT', 2, 'B;', 'Old')")
+            with db_store.DataManager(session) as manager:
+                manager.add_quarantined_lines('in/1/A.DAT', [line], property_parser_nsw.NswOldPropertyFile)
+                manager.add_quarantined_lines('in/2/A.DAT', [line], property_parser_nsw.NswOldPropertyFile)
+                # The old rows of the file are replaced, the same names of other paths are kept
+                assert [row[1:] for row in manager.get_quarantined_lines()] == [
+                    ('A.DAT', 3, 'B;011', 'Too short', 'in/1/A.DAT', 'NswOldPropertyFile'),
+                    ('A.DAT', 3, 'B;011', 'Too short', 'in/2/A.DAT', 'NswOldPropertyFile'),
+                    ('B.DAT', 2, 'B;', 'Old', None, None)]
@@ -0,0 +1,174 @@
+"""Test the DuckDB database backend."""
+
+import datetime
+
+import pytest
+
+duckdb = pytest.importorskip('duckdb')
+pytest.importorskip('pyarrow')
+
+import db_store  # pylint: disable=wrong-import-position
+import duckdb_store  # pylint: disable=wrong-import-position
+import property_data_extractor  # pylint: disable=wrong-import-position
+
+_COLUMNS = ['District_Code', 'Property_ID', 'Contract_Date', 'Purchase_Price', 'Area', 'File_Name']
+
+_SALES = [
+    {'District_Code': '011', 'Property_ID': '292674', 'Contract_Date': datetime.date(1990, 11, 20),
+     'Purchase_Price': 14500, 'Area': 802.3, 'File_Name': 'ARCHIVE_SALES_1990.DAT'},
+    {'District_Code': '011', 'Property_ID': '292675', 'Contract_Date': None,
+     'Purchase_Price': None, 'Area': None, 'File_Name': 'ARCHIVE_SALES_1990.DAT'},
+]
+
+
+def _sales(db_path, columns='*'):
+    with duckdb.connect(db_path) as connection:
+        return connection.execute(F'SELECT {columns} FROM SalesData').fetchall()
+
+
+#####
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_data_manager(tmp_path, typed):
+    db_path = str(tmp_path / 'sales.duckdb')
+    with duckdb_store.DuckDb(db_path) as database:
+        database.create(_COLUMNS, typed)
+        assert database.sales_data_columns() == _COLUMNS
+        assert database.is_typed() == typed
+        sales = [dict(sale) for sale in _SALES]
+        if not typed:
+            sales[0].update({'Contract_Date': '1990-11-20', 'Purchase_Price': '14500', 'Area': '802.3'})
+        with duckdb_store.DuckDbDataManager(database.connection, _COLUMNS, typed, commit_max=1) as data_manager:
+            data_manager.add_property_list(sales)
+
+    rows = _sales(db_path, 'Contract_Date, Purchase_Price, Area')
+    if typed:
+        assert rows == [(datetime.date(1990, 11, 20), 14500, 802.3), (None, None, None)]
+    else:
+        assert rows == [('1990-11-20', '14500', '802.3'), (None, None, None)]
+
+
+def test_scanned_files(tmp_path):
+    db_path = str(tmp_path / 'sales.duckdb')
+    with duckdb_store.DuckDb(db_path) as database:
+        database.create(_COLUMNS)
+        with duckdb_store.DuckDbDataManager(database.connection, _COLUMNS) as data_manager:
+            archive = db_store.ScannedFile(full_path='a.zip', processed=False, size_bytes=10, checksum=20)
+            data_manager.add_scanned_file(archive)
+            member = db_store.ScannedFile(full_path='a.zip/a.DAT', processed=False, size_bytes=11,
+                                          checksum=21, extracted_from_id=archive.id)
+            data_manager.add_scanned_file(member)
+            assert data_manager.find_scanned_file(11, 21) is member
+            # The flags are written with the next commit
+            member.processed = True
+            data_manager.commit()
+            # Files still unprocessed are written by later commits
+            archive.processed = True
+
+        with duckdb_store.DuckDbDataManager(database.connection, _COLUMNS) as data_manager:
+            found = data_manager.find_scanned_file(11, 21)
+            assert (found.full_path, found.processed, found.extracted_from_id) == (
+                'a.zip/a.DAT', True, archive.id)
+            assert data_manager.find_scanned_file(10, 20).processed
+            assert data_manager.find_scanned_file(12, 21) is None
+
+
+def test_rollback(tmp_path):
+    db_path = str(tmp_path / 'sales.duckdb')
+    with duckdb_store.DuckDb(db_path) as database:
+        database.create(_COLUMNS, typed=True)
+        with pytest.raises(RuntimeError):
+            with duckdb_store.DuckDbDataManager(database.connection, _COLUMNS, True) as data_manager:
+                data_manager.add_scanned_file(db_store.ScannedFile(
+                    full_path='a.DAT', processed=True, size_bytes=10, checksum=20))
+                data_manager.add_property_list(_SALES)
+                raise RuntimeError('Crash')
+
+        with duckdb_store.DuckDbDataManager(database.connection, _COLUMNS, True) as data_manager:
+            assert data_manager.find_scanned_file(10, 20) is None
+    assert _sales(db_path) == []
+
+
+def test_deduplication(tmp_path):
+    db_path = str(tmp_path / 'sales.duckdb')
+    with duckdb_store.DuckDb(db_path) as database:
+        database.create(_COLUMNS, typed=True)
+        for _ in range(2):
+            data_manager = duckdb_store.DuckDbDataManager(database.connection, _COLUMNS, True)
+            data_manager.enable_deduplication()
+            with data_manager:
+                data_manager.add_property_list(_SALES + _SALES[:1])
+
+    # The stored sales are known to the second run
+    assert data_manager.duplicate_counts == {'ARCHIVE_SALES_1990.DAT': 3}
+    assert len(_sales(db_path)) == 2
+
+
+#####
+
+
+def _write_input(tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'ARCHIVE_SALES_1990.DAT').write_text('\n'.join([
+        'A;;VALNET1;20150909 11:33;;',
+        'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+        'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+        'Z;105333;105332;;']) + '\n')
+    (input_dir / 'COPY_ARCHIVE_SALES_1991.DAT').write_text('\n'.join([
+        'A;;VALNET1;20150909 11:33;;',
+        'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+        'Z;105333;105332;;']) + '\n')
+    return str(input_dir)
+
+
+def test_ingest_duckdb(tmp_path):
+    db_path = str(tmp_path / 'sales.duckdb')
+    config = property_data_extractor.IngestConfig(
+        input_paths=[_write_input(tmp_path)], output_path=db_path, output='duckdb',
+        typed=True, dedup=True)
+
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.property_count) == (2, 3)
+    assert summary.duplicate_counts == {'COPY_ARCHIVE_SALES_1991.DAT': 1}
+    assert sorted(_sales(db_path, 'Contract_Date, Purchase_Price')) == [
+        (datetime.date(1990, 11, 20), 14500), (datetime.date(1991, 11, 20), 15500)]
+
+    # The processed files are skipped
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 2)
+    assert len(_sales(db_path)) == 2
+
+
+def test_ingest_duckdb_columns(tmp_path):
+    db_path = str(tmp_path / 'sales.duckdb')
+    input_dir = _write_input(tmp_path)
+    property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[input_dir], output_path=db_path, output='duckdb',
+        columns=['Property_ID', 'Purchase_Price']))
+    assert sorted(_sales(db_path)) == [('292674', '14500'), ('292675', '15500'), ('292675', '15500')]
+
+    with pytest.raises(ValueError, match='does not store the columns: Post_Code'):
+        property_data_extractor.ingest(property_data_extractor.IngestConfig(
+            input_paths=[input_dir], output_path=db_path, output='duckdb',
+            columns=['Post_Code']))
+    with pytest.raises(ValueError, match='does not use the typed layout'):
+        property_data_extractor.ingest(property_data_extractor.IngestConfig(
+            input_paths=[input_dir], output_path=db_path, output='duckdb', typed=True))
+
+
+INVALID_DUCKDB_CONFIGS = [
+    ({'aggregates': True}, '"aggregates" requires the sql output'),
+    ({'shard_workers': 2}, '"shard_workers" requires the sql output'),
+    ({'dedup': True, 'columns': ['Post_Code']}, '"dedup" requires the columns'),
+]
+
+
+@pytest.mark.parametrize('values, message', INVALID_DUCKDB_CONFIGS)
+def test_invalid_duckdb_config(tmp_path, values, message):
+    config = property_data_extractor.IngestConfig(
+        input_paths=[str(tmp_path)], output_path=str(tmp_path / 'sales.duckdb'),
+        output='duckdb', **values)
+    with pytest.raises(ValueError, match=message):
+        property_data_extractor.ingest(config)
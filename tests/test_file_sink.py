@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+
+import pytest
+
+import file_sink
+
+
+PROPERTY_LIST = [
+    {'File_Name': 'A.DAT', 'Purchase_Price': '100', 'Ignored': 'x'},
+    {'File_Name': 'B.DAT', 'Contract_Date': datetime.date(2018, 1, 15)}
+]
+
+
+################################
+# Tests for Class CsvSink
+################################
+def test_csv_sink_append(tmp_path):
+    csv_path = str(tmp_path / 'test.csv')
+    for _ in range(2):
+        with file_sink.CsvSink(csv_path, ['File_Name', 'Purchase_Price', 'Contract_Date']) as sink:
+            sink.add_property_list(PROPERTY_LIST)
+            sink.commit()
+
+    with open(csv_path, encoding='utf-8') as csv_file:
+        assert csv_file.read() == ('File_Name,Purchase_Price,Contract_Date\n' +
+                                   'A.DAT,100,\nB.DAT,,2018-01-15\n' * 2)
+
+
+def test_csv_sink_outside_context(tmp_path):
+    sink = file_sink.CsvSink(str(tmp_path / 'test.csv'), ['File_Name'])
+    with pytest.raises(ValueError):
+        sink.add_property_list(PROPERTY_LIST)
+
+
+################################
+# Tests for Class JsonlSink
+################################
+def test_jsonl_sink(tmp_path):
+    jsonl_path = str(tmp_path / 'test.jsonl')
+    with file_sink.JsonlSink(jsonl_path) as sink:
+        sink.add_property_list(PROPERTY_LIST)
+
+    with open(jsonl_path, encoding='utf-8') as jsonl_file:
+        lines = [json.loads(line) for line in jsonl_file]
+    assert lines == [PROPERTY_LIST[0], {'File_Name': 'B.DAT', 'Contract_Date': '2018-01-15'}]
+
+
+################################
+# Tests for Class ProcessedFileSink
+################################
+def test_processed_file_sink(tmp_path):
+    jsonl_path = str(tmp_path / 'test.jsonl')
+    manifest_path = jsonl_path + file_sink.MANIFEST_SUFFIX
+    with file_sink.ProcessedFileSink(file_sink.JsonlSink(jsonl_path), manifest_path) as sink:
+        archive = file_sink.ScannedFileRecord(full_path='a.zip', processed=False, size_bytes=10, checksum=20)
+        sink.add_scanned_file(archive)
+        member = file_sink.ScannedFileRecord(full_path='a.zip/A.DAT', processed=False, size_bytes=11,
+                                      checksum=21, extracted_from_id=archive.id)
+        sink.add_scanned_file(member)
+        assert sink.find_scanned_file(11, 21) is member
+        sink.add_property_list(PROPERTY_LIST)
+        member.processed = True
+        sink.commit()
+        # Recorded once committed
+        with open(manifest_path, encoding='utf-8') as manifest:
+            assert len(manifest.readlines()) == 2
+        archive.processed = True
+
+    with file_sink.ProcessedFileSink(file_sink.JsonlSink(jsonl_path), manifest_path) as sink:
+        found = sink.find_scanned_file(10, 20)
+        assert (found.full_path, found.processed) == ('a.zip', True)
+        found = sink.find_scanned_file(11, 21)
+        assert (found.full_path, found.processed, found.extracted_from_id) == (
+            'a.zip/A.DAT', True, archive.id)
+        assert sink.find_scanned_file(12, 21) is None
+
+
+def test_processed_file_sink_error(tmp_path):
+    jsonl_path = str(tmp_path / 'test.jsonl')
+    manifest_path = jsonl_path + file_sink.MANIFEST_SUFFIX
+    with pytest.raises(RuntimeError):
+        with file_sink.ProcessedFileSink(file_sink.JsonlSink(jsonl_path), manifest_path,
+                                         record_on_commit=False) as sink:
+            sink.add_scanned_file(file_sink.ScannedFileRecord(
+                full_path='A.DAT', processed=True, size_bytes=10, checksum=20))
+            sink.commit()
+            raise RuntimeError('Crash')
+    # Nothing is recorded without closing the sink
+    with file_sink.ProcessedFileSink(file_sink.JsonlSink(jsonl_path), manifest_path) as sink:
+        assert sink.find_scanned_file(10, 20) is None
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'oz_property_parser')
+
+# Generous budget for the cumulative import time of a module in microseconds
+IMPORT_TIME_BUDGET_US = 500000
+
+
+def _import_times(module):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_DIR, env.get('PYTHONPATH', '')])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', F'import {module}'],
+                            env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+PARSER_MODULES = [
+    ('property_parser'),
+    ('property_parser_nsw'),
+    ('property_file_manager'),
+    ('file_sink'),
+    ('property_data_extractor')
+]
+@pytest.mark.parametrize('module', PARSER_MODULES)
+def test_import_time(module):
+    times = _import_times(module)
+
+    assert module in times
+    assert not [name for name in times if name.startswith('sqlalchemy')]
+    assert times[module] < IMPORT_TIME_BUDGET_US
+
+
+SALES_LINES = [
+    'A;;VALNET1;20150909 11:33;;',
+    'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+    'Z;105333;105332;;',
+]
+
+INGEST_SCRIPT = '''
+import sys
+import property_data_extractor
+summary = property_data_extractor.ingest(property_data_extractor.IngestConfig(
+    input_paths=[sys.argv[1]], output_path=sys.argv[2], output=sys.argv[3]))
+assert summary.property_count == 1, summary
+print(sorted(name for name in sys.modules if name.split('.')[0] in ('sqlalchemy', 'db_store')))
+'''
+
+
+@pytest.mark.parametrize('output', ['csv', 'jsonl'])
+def test_file_output_without_sqlalchemy(tmp_path, output):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'ARCHIVE_SALES_1990.DAT').write_text('\n'.join(SALES_LINES) + '\n')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_DIR, env.get('PYTHONPATH', '')])
+    result = subprocess.run(
+        [sys.executable, '-c', INGEST_SCRIPT, str(input_dir), str(tmp_path / F'sales.{output}'), output],
+        env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # The file outputs never load the database backend
+    assert result.stdout.strip() == '[]'
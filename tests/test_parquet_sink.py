@@ -0,0 +1,152 @@
+"""Test the Parquet dataset output."""
+
+import datetime
+import os
+
+import pytest
+
+pyarrow = pytest.importorskip('pyarrow')
+
+import pyarrow.parquet  # pylint: disable=wrong-import-position
+
+import parquet_sink  # pylint: disable=wrong-import-position
+import property_data_extractor  # pylint: disable=wrong-import-position
+import property_parser  # pylint: disable=wrong-import-position
+
+_COLUMNS = ['Post_Code', 'Contract_Date', 'Subburb', 'Area', 'Purchase_Price']
+
+_SALES = [
+    {'Post_Code': '2336', 'Contract_Date': '1990/11/20', 'Subburb': 'ABERDEEN',
+     'Area': '802.3', 'Purchase_Price': '14500'},
+    {'Post_Code': '', 'Contract_Date': 'N/A', 'Subburb': 'WESTON',
+     'Area': '', 'Purchase_Price': 'invalid'},
+    {'Post_Code': 2326, 'Contract_Date': datetime.date(2017, 11, 21), 'Subburb': 'ABERDEEN',
+     'Area': None, 'Purchase_Price': 515000},
+]
+
+
+def _part_files(dataset_path):
+    return sorted(os.path.relpath(os.path.join(root, name), dataset_path)
+                  for root, _, names in os.walk(dataset_path) for name in names)
+
+
+#####
+
+
+def test_arrow_schema():
+    schema = parquet_sink.arrow_schema([field.value for field in property_parser.PropertyData])
+    assert schema.names == [field.value for field in property_parser.PropertyData]
+    assert schema.field('Post_Code').type == pyarrow.int64()
+    assert schema.field('Area').type == pyarrow.float64()
+    assert schema.field('Contract_Date').type == pyarrow.date32()
+    assert schema.field('Subburb').type == pyarrow.string()
+
+    # The PropertyData order is kept whatever the order requested
+    assert parquet_sink.arrow_schema(['Purchase_Price', 'Post_Code']).names == [
+        'Post_Code', 'Purchase_Price']
+
+
+def test_parquet_sink(tmp_path):
+    dataset_path = str(tmp_path / 'sales.parquet')
+    with parquet_sink.ParquetSink(dataset_path, _COLUMNS, row_group_size=2,
+                                  compression='zstd') as sink:
+        sink.add_property_list(_SALES)
+
+    [part_file] = _part_files(dataset_path)
+    metadata = pyarrow.parquet.ParquetFile(os.path.join(dataset_path, part_file)).metadata
+    assert metadata.num_row_groups == 2
+    assert metadata.row_group(0).num_rows == 2
+    subburb = metadata.row_group(0).column(metadata.schema.names.index('Subburb'))
+    assert subburb.compression == 'ZSTD'
+    assert subburb.has_dictionary_page
+    assert not metadata.row_group(0).column(0).has_dictionary_page
+
+    table = pyarrow.parquet.read_table(dataset_path)
+    # In the PropertyData order
+    assert table.schema.names == ['Area', 'Subburb', 'Post_Code', 'Contract_Date', 'Purchase_Price']
+    assert table.to_pylist() == [
+        {'Post_Code': 2336, 'Contract_Date': datetime.date(1990, 11, 20), 'Subburb': 'ABERDEEN',
+         'Area': 802.3, 'Purchase_Price': 14500},
+        {'Post_Code': None, 'Contract_Date': None, 'Subburb': 'WESTON',
+         'Area': None, 'Purchase_Price': None},
+        {'Post_Code': 2326, 'Contract_Date': datetime.date(2017, 11, 21), 'Subburb': 'ABERDEEN',
+         'Area': None, 'Purchase_Price': 515000},
+    ]
+
+
+def test_parquet_sink_partitioned(tmp_path):
+    dataset_path = str(tmp_path / 'sales.parquet')
+    for sales in [_SALES[:2], _SALES[2:]]:
+        with parquet_sink.ParquetSink(dataset_path, _COLUMNS, partition_by_year=True) as sink:
+            sink.add_property_list(sales)
+
+    assert [os.path.dirname(path) for path in _part_files(dataset_path)] == [
+        'Contract_Year=1990', 'Contract_Year=2017', 'Contract_Year=__HIVE_DEFAULT_PARTITION__']
+    table = pyarrow.parquet.read_table(dataset_path, filters=[('Contract_Year', '=', 2017)])
+    assert table.column('Purchase_Price').to_pylist() == [515000]
+    assert pyarrow.parquet.read_table(dataset_path).num_rows == 3
+
+    with pytest.raises(ValueError, match='requires the Contract_Date column'):
+        parquet_sink.ParquetSink(dataset_path, ['Post_Code'], partition_by_year=True)
+
+
+def test_parquet_sink_error(tmp_path):
+    dataset_path = str(tmp_path / 'sales.parquet')
+    with pytest.raises(RuntimeError):
+        with parquet_sink.ParquetSink(dataset_path, _COLUMNS, row_group_size=1) as sink:
+            sink.add_property_list(_SALES)
+            raise RuntimeError('Crash')
+    # The row groups already written are removed with the run
+    assert not _part_files(dataset_path)
+
+
+#####
+
+
+def _write_input(tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'ARCHIVE_SALES_1990.DAT').write_text('\n'.join([
+        'A;;VALNET1;20150909 11:33;;',
+        'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+        'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+        'Z;105333;105332;;']) + '\n')
+    return str(input_dir)
+
+
+def test_ingest_parquet(tmp_path):
+    dataset_path = str(tmp_path / 'sales.parquet')
+    config = property_data_extractor.IngestConfig(
+        input_paths=[_write_input(tmp_path)], output_path=dataset_path, output='parquet',
+        partitioned=True, row_group_size=1000, compression='gzip')
+
+    summary = property_data_extractor.ingest(config)
+    assert summary.property_count == 2
+    table = pyarrow.parquet.read_table(dataset_path)
+    assert table.schema.names[:-1] == [field.value for field in property_parser.PropertyData]
+    assert sorted(table.column('Contract_Year').to_pylist()) == [1990, 1991]
+    assert sum(table.column('Purchase_Price').to_pylist()) == 30000
+
+    # The processed files are skipped
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 1)
+    assert pyarrow.parquet.read_table(dataset_path).num_rows == 2
+
+
+INVALID_PARQUET_CONFIGS = [
+    ({'output': 'csv', 'row_group_size': 10}, '"row_group_size" requires the parquet output'),
+    ({'output': 'sql', 'compression': 'zstd'}, '"compression" requires the parquet output'),
+    ({'output': 'csv', 'partitioned': True}, '"partitioned" requires the sql or parquet output'),
+    ({'output': 'parquet', 'row_group_size': 0}, '"row_group_size" must be at least 1'),
+    ({'output': 'parquet', 'compression': 'lzma'}, 'Unknown compression "lzma"'),
+    ({'output': 'parquet', 'partitioned': True, 'columns': ['Post_Code']},
+     '"partitioned" requires the columns: Contract_Date'),
+]
+
+
+@pytest.mark.parametrize('values, message', INVALID_PARQUET_CONFIGS)
+def test_invalid_parquet_config(tmp_path, values, message):
+    config = property_data_extractor.IngestConfig(
+        input_paths=[str(tmp_path)], output_path=str(tmp_path / 'out'), **values)
+    with pytest.raises(ValueError, match=message):
+        property_data_extractor.ingest(config)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+
+import parse_cache
+import property_parser_nsw
+
+
+PROPERTY_LIST = [
+    {'File_Name': 'ARCHIVE_SALES_1990.DAT', 'Line_No': '2', 'Purchase_Price': '14500'},
+    {'File_Name': 'ARCHIVE_SALES_1990.DAT', 'Line_No': '3', 'Contract_Date': 'N/A'}
+]
+
+
+def _entry(size=284, checksum=1911242547):
+    return parse_cache.CacheEntry(R'path/ARCHIVE_SALES_1990.DAT', size, checksum,
+                                  [dict(prop) for prop in PROPERTY_LIST])
+
+
+################################
+# Tests for Class ParseCache
+################################
+def test_parse_cache_store_load(tmp_path):
+    cache = parse_cache.ParseCache(str(tmp_path))
+    cache.store(property_parser_nsw.NswOldPropertyFile, _entry())
+
+    assert cache.load(property_parser_nsw.NswOldPropertyFile, 284, 1911242547) == _entry()
+    assert cache.load(property_parser_nsw.NswOldPropertyFile, 284, 1) is None
+    assert cache.load(property_parser_nsw.NswNewPropertyFile, 284, 1911242547) is None
+
+
+def test_parse_cache_iter_entries(tmp_path):
+    cache = parse_cache.ParseCache(str(tmp_path))
+    cache.store(property_parser_nsw.NswOldPropertyFile, _entry(1, 1))
+    cache.store(property_parser_nsw.NswOldPropertyFile, _entry(2, 2))
+
+    entries = list(cache.iter_entries([property_parser_nsw.NswOldPropertyFile,
+                                       property_parser_nsw.NswNewPropertyFile]))
+    assert entries == [_entry(1, 1), _entry(2, 2)]
+
+
+def test_parse_cache_invalid_entry(tmp_path):
+    cache = parse_cache.ParseCache(str(tmp_path))
+    cache.store(property_parser_nsw.NswOldPropertyFile, _entry())
+    class_dir = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    with open(os.path.join(class_dir, os.listdir(class_dir)[0]), 'wb') as entry_file:
+        entry_file.write(b'invalid')
+
+    assert cache.load(property_parser_nsw.NswOldPropertyFile, 284, 1911242547) is None
+    assert list(cache.iter_entries([property_parser_nsw.NswOldPropertyFile])) == []
+
+
+################################
+# Module Function Tests
+################################
+def test_parser_fingerprint():
+    fingerprint = parse_cache.parser_fingerprint(property_parser_nsw.NswOldPropertyFile)
+
+    assert len(fingerprint) == 16
+    assert fingerprint == parse_cache.parser_fingerprint(property_parser_nsw.NswOldPropertyFile)
@@ -0,0 +1,383 @@
+"""Test the property data extractor."""
+
+import csv
+import datetime
+import gzip
+import logging
+import os
+import sqlite3
+
+import pytest
+
+import property_data_extractor
+import property_parser
+
+_ARCHIVE_LINES = [
+    'A;;VALNET1;20150909 11:33;;',
+    'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+    'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+    'Z;105333;105332;;',
+]
+
+_CURRENT_LINES = [
+    'A;RTSALEDATA;001;20180115 01:15;VALNET;',
+    'B;001;3771736;141;20180115 01:15;;;73 A;KLINE ST;WESTON;2326;802.3;M;20171121;20171219;515000;R2;R;RESIDENCE;;AAN;;0;AN8513;',
+    'C;001;3771736;141;20180115 01:15;928/1209451;',
+    'D;001;3771736;141;20180115 01:15;P;;;;;;',
+    'Z;732;148;148;434;',
+]
+
+
+def _write_roots(tmp_path):
+    """Write a sales file into each of two input roots."""
+    roots = []
+    for name, file_name, lines in [
+            ('archive', 'ARCHIVE_SALES_1990.DAT', _ARCHIVE_LINES),
+            ('current', '001_SALES_DATA_NNME_15012018.DAT', _CURRENT_LINES)]:
+        root = tmp_path / name
+        root.mkdir()
+        (root / file_name).write_text('\n'.join(lines) + '\n')
+        roots.append(str(root))
+    return roots
+
+
+#####
+
+
+def test_ingest_sql(tmp_path):
+    """Ingest several input roots into a database."""
+    roots = _write_roots(tmp_path)
+    db_path = str(tmp_path / 'out' / 'sales.sql')
+    os.mkdir(os.path.dirname(db_path))
+    handlers = list(logging.getLogger().handlers)
+    level = logging.getLogger().level
+
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=db_path, commit_max=1)
+    summary = property_data_extractor.ingest(config)
+
+    assert summary.files_processed == 2
+    assert summary.files_skipped == 0
+    assert summary.files_failed == 0
+    assert summary.property_count == 3
+    assert summary.duration_seconds > 0
+    # The caller's logging configuration is left alone
+    assert logging.getLogger().handlers == handlers
+    assert logging.getLogger().level == level
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM SalesData').fetchone() == (3,)
+
+    # The files are skipped by the next run
+    summary = property_data_extractor.ingest(config)
+    assert summary.files_processed == 0
+    assert summary.files_skipped == 2
+    assert summary.property_count == 0
+
+
+def test_ingest_csv(tmp_path):
+    """Ingest into a csv file."""
+    roots = _write_roots(tmp_path)
+    csv_path = str(tmp_path / 'sales.csv')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=csv_path, output='csv')
+
+    summary = property_data_extractor.ingest(config)
+
+    assert summary.files_processed == 2
+    assert summary.property_count == 3
+    with open(csv_path, newline='') as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == 3
+
+    # The files recorded next to the output are skipped by the next run
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 2)
+    with open(csv_path, newline='') as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == 3
+
+
+@pytest.mark.parametrize('stream_archives', [False, True])
+def test_ingest_jsonl_archive_rerun(tmp_path, stream_archives):
+    """Skip the archives processed by a previous run."""
+    roots = _write_roots(tmp_path)
+    gz_path = tmp_path / 'archive' / 'ARCHIVE_SALES_1991.DAT.gz'
+    with gzip.open(gz_path, 'wb') as gz_file:
+        gz_file.write(('\n'.join(_ARCHIVE_LINES[:2] + _ARCHIVE_LINES[3:]) + '\n').encode())
+    jsonl_path = str(tmp_path / 'sales.jsonl')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=jsonl_path, output='jsonl',
+        stream_archives=stream_archives)
+
+    assert property_data_extractor.ingest(config).property_count == 4
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 3)
+    with open(jsonl_path) as jsonl_file:
+        assert len(jsonl_file.readlines()) == 4
+
+
+def test_ingest_broken_archive(tmp_path):
+    """Count the archives that cannot be extracted as failed."""
+    roots = _write_roots(tmp_path)
+    (tmp_path / 'archive' / 'broken.zip').write_bytes(b'not a zip file')
+
+    summary = property_data_extractor.ingest(
+        property_data_extractor.IngestConfig(
+            input_paths=roots, output_path=str(tmp_path / 'sales.jsonl'),
+            output='jsonl'))
+
+    assert summary.files_processed == 2
+    assert summary.files_failed == 1
+
+
+STREAM_OUTPUTS = [
+    ('sql', True),
+    ('jsonl', True),
+    ('sql', False),
+]
+@pytest.mark.parametrize('output, stream_archives', STREAM_OUTPUTS)
+def test_ingest_truncated_archive(tmp_path, output, stream_archives):
+    """Count the corrupt archive members as failed and go on."""
+    roots = _write_roots(tmp_path)
+    gz_path = tmp_path / 'archive' / 'ARCHIVE_SALES_1991.DAT.gz'
+    with gzip.open(gz_path, 'wb') as gz_file:
+        gz_file.write(('\n'.join(_ARCHIVE_LINES) + '\n').encode() * 100)
+    gz_path.write_bytes(gz_path.read_bytes()[:-20])
+
+    summary = property_data_extractor.ingest(
+        property_data_extractor.IngestConfig(
+            input_paths=roots, output_path=str(tmp_path / F'sales.{output}'),
+            output=output, stream_archives=stream_archives))
+
+    assert (summary.files_processed, summary.files_failed) == (2, 1)
+    assert summary.property_count == 3
+    # Nothing of the archive is left in the input tree
+    assert sorted(os.listdir(roots[0])) == ['ARCHIVE_SALES_1990.DAT', 'ARCHIVE_SALES_1991.DAT.gz']
+
+
+def test_ingest_renamed_files(tmp_path):
+    """Identify files renamed by a mirror by their content."""
+    roots = _write_roots(tmp_path)
+    os.rename(os.path.join(roots[0], 'ARCHIVE_SALES_1990.DAT'),
+              os.path.join(roots[0], 'archive_1990.txt'))
+    os.rename(os.path.join(roots[1], '001_SALES_DATA_NNME_15012018.DAT'),
+              os.path.join(roots[1], 'current.dat.part'))
+    (tmp_path / 'archive' / 'README.txt').write_text('Not a sales file\n')
+
+    summary = property_data_extractor.ingest(
+        property_data_extractor.IngestConfig(
+            input_paths=roots, output_path=str(tmp_path / 'sales.csv'),
+            output='csv'))
+
+    assert summary.files_processed == 2
+    assert summary.property_count == 3
+
+
+def test_ingest_dedup_rerun(tmp_path):
+    """Keep deduplicating databases with a natural key index."""
+    roots = _write_roots(tmp_path)
+    db_path = str(tmp_path / 'sales.sql')
+    property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=roots[:1], output_path=db_path, dedup=True))
+
+    # An overlapping file ingested without dedup
+    (tmp_path / 'overlap').mkdir()
+    (tmp_path / 'overlap' / 'ARCHIVE_SALES_1991.DAT').write_text(
+        '\n'.join(_ARCHIVE_LINES[:1] + _ARCHIVE_LINES[2:]) + '\n')
+    summary = property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[str(tmp_path / 'overlap')], output_path=db_path))
+    assert summary.files_processed == 1
+    assert summary.duplicate_counts == {'ARCHIVE_SALES_1991.DAT': 1}
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM SalesData').fetchone() == (2,)
+
+
+def test_ingest_record_filter(tmp_path):
+    """Only ingest the sales matching the filter."""
+    roots = _write_roots(tmp_path)
+    db_path = str(tmp_path / 'sales.sql')
+
+    summary = property_data_extractor.ingest(
+        property_data_extractor.IngestConfig(
+            input_paths=roots, output_path=db_path,
+            record_filter=property_parser.RecordFilter(
+                district_codes=frozenset(['011']),
+                end_date=datetime.date(1990, 12, 31))))
+
+    assert summary.files_processed == 2
+    assert summary.property_count == 1
+    assert summary.lines_filtered == 2
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT Property_ID, Contract_Date FROM SalesData').fetchall() == [
+            ('292674', '1990/11/20')]
+
+
+_COLUMNS = ['Post_Code', 'Contract_Date', 'Purchase_Price']
+
+
+def test_ingest_columns_csv(tmp_path):
+    """Only write the requested columns."""
+    roots = _write_roots(tmp_path)
+    csv_path = str(tmp_path / 'sales.csv')
+
+    property_data_extractor.ingest(
+        property_data_extractor.IngestConfig(
+            input_paths=roots, output_path=csv_path, output='csv',
+            columns=_COLUMNS))
+
+    with open(csv_path, newline='') as csv_file:
+        rows = sorted(csv.reader(csv_file))
+    assert rows == [['2326', '2017/11/21', '515000'],
+                    ['2336', '1990/11/20', '14500'],
+                    ['2336', '1991/11/20', '15500'],
+                    ['Post_Code', 'Contract_Date', 'Purchase_Price']]
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_ingest_columns_sql(tmp_path, typed):
+    """Create new databases with the requested columns only."""
+    roots = _write_roots(tmp_path)
+    db_path = str(tmp_path / 'sales.sql')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots[:1], output_path=db_path, columns=_COLUMNS,
+        typed=typed, query_indexes=False)
+
+    summary = property_data_extractor.ingest(config)
+    assert summary.property_count == 2
+    with sqlite3.connect(db_path) as conn:
+        assert [row[1] for row in conn.execute('PRAGMA table_info(SalesData)')] == [
+            'id', 'Post_Code', 'Contract_Date', 'Purchase_Price']
+
+    # Existing databases keep their columns
+    with pytest.raises(ValueError, match='does not store the columns: District'):
+        property_data_extractor.ingest(config._replace(
+            input_paths=roots[1:], columns=_COLUMNS + ['District']))
+    summary = property_data_extractor.ingest(config._replace(
+        input_paths=roots[1:], columns=None, typed=False))
+    assert summary.property_count == 1
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM SalesData').fetchone() == (3,)
+
+
+def test_ingest_columns_existing_features(tmp_path):
+    """Reject projections without the columns of the database features."""
+    roots = _write_roots(tmp_path)
+    db_path = str(tmp_path / 'sales.sql')
+    property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=roots[:1], output_path=db_path, repeat_sales=True))
+
+    with pytest.raises(ValueError, match='requires the columns'):
+        property_data_extractor.ingest(property_data_extractor.IngestConfig(
+            input_paths=roots[1:], output_path=db_path, columns=_COLUMNS))
+
+
+def test_ingest_quarantine(tmp_path):
+    """Quarantine the lines failing parsing and parse them again."""
+    roots = _write_roots(tmp_path)
+    short_line = 'B;011;VALNET1;0145900000000;292676;;;ELDON ST'
+    with open(os.path.join(roots[0], 'ARCHIVE_SALES_1990.DAT'), 'a') as file:
+        file.write(short_line + '\n')
+    db_path = str(tmp_path / 'sales.sql')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=db_path, quarantine=True)
+
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.lines_quarantined) == (2, 1)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM SalesData').fetchone() == (3,)
+        assert conn.execute('SELECT File_Name, Line_No, Line FROM QuarantinedLine').fetchall() == [
+            ('ARCHIVE_SALES_1990.DAT', 5, short_line)]
+
+        # Still failing lines stay quarantined
+        summary = property_data_extractor.ingest(config._replace(reprocess_quarantine=True))
+        assert summary.property_count == 0
+        assert conn.execute('SELECT COUNT(*) FROM QuarantinedLine').fetchone() == (1,)
+
+        # Fix the line
+        conn.execute('UPDATE QuarantinedLine SET Line = ?', (_ARCHIVE_LINES[1].replace('292674', '292676'),))
+        conn.commit()
+        summary = property_data_extractor.ingest(config._replace(reprocess_quarantine=True))
+        assert summary.property_count == 1
+        assert conn.execute('SELECT COUNT(*) FROM QuarantinedLine').fetchone() == (0,)
+        assert conn.execute('SELECT Line_No FROM SalesData WHERE Property_ID = ?', ('292676',)).fetchall() == [('5',)]
+
+
+def test_ingest_quarantine_renamed(tmp_path):
+    """Parse the quarantined lines of renamed files with the same name again."""
+    roots = _write_roots(tmp_path)
+    for root, property_id in zip(roots, ['292676', '292677']):
+        # Identified by the content, stored by the full path
+        with open(os.path.join(root, 'sales.txt'), 'w') as file:
+            file.write('\n'.join(_ARCHIVE_LINES[:-1] + [F'B;011;VALNET1;0145900000000;{property_id};;;ELDON ST',
+                                                        _ARCHIVE_LINES[-1]]) + '\n')
+    db_path = str(tmp_path / 'sales.sql')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=db_path, quarantine=True)
+
+    summary = property_data_extractor.ingest(config)
+    assert summary.lines_quarantined == 2
+    with sqlite3.connect(db_path) as conn:
+        assert sorted(conn.execute('SELECT Full_Path, Parser FROM QuarantinedLine')) == [
+            (os.path.join(root, 'sales.txt'), 'NswOldPropertyFile') for root in roots]
+
+        conn.execute("UPDATE QuarantinedLine SET Line = Line || ';ABERDEEN;2336;20/11/1990;14500;LOT 7;2365;M;;;A;;;;'")
+        conn.commit()
+        summary = property_data_extractor.ingest(config._replace(reprocess_quarantine=True))
+        assert summary.property_count == 2
+        assert conn.execute('SELECT COUNT(*) FROM QuarantinedLine').fetchone() == (0,)
+
+
+def test_ingest_error_budget(tmp_path):
+    """Abort files exceeding the line error budget, retried by the next run."""
+    roots = _write_roots(tmp_path)
+    file_path = os.path.join(roots[0], 'ARCHIVE_SALES_1990.DAT')
+    with open(file_path, 'a') as file:
+        file.write('B;011;VALNET1\nB;011;VALNET2\n')
+    db_path = str(tmp_path / 'sales.sql')
+    config = property_data_extractor.IngestConfig(
+        input_paths=roots, output_path=db_path, quarantine=True,
+        max_line_errors=1)
+
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_aborted) == (1, 1)
+    assert summary.property_count == 1
+
+    with open(file_path, 'w') as file:
+        file.write('\n'.join(_ARCHIVE_LINES) + '\n')
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (1, 1)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM SalesData').fetchone() == (3,)
+
+
+INVALID_CONFIGS = [
+    ({'input_paths': ['missing']}, 'is not a vaid directory'),
+    ({'output': 'xml'}, 'Unknown output'),
+    ({'commit_max': 0}, '"commit_max" must be at least 1'),
+    ({'unzip_workers': 0}, '"unzip_workers" must be at least 1'),
+    ({'memory_budget': 0}, '"memory_budget" must be at least 1'),
+    ({'rebuild': True}, '"rebuild" requires "cache_dir"'),
+    ({'output': 'csv', 'dedup': True}, '"dedup" requires the sql output'),
+    ({'max_line_errors': -1}, '"max_line_errors" must not be negative'),
+    ({'reprocess_quarantine': True, 'shard_workers': 2}, '"reprocess_quarantine" cannot be combined'),
+    ({'output': 'csv', 'quarantine': True}, '"quarantine" requires the sql output'),
+    ({'shard_workers': 0}, '"shard_workers" must be at least 1'),
+    ({'shard_workers': 2, 'reload_years': ['2018']}, '"shard_workers" cannot be combined'),
+    ({'record_filter': property_parser.RecordFilter(), 'cache_dir': 'cache'}, '"record_filter" cannot be combined'),
+    ({'columns': ['Post_Code', 'Price']}, 'Unknown columns: Price'),
+    ({'columns': []}, '"columns" must not be empty'),
+    ({'columns': ['Post_Code'], 'cache_dir': 'cache'}, '"columns" cannot be combined'),
+    ({'columns': ['Post_Code'], 'dedup': True}, '"dedup" requires the columns'),
+    ({'columns': ['Post_Code'], 'reload_years': ['2018']}, '"partitioned" requires the columns'),
+    ({'record_filter': property_parser.RecordFilter(start_date=datetime.date(2018, 2, 1),
+                                                    end_date=datetime.date(2018, 1, 31))},
+     'start date is after the end date'),
+]
+
+
+@pytest.mark.parametrize('values, message', INVALID_CONFIGS)
+def test_validate_config(tmp_path, values, message):
+    """Reject invalid configurations."""
+    config = property_data_extractor.IngestConfig(
+        input_paths=[str(tmp_path)], output_path=str(tmp_path / 'out.sql'))
+    with pytest.raises(ValueError, match=message):
+        property_data_extractor.validate_config(config._replace(**values))
@@ -3,6 +3,7 @@
 import pytest
 
 import property_file_manager
+import property_parser
 import property_parser_nsw
 
 ################################
@@ -27,3 +28,80 @@ PROPERTY_FILE_CLASS_NOT_IDENTIFIED = [
 def test_get_property_file_from_path_invalid(file_name):
     with pytest.raises(ValueError):
         property_file_manager.get_property_file_from_path(file_name)
+
+
+PROPERTY_FILE_CLASS_SNIFFED = [
+    (b'A;;VALNET1;20150909 11:33;;\nB;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;',
+     property_parser_nsw.NswOldPropertyFile),
+    (b'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;',
+     property_parser_nsw.NswOldPropertyFile),
+    (b'A;RTSALEDATA;001;20180115 01:15;VALNET;\nB;001;3771736;141;20180115 01:15;;;73 A;KLINE ST;',
+     property_parser_nsw.NswNewPropertyFile),
+    (b'C;001;3771736;141;20180115 01:15;928/1209451;\n',
+     property_parser_nsw.NswNewPropertyFile),
+]
+@pytest.mark.parametrize('head, property_class', PROPERTY_FILE_CLASS_SNIFFED)
+def test_get_property_file_from_path_sniffed(tmp_path, head, property_class):
+    assert property_file_manager.get_property_file_from_path('sales.txt', head) == property_class
+
+    # Renamed files are identified by the start of the file
+    file_path = tmp_path / 'sales_mirror.txt'
+    file_path.write_bytes(head + b'x' * property_file_manager.SNIFF_BYTES + b'\nZ;1;')
+    assert property_file_manager.get_property_file_from_path(str(file_path)) == property_class
+    assert property_file_manager.file_can_be_parsed(str(file_path))
+
+
+PROPERTY_FILE_CONTENT_NOT_IDENTIFIED = [
+    (b''),
+    (b'SQLite format 3\x00'),
+    (b'File_Name,Line_No,District_Code\n'),
+    (b'Z;105333;105332;;\n'),
+]
+@pytest.mark.parametrize('head', PROPERTY_FILE_CONTENT_NOT_IDENTIFIED)
+def test_get_property_file_from_path_not_sniffed(tmp_path, head):
+    file_path = tmp_path / 'sales.txt'
+    file_path.write_bytes(head)
+    with pytest.raises(ValueError):
+        property_file_manager.get_property_file_from_path(str(file_path))
+    assert not property_file_manager.file_can_be_parsed(str(file_path))
+
+
+def test_get_property_file_classes():
+    assert property_file_manager.get_property_file_classes() == [
+        property_parser_nsw.NswOldPropertyFile, property_parser_nsw.NswNewPropertyFile]
+
+
+################################
+# FormatRegistry Tests
+################################
+class VicPropertyFile(property_parser_nsw.NswNewPropertyFile):
+    NAME_PATTERN = r'VIC_SALES_.*\.CSV'
+    CONTENT_PATTERN = r'VIC;'
+
+
+def test_format_registry_register():
+    registry = property_file_manager.FormatRegistry()
+    registry.register(property_parser_nsw.NswOldPropertyFile)
+    assert registry.class_from_name('vic_sales_2018.csv') is None
+
+    assert registry.register(VicPropertyFile) == VicPropertyFile
+    registry.register(VicPropertyFile)
+    assert registry.classes() == [property_parser_nsw.NswOldPropertyFile, VicPropertyFile]
+    assert registry.class_from_name('vic_sales_2018.csv') == VicPropertyFile
+    assert registry.class_from_name('ARCHIVE_SALES_1990.DAT') == property_parser_nsw.NswOldPropertyFile
+    assert registry.class_from_content(b'X;1\nVIC;2018;') == VicPropertyFile
+    assert registry.class_from_content(b'X;VIC;2018;') is None
+
+
+def test_format_registry_first_match():
+    registry = property_file_manager.FormatRegistry()
+    assert registry.class_from_name('ARCHIVE_SALES_1990.DAT') is None
+
+    registry.register(property_parser_nsw.NswOldPropertyFile)
+    registry.register(property_parser_nsw.NswNewPropertyFile)
+    assert registry.class_from_name('ARCHIVE_SALES_DATA_NNME_1990.DAT') == property_parser_nsw.NswOldPropertyFile
+
+
+def test_format_registry_no_pattern():
+    with pytest.raises(ValueError):
+        property_file_manager.FormatRegistry().register(property_parser.PropertyFile)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import datetime
+
 import pytest
 
 import property_parser
@@ -94,3 +96,57 @@ SPLIT_STR = [
 @pytest.mark.parametrize('expected_list, text, separator', SPLIT_STR)
 def test_split_str(expected_list, text, separator):
     assert expected_list == property_parser.split_str(text, separator)
+
+
+TYPED_CONVERSION = [
+    (None, property_parser.PropertyData.PURCHASE_PRICE, ''),
+    (None, property_parser.PropertyData.CONTRACT_DATE, 'N/A'),
+    (515000, property_parser.PropertyData.PURCHASE_PRICE, '515000'),
+    (42, property_parser.PropertyData.LINE_NO, '42'),
+    (2326, property_parser.PropertyData.POST_CODE, '2326'),
+    (802.3, property_parser.PropertyData.AREA, '802.3'),
+    (datetime.date(2018, 10, 21), property_parser.PropertyData.SETTLEMENT_DATE, '2018/10/21'),
+    ('N/A', property_parser.PropertyData.SUBBURB, 'N/A'),
+    (12, property_parser.PropertyData.LINE_NO, 12)
+]
+@pytest.mark.parametrize('expected_value, field, value', TYPED_CONVERSION)
+def test_convert_to_typed(expected_value, field, value):
+    assert expected_value == property_parser.convert_to_typed(field, value)
+
+
+TYPED_CONVERSION_FAILED = [
+    (property_parser.PropertyData.PURCHASE_PRICE, 'ABC'),
+    (property_parser.PropertyData.CONTRACT_DATE, '2018/13/01'),
+    (property_parser.PropertyData.CONTRACT_DATE, '21/10/2018')
+]
+@pytest.mark.parametrize('field, value', TYPED_CONVERSION_FAILED)
+def test_convert_to_typed_failed(field, value):
+    with pytest.raises(ValueError):
+        property_parser.convert_to_typed(field, value)
+
+
+################################
+# Tests for Class StringInterner
+################################
+def test_string_interner():
+    interner = property_parser.StringInterner()
+    value = ''.join(['WES', 'TON'])
+    copy = ''.join(['WEST', 'ON'])
+    assert value is not copy
+
+    assert interner.intern(value) is value
+    assert interner.intern(copy) is value
+    assert len(interner) == 1
+
+
+def test_property_intern_fields():
+    interner = property_parser.StringInterner()
+    props = [property_parser.Property('This is a fake line') for _ in range(2)]
+    for prop in props:
+        prop[property_parser.PropertyData.SUBBURB] = ''.join(['WES', 'TON'])
+        prop[property_parser.PropertyData.STREET_NAME] = ''.join(['KLINE', ' ST'])
+        prop.intern_fields(interner)
+
+    assert props[0][property_parser.PropertyData.SUBBURB] is props[1][property_parser.PropertyData.SUBBURB]
+    assert props[0][property_parser.PropertyData.STREET_NAME] is not props[1][property_parser.PropertyData.STREET_NAME]
+    assert len(interner) == 1
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import datetime
+
 import pytest
 
 import property_parser
@@ -35,7 +37,8 @@ def test_nsw_old_property_file_init():
 
 
 OLD_FILE_NAMES_ALLOWED = [
-    ('ARCHIVE_SALES_1990.DAT')
+    ('ARCHIVE_SALES_1990.DAT'),
+    ('archive_sales_1990.dat')
 ]
 @pytest.mark.parametrize('name', OLD_FILE_NAMES_ALLOWED)
 def test_nsw_old_property_file_name_allowed(name):
@@ -106,7 +109,8 @@ def test_nsw_new_property_file_init():
 
 
 NEW_FILE_NAMES_ALLOWED = [
-    ('001_SALES_DATA_NNME_15012018.DAT')
+    ('001_SALES_DATA_NNME_15012018.DAT'),
+    ('001_sales_data_nnme_15012018.dat')
 ]
 @pytest.mark.parametrize('name', NEW_FILE_NAMES_ALLOWED)
 def test_nsw_new_property_file_name_allowed(name):
@@ -147,3 +151,200 @@ NEW_FILE_LINE_NOT_OF_INTEREST = [
 def test_nsw_new_property_file_line_of_interest(line):
     prop = property_parser_nsw.NswNewPropertyFile(R'file/path')
     assert not prop.line_of_interest(line)
+
+
+##########################################
+# Tests for tolerant parsing (quarantine)
+##########################################
+_OLD_VALID_LINE = 'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7;2365;M;;;A;;;;'
+_OLD_SHORT_LINE = 'B;011;VALNET1;0145900000000;292675;;;ELDON ST'
+
+
+def test_nsw_old_property_file_parse_strict():
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT')
+    with pytest.raises(ValueError, match='Missing Fields'):
+        prop_file.parse_lines([_OLD_VALID_LINE, _OLD_SHORT_LINE])
+
+
+def test_nsw_old_property_file_parse_quarantine():
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT', max_errors=1)
+    prop_file.parse_lines(['A;;VALNET1;20150909 11:33;;', _OLD_SHORT_LINE, _OLD_VALID_LINE])
+
+    assert [prop[property_parser.PropertyData.LINE_NO] for prop in prop_file] == ['3']
+    assert prop_file.quarantined_lines == [
+        property_parser.QuarantinedLine(2, _OLD_SHORT_LINE, F'Missing Fields in Line: "{_OLD_SHORT_LINE}"')]
+
+
+def test_nsw_old_property_file_parse_error_budget():
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT', max_errors=1)
+    with pytest.raises(property_parser.ErrorBudgetExceeded):
+        prop_file.parse_lines([_OLD_SHORT_LINE, _OLD_VALID_LINE, _OLD_SHORT_LINE])
+
+
+def test_nsw_old_property_file_convert_types_quarantine():
+    bad_price_line = _OLD_VALID_LINE.replace(';14500;', ';14.500;')
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT', max_errors=5)
+    prop_file.parse_lines([_OLD_VALID_LINE, bad_price_line])
+    assert len(prop_file) == 2
+
+    prop_file.convert_types()
+    assert len(prop_file) == 1
+    assert [line.line_no for line in prop_file.quarantined_lines] == [2]
+
+
+##########################################
+# Tests for new format record assembly
+##########################################
+_NEW_RECORDS = [
+    'A;RTSALEDATA;001;20180115 01:15;VALNET;',
+    'B;001;3771736;141;20180115 01:15;;;73 A;KLINE ST;WESTON;2326;802.3;M;20171121;20171219;515000;R2;R;RESIDENCE;;AAN;;0;AN8513;',
+    'C;001;3771736;141;20180115 01:15;928/1209451;',
+    'D;001;3771736;141;20180115 01:15;P;;;;;;',
+    'D;001;3771736;141;20180115 01:15;V;;;;;;',
+    'B;001;3968570;148;20180115 01:15;;;12;SMITH ST;WESTON;2326;500;M;20171201;20171222;420000;R2;R;RESIDENCE;;AAN;;0;AN8514;',
+    'C;001;3968570;148;20180115 01:15;LOT 1 DP 1234, LOT 2 ;',
+    'C;001;3968570;148;20180115 01:15;DP 5678;',
+    # Record of another property, not part of the sale above
+    'C;001;9999999;1;20180115 01:15;1/999;',
+    'Z;732;148;148;434;',
+]
+
+
+def test_nsw_new_property_file_assemble_records():
+    prop_file = property_parser_nsw.NswNewPropertyFile('001_SALES_DATA_NNME_15012018.DAT')
+    prop_file.parse_lines(_NEW_RECORDS)
+
+    assert [(prop[property_parser.PropertyData.LINE_NO],
+             prop[property_parser.PropertyData.LAND_DESCRIPTIONS]) for prop in prop_file] == [
+        ('2', '928/1209451'), ('6', 'LOT 1 DP 1234, LOT 2DP 5678')]
+
+
+def test_nsw_new_property_file_assemble_streaming():
+    consumed = []
+
+    def lines():
+        for line in _NEW_RECORDS:
+            consumed.append(line)
+            yield line
+
+    prop_file = property_parser_nsw.NswNewPropertyFile('001_SALES_DATA_NNME_15012018.DAT')
+    records = prop_file._iter_records(lines())
+    assert next(records) == (2, _NEW_RECORDS[1], _NEW_RECORDS[2:5])
+    # Only a single line of lookahead is read
+    assert len(consumed) == 6
+
+
+def test_nsw_new_property_file_assemble_quarantine():
+    short_c_line = 'C;001;3771736;141'
+    prop_file = property_parser_nsw.NswNewPropertyFile('001_SALES_DATA_NNME_15012018.DAT', max_errors=1)
+    prop_file.parse_lines(_NEW_RECORDS[:2] + [short_c_line])
+
+    assert len(prop_file) == 0
+    line = prop_file.quarantined_lines[0]
+    assert (line.line_no, line.line) == (2, _NEW_RECORDS[1] + '\n' + short_c_line)
+
+
+##########################################
+# Tests for record filters
+##########################################
+_OLD_FILTER_LINES = [
+    _OLD_VALID_LINE,
+    _OLD_VALID_LINE.replace('B;011;', 'B;012;').replace(';2336;', ';2337;'),
+    _OLD_VALID_LINE.replace(';20/11/1990;', ';5/1/1991;'),
+    _OLD_VALID_LINE.replace(';20/11/1990;', ';;'),
+]
+OLD_RECORD_FILTERS = [
+    (property_parser.RecordFilter(), ['1', '2', '3', '4']),
+    (property_parser.RecordFilter(district_codes=frozenset(['011'])), ['1', '3', '4']),
+    (property_parser.RecordFilter(post_codes=frozenset(['2337', '2000'])), ['2']),
+    (property_parser.RecordFilter(start_date=datetime.date(1991, 1, 1)), ['3']),
+    (property_parser.RecordFilter(end_date=datetime.date(1990, 11, 20)), ['1', '2']),
+    (property_parser.RecordFilter(district_codes=frozenset(['012']),
+                                  end_date=datetime.date(1990, 11, 19)), []),
+]
+@pytest.mark.parametrize('record_filter, line_numbers', OLD_RECORD_FILTERS)
+def test_nsw_old_property_file_record_filter(record_filter, line_numbers):
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT', record_filter=record_filter)
+    prop_file.parse_lines(_OLD_FILTER_LINES)
+
+    assert [prop[property_parser.PropertyData.LINE_NO] for prop in prop_file] == line_numbers
+    assert prop_file.filtered_count == len(_OLD_FILTER_LINES) - len(line_numbers)
+
+
+NEW_RECORD_FILTERS = [
+    (property_parser.RecordFilter(district_codes=frozenset(['001'])), ['2', '6']),
+    (property_parser.RecordFilter(district_codes=frozenset(['002'])), []),
+    (property_parser.RecordFilter(start_date=datetime.date(2017, 11, 22),
+                                  end_date=datetime.date(2017, 12, 31)), ['6']),
+]
+@pytest.mark.parametrize('record_filter, line_numbers', NEW_RECORD_FILTERS)
+def test_nsw_new_property_file_record_filter(record_filter, line_numbers):
+    prop_file = property_parser_nsw.NswNewPropertyFile('001_SALES_DATA_NNME_15012018.DAT', record_filter=record_filter)
+    prop_file.parse_lines(_NEW_RECORDS)
+
+    assert [prop[property_parser.PropertyData.LINE_NO] for prop in prop_file] == line_numbers
+
+
+def test_nsw_old_property_file_record_filter_short_line():
+    # Lines missing the filtered fields fail parsing as without a filter
+    prop_file = property_parser_nsw.NswOldPropertyFile(
+        'ARCHIVE_SALES_1990.DAT', max_errors=1,
+        record_filter=property_parser.RecordFilter(district_codes=frozenset(['012'])))
+    prop_file.parse_lines([_OLD_VALID_LINE, _OLD_SHORT_LINE])
+
+    assert len(prop_file) == 0
+    assert [line.line_no for line in prop_file.quarantined_lines] == [2]
+
+
+##########################################
+# Tests for column projection
+##########################################
+_PROJECTION = [property_parser.PropertyData.CONTRACT_DATE,
+               property_parser.PropertyData.PURCHASE_PRICE,
+               property_parser.PropertyData.POST_CODE]
+
+
+def _fail_lookup(code):
+    raise AssertionError(F'Unexpected lookup of "{code}"')
+
+
+def test_nsw_old_property_file_columns(monkeypatch):
+    monkeypatch.setattr(property_parser_nsw.nsw_def, 'get_district_from_code', _fail_lookup)
+    monkeypatch.setattr(property_parser_nsw.nsw_def, 'get_zone_from_old_code', _fail_lookup)
+    prop_file = property_parser_nsw.NswOldPropertyFile('ARCHIVE_SALES_1990.DAT', typed=True, columns=_PROJECTION)
+    prop_file.parse_lines([_OLD_VALID_LINE])
+
+    assert prop_file.get_lines_as_list() == [
+        {'Contract_Date': datetime.date(1990, 11, 20), 'Purchase_Price': 14500, 'Post_Code': 2336}]
+
+
+def test_nsw_new_property_file_columns(monkeypatch):
+    monkeypatch.setattr(property_parser_nsw.nsw_def, 'get_zone_from_new_code', _fail_lookup)
+    monkeypatch.setattr(property_parser_nsw.nsw_def, 'get_type_from_new_zone_code', _fail_lookup)
+    prop_file = property_parser_nsw.NswNewPropertyFile(
+        '001_SALES_DATA_NNME_15012018.DAT',
+        columns=_PROJECTION + [property_parser.PropertyData.DISTRICT,
+                               property_parser.PropertyData.LINE_NO])
+    prop_file.parse_lines(_NEW_RECORDS[:5])
+
+    assert prop_file.get_lines_as_list() == [
+        {'District': 'CESSNOCK', 'Post_Code': '2326', 'Contract_Date': '2017/11/21',
+         'Purchase_Price': '515000', 'Line_No': '2'}]
+
+
+def test_nsw_old_property_file_columns_convert_quarantine():
+    bad_price_line = _OLD_VALID_LINE.replace(';14500;', ';14.500;')
+    prop_file = property_parser_nsw.NswOldPropertyFile(
+        'ARCHIVE_SALES_1990.DAT', max_errors=5, columns=_PROJECTION)
+    prop_file.parse_lines([_OLD_VALID_LINE, bad_price_line])
+
+    prop_file.convert_types()
+    assert len(prop_file) == 1
+    assert [line.line_no for line in prop_file.quarantined_lines] == [2]
+
+
+def test_fields_from_names():
+    assert property_parser.fields_from_names(['Post_Code', 'Contract_Date']) == [
+        property_parser.PropertyData.POST_CODE, property_parser.PropertyData.CONTRACT_DATE]
+    with pytest.raises(ValueError, match='Unknown columns: Price'):
+        property_parser.fields_from_names(['Post_Code', 'Price'])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import datetime
+import random
+
+import pytest
+
+import sales_aggregates
+
+
+################################
+# Module Function Tests
+################################
+CONTRACT_QUARTERS = [
+    ('2018-Q1', '2018/01/15'),
+    ('2018-Q1', '2018/03/31'),
+    ('2018-Q2', '2018-04-01'),
+    ('1990-Q4', datetime.date(1990, 11, 20)),
+    (sales_aggregates.UNKNOWN_QUARTER, '2018/13/01'),
+    (sales_aggregates.UNKNOWN_QUARTER, 'N/A'),
+    (sales_aggregates.UNKNOWN_QUARTER, ''),
+    (sales_aggregates.UNKNOWN_QUARTER, None)
+]
+@pytest.mark.parametrize('expected_quarter, contract_date', CONTRACT_QUARTERS)
+def test_contract_quarter(expected_quarter, contract_date):
+    assert sales_aggregates.contract_quarter(contract_date) == expected_quarter
+
+
+PRICE_VALUES = [
+    (100, '100'),
+    (100, 100),
+    (None, ''),
+    (None, 'N/A'),
+    (None, None)
+]
+@pytest.mark.parametrize('expected_price, price', PRICE_VALUES)
+def test_price_value(expected_price, price):
+    assert sales_aggregates.price_value(price) == expected_price
+
+
+def test_aggregate_properties():
+    aggregates = sales_aggregates.aggregate_properties([
+        {'District': 'SYDNEY', 'Subburb': 'PYRMONT', 'Contract_Date': '2018/01/15',
+         'Purchase_Price': '100'},
+        {'District': 'SYDNEY', 'Subburb': 'ULTIMO', 'Contract_Date': '2018/02/15',
+         'Purchase_Price': '300'},
+        {'District': 'SYDNEY', 'Subburb': 'ULTIMO', 'Contract_Date': '2018/02/15',
+         'Purchase_Price': ''}])
+
+    assert sorted(aggregates) == [('district', 'SYDNEY', '2018-Q1'),
+                                  ('suburb', 'PYRMONT', '2018-Q1'),
+                                  ('suburb', 'ULTIMO', '2018-Q1')]
+    district = aggregates[('district', 'SYDNEY', '2018-Q1')]
+    assert district.sales_count == 3
+    assert district.price_count == 2
+    assert district.mean_price == 200
+    assert aggregates[('suburb', 'ULTIMO', '2018-Q1')].sales_count == 2
+
+
+################################
+# Tests for Class QuantileSketch
+################################
+@pytest.mark.parametrize('quantile', [0, 0.1, 0.5, 0.9, 1])
+def test_quantile_sketch_accuracy(quantile):
+    rng = random.Random(42)
+    values = sorted(rng.lognormvariate(13, 1) for _ in range(10000))
+    sketch = sales_aggregates.QuantileSketch(0.01)
+    for value in values:
+        sketch.add(value)
+
+    expected = values[int(quantile * (len(values) - 1))]
+    assert sketch.quantile(quantile) == pytest.approx(expected, rel=0.01)
+
+
+def test_quantile_sketch_merge():
+    merged = sales_aggregates.QuantileSketch()
+    for values in [[0, 100, 200], [300, 400]]:
+        sketch = sales_aggregates.QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        merged.merge(sales_aggregates.QuantileSketch.from_json(sketch.to_json()))
+
+    assert len(merged) == 5
+    assert merged.quantile(0) == 0
+    assert merged.quantile(0.5) == pytest.approx(200, rel=0.01)
+    assert merged.quantile(1) == pytest.approx(400, rel=0.01)
+
+    with pytest.raises(ValueError):
+        merged.merge(sales_aggregates.QuantileSketch(0.05))
+
+
+def test_quantile_sketch_invalid():
+    sketch = sales_aggregates.QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
+    with pytest.raises(ValueError):
+        sales_aggregates.QuantileSketch(1)
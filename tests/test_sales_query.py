@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import datetime
+
+import pytest
+
+import db_store
+import property_parser
+import sales_query
+
+COLUMNS = ['File_Name', 'Property_ID', 'District_Code', 'Subburb', 'Post_Code',
+           'Contract_Date', 'Purchase_Price']
+SALES = [
+    {'File_Name': 'A.DAT', 'Property_ID': '1', 'District_Code': '001', 'Subburb': 'PYRMONT',
+     'Post_Code': '2009', 'Contract_Date': '2018/01/15', 'Purchase_Price': '900000'},
+    {'File_Name': 'A.DAT', 'Property_ID': '2', 'District_Code': '001', 'Subburb': 'ULTIMO',
+     'Post_Code': '2007', 'Contract_Date': '1990/11/20', 'Purchase_Price': '85000'},
+    {'File_Name': 'A.DAT', 'Property_ID': '1', 'District_Code': '002', 'Subburb': 'PYRMONT',
+     'Post_Code': '2009', 'Contract_Date': '2018/02/15', 'Purchase_Price': ''},
+    {'File_Name': 'A.DAT', 'Property_ID': '1', 'District_Code': '001', 'Subburb': 'PYRMONT',
+     'Post_Code': '2009', 'Contract_Date': '1991/03/01', 'Purchase_Price': '120000'},
+    {'File_Name': 'A.DAT', 'Property_ID': '9', 'District_Code': '003', 'Subburb': 'HAYMARKET',
+     'Post_Code': '2000', 'Contract_Date': 'N/A', 'Purchase_Price': '50000'}]
+
+LAYOUTS = [
+    ('plain', False),
+    ('plain', True),
+    ('partitioned', False),
+    ('partitioned', True),
+    ('normalised', False),
+    ('normalised', True)
+]
+
+
+def _create_manager(session, layout, typed, commit_max=2, partitions=None):
+    if layout == 'partitioned':
+        return db_store.PartitionedDataManager(session, COLUMNS, commit_max, partitions, typed)
+    if layout == 'normalised':
+        return db_store.NormalisedDataManager(session, commit_max)
+    return db_store.DataManager(session, commit_max)
+
+
+def _typed_sales(sales, typed):
+    sales = [dict(sale) for sale in sales]
+    if typed:
+        for sale in sales:
+            property_parser.convert_fields_to_typed(sale)
+    return sales
+
+
+@pytest.fixture(params=LAYOUTS, ids=lambda layout: '-'.join(map(str, layout)))
+def sales_session(request, tmp_path):
+    layout, typed = request.param
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, partitioned=layout == 'partitioned', typed=typed,
+                        normalised=layout == 'normalised')
+        with database.session_scope() as session:
+            session.info['layout'] = request.param
+            manager = _create_manager(session, layout, typed)
+            manager.enable_query_indexes()
+            with manager:
+                manager.add_property_list(_typed_sales(SALES, typed))
+            yield session
+
+
+def _prices(sales):
+    return [sale['Purchase_Price'] for sale in sales]
+
+
+SALES_FILTERS = [
+    # Sales without a contract date first
+    (sales_query.SalesFilter(), [50000, 85000, 120000, 900000, None]),
+    (sales_query.SalesFilter(start_date=datetime.date(1991, 1, 1)), [120000, 900000, None]),
+    (sales_query.SalesFilter(end_date=datetime.date(1991, 1, 1)), [85000]),
+    (sales_query.SalesFilter(start_date=datetime.date(1990, 11, 20),
+                             end_date=datetime.date(2018, 1, 15)), [85000, 120000, 900000]),
+    (sales_query.SalesFilter(post_code=2009), [120000, 900000, None]),
+    (sales_query.SalesFilter(suburb='ULTIMO'), [85000]),
+    (sales_query.SalesFilter(district_code='002'), [None]),
+    (sales_query.SalesFilter(property_id='1', district_code='001'), [120000, 900000]),
+    (sales_query.SalesFilter(min_price=100000), [120000, 900000]),
+    (sales_query.SalesFilter(min_price=85000, max_price=120000), [85000, 120000]),
+    (sales_query.SalesFilter(suburb='PYRMONT', max_price=500000), [120000]),
+    (sales_query.SalesFilter(suburb='SURRY HILLS'), []),
+]
+@pytest.mark.parametrize('sales_filter, expected_prices', SALES_FILTERS)
+def test_query_sales(sales_session, sales_filter, expected_prices):
+    assert _prices(sales_query.query_sales(sales_session, sales_filter, 1)) == expected_prices
+
+
+def test_query_sales_typed(sales_session):
+    sale = next(sales_query.sales_in_area(sales_session, suburb='ULTIMO'))
+    assert sale['Contract_Date'] == datetime.date(1990, 11, 20)
+    assert sale['Post_Code'] == 2007
+    assert sale['Purchase_Price'] == 85000
+    assert sale['Subburb'] == 'ULTIMO'
+
+
+def test_query_functions(sales_session):
+    assert _prices(sales_query.sales_in_date_range(
+        sales_session, datetime.date(2018, 1, 1), datetime.date(2018, 12, 31))) == [900000, None]
+    assert _prices(sales_query.sales_in_area(sales_session, post_code=2007)) == [85000]
+    assert _prices(sales_query.sales_in_price_band(sales_session, max_price=100000)) == [50000, 85000]
+    assert _prices(sales_query.sales_of_property(sales_session, '2')) == [85000]
+    with pytest.raises(ValueError):
+        sales_query.sales_in_area(sales_session)
+
+
+def test_query_indexes(sales_session):
+    assert db_store.has_query_indexes(sales_session)
+    plan = ' '.join(str(row[-1]) for row in sales_session.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM SalesData WHERE Post_Code = '2009'"))
+    assert 'Post_Code' in plan
+
+
+################################
+# Tests for the repeat sales
+################################
+def test_repeat_sales(sales_session):
+    with pytest.raises(ValueError):
+        sales_query.repeat_sales(sales_session)
+
+    # Enabling builds the repeat sales of the stored sales
+    layout, typed = sales_session.info['layout']
+    manager = _create_manager(sales_session, layout, typed)
+    manager.enable_repeat_sales()
+    pairs = list(sales_query.repeat_sales(sales_session))
+    assert pairs == [sales_query.RepeatSale(
+        '001', '1', 2009, 'PYRMONT', datetime.date(1991, 3, 1), 120000,
+        datetime.date(2018, 1, 15), 900000, 9817, 780000)]
+
+    # A sale arriving out of order is linked in between
+    sale = {'File_Name': 'B.DAT', 'Property_ID': '1', 'District_Code': '001',
+            'Subburb': 'PYRMONT', 'Post_Code': '2009', 'Contract_Date': '2000/03/01',
+            'Purchase_Price': '500000'}
+    with manager:
+        manager.add_property_list(_typed_sales([sale], typed))
+
+    pairs = list(sales_query.repeat_sales(sales_session, post_code=2009))
+    assert [(pair.previous_price, pair.purchase_price, pair.price_delta)
+            for pair in pairs] == [(120000, 500000, 380000), (500000, 900000, 400000)]
+    assert pairs[0].holding_days == 3288
+
+    assert len(list(sales_query.repeat_sales(
+        sales_session, suburb='PYRMONT', start_date=datetime.date(2001, 1, 1)))) == 1
+    assert len(list(sales_query.repeat_sales(
+        sales_session, district_code='002', end_date=datetime.date(2018, 12, 31)))) == 0
+
+
+def test_repeat_sales_reload(tmp_path):
+    with db_store.SqliteDb(str(tmp_path / 'test.sql')) as database:
+        database.create(COLUMNS, partitioned=True)
+        with database.session_scope() as session:
+            manager = db_store.PartitionedDataManager(session, COLUMNS)
+            manager.enable_repeat_sales()
+            with manager:
+                manager.add_property_list([dict(sale) for sale in SALES])
+                # The same sale stored twice is no repeat sale
+                manager.add_property_list([dict(SALES[0])])
+            assert len(list(sales_query.repeat_sales(session))) == 1
+
+            manager.drop_partition('2018')
+            assert list(sales_query.repeat_sales(session)) == []
+
+            manager = db_store.PartitionedDataManager(session, COLUMNS, partitions=['2018'])
+            manager.enable_repeat_sales()
+            with manager:
+                manager.add_property_list([dict(sale) for sale in SALES])
+            pairs = list(sales_query.repeat_sales(session))
+            assert [(pair.previous_price, pair.purchase_price) for pair in pairs] == [
+                (120000, 900000)]
@@ -0,0 +1,375 @@
+"""Test the leased work queue."""
+
+import sqlite3
+import zipfile
+
+import pytest
+import sqlalchemy
+
+import db_store
+import property_data_extractor
+import property_parser
+import work_queue
+
+_ARCHIVE_LINES = [
+    'A;;VALNET1;20150909 11:33;;',
+    'B;011;VALNET1;0145900000000;292674;;;ELDON ST;ABERDEEN;2336;20/11/1990;14500;LOT 7 SEC 22 DP 758003;2365;M;;;A;;;;',
+    'B;011;VALNET1;0145900000000;292675;;;ELDON ST;ABERDEEN;2336;20/11/1991;15500;LOT 9;2365;M;;;A;;;;',
+    'Z;105333;105332;;',
+]
+
+_CURRENT_LINES = [
+    'A;RTSALEDATA;001;20180115 01:15;VALNET;',
+    'B;001;3771736;141;20180115 01:15;;;73 A;KLINE ST;WESTON;2326;802.3;M;20171121;20171219;515000;R2;R;RESIDENCE;;AAN;;0;AN8513;',
+    'C;001;3771736;141;20180115 01:15;928/1209451;',
+    'D;001;3771736;141;20180115 01:15;P;;;;;;',
+    'Z;732;148;148;434;',
+]
+
+
+class FakeClock():
+    """Clock advanced by the tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def queue(tmp_path):
+    clock = FakeClock()
+    with work_queue.WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=10,
+                              max_attempts=2, clock=clock) as work:
+        work.clock = clock
+        yield work
+
+
+#####
+
+
+def test_claim_and_complete(queue):
+    assert queue.add('a.DAT')
+    assert not queue.add('a.DAT')
+    assert queue.add('b.zip', 'b.DAT')
+
+    first = queue.claim('worker-1')
+    second = queue.claim('worker-2')
+    assert (first.path, first.member, first.attempts) == ('a.DAT', '', 1)
+    assert (second.path, second.member) == ('b.zip', 'b.DAT')
+    assert queue.claim('worker-3') is None
+
+    assert not queue.complete(first.id, 'worker-2')
+    assert queue.complete(first.id, 'worker-1')
+    assert queue.counts() == {'pending': 0, 'leased': 1, 'done': 1,
+                              'failed': 0}
+
+
+def test_lease_expiry(queue):
+    queue.add('a.DAT')
+    item = queue.claim('worker-1')
+
+    # The heartbeat keeps the lease
+    queue.clock.now += 8
+    assert queue.heartbeat(item.id, 'worker-1')
+    queue.clock.now += 8
+    assert queue.claim('worker-2') is None
+
+    # The expired lease is claimed by another worker
+    queue.clock.now += 11
+    retry = queue.claim('worker-2')
+    assert (retry.id, retry.attempts) == (item.id, 2)
+    assert not queue.heartbeat(item.id, 'worker-1')
+    assert not queue.complete(item.id, 'worker-1')
+
+    # Failed after max_attempts
+    queue.clock.now += 11
+    assert queue.claim('worker-3') is None
+    assert queue.failed_items() == [retry]
+
+
+def test_archive_done(queue):
+    queue.add('b.zip', 'b.DAT')
+    queue.add('b.zip', 'c.DAT')
+    first = queue.claim('worker-1')
+    second = queue.claim('worker-2')
+    assert queue.complete(first.id, 'worker-1')
+    assert not queue.archive_done('b.zip')
+    assert queue.complete(second.id, 'worker-2')
+    assert queue.archive_done('b.zip')
+
+    # Members not processed completely keep the archive open
+    queue.add('c.zip', 'c.DAT')
+    item = queue.claim('worker-1')
+    assert queue.complete(item.id, 'worker-1', 'Not processed')
+    assert not queue.archive_done('c.zip')
+
+
+def test_fail_and_retry(queue):
+    queue.add('a.DAT')
+    item = queue.claim('worker-1')
+    assert queue.fail(item.id, 'worker-1', 'Error')
+    assert queue.counts()['pending'] == 1
+
+    item = queue.claim('worker-1')
+    assert queue.fail(item.id, 'worker-1', 'Error')
+    assert queue.counts()['failed'] == 1
+    assert queue.claim('worker-1') is None
+
+
+INVALID_QUEUES = [
+    ({'lease_seconds': 0}, '"lease_seconds" must be positive'),
+    ({'max_attempts': 0}, '"max_attempts" must be at least 1'),
+]
+
+
+@pytest.mark.parametrize('values, message', INVALID_QUEUES)
+def test_invalid_queue(tmp_path, values, message):
+    with pytest.raises(ValueError, match=message):
+        work_queue.WorkQueue(str(tmp_path / 'queue.db'), **values)
+
+
+#####
+
+
+def _write_input(tmp_path):
+    """Write a sales file and a zip of a sales file."""
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / '001_SALES_DATA_NNME_15012018.DAT').write_text(
+        '\n'.join(_CURRENT_LINES) + '\n')
+    with zipfile.ZipFile(input_dir / 'archive.zip', 'w') as zip_ref:
+        zip_ref.writestr('ARCHIVE_SALES_1990.DAT',
+                         '\n'.join(_ARCHIVE_LINES) + '\n')
+        zip_ref.writestr('README.txt', 'Not parsed')
+    return input_dir
+
+
+def test_enqueue(tmp_path):
+    input_dir = _write_input(tmp_path)
+    with work_queue.WorkQueue(str(tmp_path / 'queue.db')) as queue:
+        assert work_queue.enqueue(queue, [str(input_dir)]) == 2
+        assert work_queue.enqueue(queue, [str(input_dir)]) == 0
+
+        items = {(item.path, item.member) for item in
+                 iter(lambda: queue.claim('worker'), None)}
+    assert items == {
+        (str(input_dir / '001_SALES_DATA_NNME_15012018.DAT'), ''),
+        (str(input_dir / 'archive.zip'), 'ARCHIVE_SALES_1990.DAT')}
+
+
+def _config(db_path, **values):
+    return property_data_extractor.IngestConfig(
+        input_paths=[], output_path=str(db_path), **values)
+
+
+def _sales_count(db_path):
+    with sqlite3.connect(str(db_path)) as conn:
+        return conn.execute('SELECT COUNT(*) FROM SalesData').fetchone()[0]
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_workers_and_merge(tmp_path, typed):
+    input_dir = _write_input(tmp_path)
+    queue_path = str(tmp_path / 'queue.db')
+    with work_queue.WorkQueue(queue_path, lease_seconds=0.2) as queue:
+        work_queue.enqueue(queue, [str(input_dir)])
+        # A crashed worker left a lease, it is retried after expiring
+        queue.claim('crashed')
+
+    first = work_queue.run_worker(
+        queue_path, _config(tmp_path / 'shard_1.sql', typed=typed),
+        'worker-1', lease_seconds=0.2, poll_seconds=0.05)
+    second = work_queue.run_worker(
+        queue_path, _config(tmp_path / 'shard_2.sql', typed=typed),
+        'worker-2', lease_seconds=0.2, poll_seconds=0.05)
+
+    assert (first.files_processed, second.files_processed) == (2, 0)
+    assert first.property_count == 3
+    with work_queue.WorkQueue(queue_path) as queue:
+        assert queue.counts()['done'] == 2
+
+    summary = work_queue.merge_shards(
+        _config(tmp_path / 'result.sql', typed=typed),
+        [str(tmp_path / 'shard_1.sql'), str(tmp_path / 'shard_2.sql')])
+    assert summary.property_count == 3
+    assert _sales_count(tmp_path / 'result.sql') == 3
+
+    with sqlite3.connect(str(tmp_path / 'result.sql')) as conn:
+        files = conn.execute(
+            'SELECT file.full_path, file.processed, archive.full_path '
+            'FROM scanned_file file LEFT JOIN scanned_file archive '
+            'ON archive.id = file.extracted_from_id').fetchall()
+    archive_path = str(input_dir / 'archive.zip')
+    # The archive is processed with its last member
+    assert sorted(files) == sorted([
+        (str(input_dir / '001_SALES_DATA_NNME_15012018.DAT'), 1, None),
+        (archive_path, 1, None),
+        (archive_path + '/ARCHIVE_SALES_1990.DAT', 1, archive_path)])
+
+
+def test_merge_shards_dedup(tmp_path):
+    input_dir = _write_input(tmp_path)
+    for shard in ['shard_1.sql', 'shard_2.sql']:
+        with work_queue.WorkQueue(str(tmp_path / (shard + '.queue'))) as queue:
+            work_queue.enqueue(queue, [str(input_dir)])
+        work_queue.run_worker(str(tmp_path / (shard + '.queue')),
+                              _config(tmp_path / shard), 'worker')
+
+    summary = work_queue.merge_shards(
+        _config(tmp_path / 'result.sql', dedup=True),
+        [str(tmp_path / 'shard_1.sql'), str(tmp_path / 'shard_2.sql')])
+    assert summary.files_processed == 2
+    assert _sales_count(tmp_path / 'result.sql') == 3
+
+
+def test_merge_shards_typed_mismatch(tmp_path):
+    input_dir = _write_input(tmp_path)
+    queue_path = str(tmp_path / 'queue.db')
+    with work_queue.WorkQueue(queue_path) as queue:
+        work_queue.enqueue(queue, [str(input_dir)])
+    work_queue.run_worker(queue_path, _config(tmp_path / 'shard.sql'))
+
+    with pytest.raises(ValueError, match='different column types'):
+        work_queue.merge_shards(_config(tmp_path / 'result.sql', typed=True),
+                                [str(tmp_path / 'shard.sql')])
+
+
+@pytest.mark.parametrize('layout', [{}, {'partitioned': True}, {'normalised': True}])
+def test_merge_shards_layouts(tmp_path, layout):
+    input_dir = _write_input(tmp_path)
+    queue_path = str(tmp_path / 'queue.db')
+    with work_queue.WorkQueue(queue_path) as queue:
+        work_queue.enqueue(queue, [str(input_dir)])
+    work_queue.run_worker(queue_path, _config(tmp_path / 'shard.sql', bulk_load=True))
+
+    summary = work_queue.merge_shards(_config(tmp_path / 'result.sql', **layout),
+                                      [str(tmp_path / 'shard.sql')])
+    assert (summary.files_processed, summary.property_count) == (2, 3)
+    assert _sales_count(tmp_path / 'result.sql') == 3
+
+    # Merging again keeps the scanned files once
+    summary = work_queue.merge_shards(_config(tmp_path / 'result.sql'),
+                                      [str(tmp_path / 'shard.sql')])
+    assert summary.files_processed == 0
+    with sqlite3.connect(str(tmp_path / 'result.sql')) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM scanned_file').fetchone() == (3,)
+
+
+def test_merge_shard_detaches(tmp_path):
+    input_dir = _write_input(tmp_path)
+    queue_path = str(tmp_path / 'queue.db')
+    with work_queue.WorkQueue(queue_path) as queue:
+        work_queue.enqueue(queue, [str(input_dir)])
+    work_queue.run_worker(queue_path, _config(tmp_path / 'shard.sql'))
+    shard_path = str(tmp_path / 'shard.sql')
+    result_path = str(tmp_path / 'result.sql')
+    with db_store.SqliteDb(result_path) as database:
+        database.create(property_data_extractor.get_csv_keys(None))
+
+    # The attached databases outlive the transactions of a pooled connection
+    engine = sqlalchemy.create_engine(
+        'sqlite:///' + result_path, poolclass=sqlalchemy.pool.StaticPool)
+    session = sqlalchemy.orm.sessionmaker(bind=engine)()
+    data_manager = db_store.DataManager(session)
+    assert data_manager.merge_shard(shard_path) == (2, 3)
+    assert data_manager.merge_shard(shard_path) == (0, 3)
+    copy_path = str(tmp_path / 'copy.sql')
+    with db_store.SqliteDb(copy_path) as database:
+        database.create(property_data_extractor.get_csv_keys(None))
+    copy_session = sqlalchemy.orm.sessionmaker(bind=sqlalchemy.create_engine(
+        'sqlite:///' + copy_path, poolclass=sqlalchemy.pool.StaticPool))()
+    db_store.copy_scanned_files(copy_session, result_path)
+    for attached, schema in [(session, 'shard'), (copy_session, 'source')]:
+        assert schema not in [row[1] for row in attached.execute(
+            sqlalchemy.text('PRAGMA database_list'))]
+        attached.close()
+    assert _sales_count(tmp_path / 'result.sql') == 6
+
+
+def test_ingest_sharded(tmp_path):
+    input_dir = _write_input(tmp_path)
+    (input_dir / 'broken.zip').write_bytes(b'not a zip file')
+    db_path = tmp_path / 'result.sql'
+    config = property_data_extractor.IngestConfig(
+        input_paths=[str(input_dir)], output_path=str(db_path), shard_workers=2)
+
+    summary = property_data_extractor.ingest(config)
+    assert summary.files_processed == 2
+    assert summary.property_count == 3
+    assert _sales_count(db_path) == 3
+    assert not (tmp_path / 'result.sql.shards').exists()
+
+    # The shards are seeded with the processed files of the result
+    summary = property_data_extractor.ingest(config)
+    assert (summary.files_processed, summary.files_skipped) == (0, 2)
+    assert _sales_count(db_path) == 3
+
+
+def test_ingest_sharded_aborted_member(tmp_path):
+    input_dir = _write_input(tmp_path)
+    with zipfile.ZipFile(input_dir / 'archive.zip', 'a') as zip_ref:
+        zip_ref.writestr('ARCHIVE_SALES_1991.DAT', 'B;011;VALNET1\nB;011;VALNET2\n')
+    db_path = tmp_path / 'result.sql'
+    summary = property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[str(input_dir)], output_path=str(db_path), shard_workers=2,
+        quarantine=True, max_line_errors=1))
+    assert (summary.files_processed, summary.files_aborted) == (2, 1)
+
+    # The archive is parsed again by the next run
+    with sqlite3.connect(str(db_path)) as conn:
+        assert conn.execute('SELECT processed FROM scanned_file WHERE full_path = ?',
+                            (str(input_dir / 'archive.zip'),)).fetchone() == (0,)
+
+
+def test_ingest_sharded_cleanup(tmp_path, monkeypatch):
+    input_dir = _write_input(tmp_path)
+    db_path = tmp_path / 'result.sql'
+    config = property_data_extractor.IngestConfig(
+        input_paths=[str(input_dir)], output_path=str(db_path), shard_workers=2)
+
+    def _fail(*_):
+        raise RuntimeError('Merge failed')
+    monkeypatch.setattr(work_queue, 'merge_shards', _fail)
+    with pytest.raises(RuntimeError, match='Merge failed'):
+        property_data_extractor.ingest(config)
+    assert not (tmp_path / 'result.sql.shards').exists()
+
+    # Shards of a killed ingestion are not merged
+    (tmp_path / 'result.sql.shards').mkdir()
+    with pytest.raises(ValueError, match='of an interrupted ingestion exists'):
+        property_data_extractor.ingest(config)
+
+
+def test_ingest_sharded_columns(tmp_path):
+    input_dir = _write_input(tmp_path)
+    db_path = tmp_path / 'result.sql'
+    # The result stores all columns, the shards the projection only
+    (tmp_path / 'empty').mkdir()
+    property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[str(tmp_path / 'empty')], output_path=str(db_path)))
+
+    summary = property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[str(input_dir)], output_path=str(db_path), shard_workers=2,
+        columns=['Property_ID', 'Purchase_Price'],
+        record_filter=property_parser.RecordFilter(district_codes=frozenset(['011']))))
+    assert (summary.property_count, summary.lines_filtered) == (2, 1)
+    with sqlite3.connect(str(db_path)) as conn:
+        assert sorted(conn.execute('SELECT Property_ID, Purchase_Price, Post_Code FROM SalesData')) == [
+            ('292674', '14500', None), ('292675', '15500', None)]
+
+
+def test_ingest_sharded_quarantine(tmp_path):
+    input_dir = _write_input(tmp_path)
+    with open(input_dir / '001_SALES_DATA_NNME_15012018.DAT', 'a') as file:
+        file.write('B;001;3771737\n')
+    db_path = tmp_path / 'result.sql'
+
+    summary = property_data_extractor.ingest(property_data_extractor.IngestConfig(
+        input_paths=[str(input_dir)], output_path=str(db_path), shard_workers=2,
+        quarantine=True))
+    assert summary.lines_quarantined == 1
+    with sqlite3.connect(str(db_path)) as conn:
+        assert conn.execute('SELECT File_Name, Line_No FROM QuarantinedLine').fetchall() == [
+            ('001_SALES_DATA_NNME_15012018.DAT', 6)]